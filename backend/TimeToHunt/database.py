@@ -0,0 +1,44 @@
+"""
+SQLiteの接続設定プロファイル
+
+TIMETOHUNT_DB_PROFILE=production のとき、接続ごとにWALなどのPRAGMAを設定し、接続を使い回し、
+トランザクションをBEGIN IMMEDIATEで始める。WALでは読み取りが書き込みを待たず、IMMEDIATEでは
+読み取りから書き込みへの昇格時にロック待ちをせず即座に失敗する事態（SQLITE_BUSY）を避けられる。
+"""
+
+PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,        # ミリ秒
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,    # 負の値はKiB単位
+    'temp_store': 'MEMORY',
+}
+
+PROFILES = ('development', 'production')
+
+
+def init_command(pragmas):
+    return '; '.join(f'PRAGMA {name}={value}' for name, value in pragmas.items())
+
+
+def sqlite_database(name, profile='development'):
+    """DATABASES['default'] に設定する辞書"""
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown database profile {profile!r}; use one of {", ".join(PROFILES)}.')
+
+    database = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+    }
+    if profile == 'production':
+        database.update({
+            # ASGIではリクエストごとにスレッドが変わるため、使い回しが効くのはWSGIで動かす場合
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'init_command': init_command(PRODUCTION_PRAGMAS),
+                'transaction_mode': 'IMMEDIATE',
+            },
+        })
+    return database
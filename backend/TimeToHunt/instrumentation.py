@@ -0,0 +1,215 @@
+"""
+リクエストごとのSQL・レイテンシ計測
+
+TIMETOHUNT_INSTRUMENTATION['ENABLED'] が偽のときはミドルウェアの初期化時にMiddlewareNotUsedを
+送出するので、リクエスト処理の経路には一切入らない。
+
+有効な場合は各リクエストについて次を行う。
+- 経過時間・DB時間・クエリ数・重複クエリ数をServer-Timingヘッダで返す
+- SLOW_REQUEST_MSを超えたリクエストを、繰り返し発行されたSQLの上位とともにログに出す
+- ビューごとのレイテンシのヒストグラムを集計し、メトリクスエンドポイントで返す
+"""
+import bisect
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, JsonResponse
+
+logger = logging.getLogger('TimeToHunt.instrumentation')
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SLOW_REQUEST_MS': 500,
+    'TOP_QUERIES': 5,
+    'BUCKETS_MS': [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000],
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'TIMETOHUNT_INSTRUMENTATION', {}).get(name, DEFAULTS[name])
+
+
+class QueryRecorder:
+    """connection.execute_wrapper() に渡して発行されたSQLと所要時間を記録する"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.durations = defaultdict(float)
+        self.exact = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            self.statements[sql] += 1
+            self.durations[sql] += elapsed
+            self.exact[sql, repr(params)] += 1
+
+    @property
+    def duplicates(self):
+        """同じSQLを同じパラメータで発行し直した回数"""
+        return sum(n - 1 for n in self.exact.values())
+
+    def top_repeated(self, limit):
+        """繰り返し発行されたSQLを回数の多い順に [(回数, 合計ms, SQL), ...] で返す"""
+        return [
+            (n, round(self.durations[sql] * 1000, 3), sql)
+            for sql, n in self.statements.most_common(limit)
+            if n > 1
+        ]
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.db_ms = 0.0
+        self.queries = 0
+        self.max_ms = 0.0
+
+    def observe(self, total_ms, db_ms, queries):
+        self.buckets[bisect.bisect_left(self.bounds, total_ms)] += 1
+        self.count += 1
+        self.total_ms += total_ms
+        self.db_ms += db_ms
+        self.queries += queries
+        self.max_ms = max(self.max_ms, total_ms)
+
+    def as_dict(self):
+        labels = [f'le_{bound}' for bound in self.bounds] + ['le_inf']
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0,
+            'max_ms': round(self.max_ms, 3),
+            'mean_db_ms': round(self.db_ms / self.count, 3) if self.count else 0,
+            'mean_queries': round(self.queries / self.count, 2) if self.count else 0,
+            'buckets': dict(zip(labels, self.buckets)),
+        }
+
+
+class Metrics:
+    """ビューごとのヒストグラム（プロセス内で集計する）"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, total_ms, db_ms, queries):
+        with self._lock:
+            histogram = self._histograms.get(view)
+            if histogram is None:
+                histogram = self._histograms[view] = Histogram(get_setting('BUCKETS_MS'))
+            histogram.observe(total_ms, db_ms, queries)
+
+    def snapshot(self):
+        with self._lock:
+            return {view: histogram.as_dict() for view, histogram in sorted(self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+metrics = Metrics()
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return f'{request.method} {match.view_name if match else "<unresolved>"}'
+
+
+class RequestInstrumentationMiddleware:
+    """リクエストごとの経過時間・DB時間・クエリ数を計測する"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_setting('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_ms = get_setting('SLOW_REQUEST_MS')
+        self.top_queries = get_setting('TOP_QUERIES')
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def install(recorder):
+        for connection in connections.all():
+            connection.execute_wrappers.append(recorder)
+
+    @staticmethod
+    def uninstall(recorder):
+        for connection in connections.all():
+            connection.execute_wrappers.remove(recorder)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        self.install(recorder)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.uninstall(recorder)
+        self.finish(request, response, time.perf_counter() - started, recorder)
+        return response
+
+    async def __acall__(self, request):
+        # 同期のORM呼び出しはリクエストごとに同じスレッドで実行されるので、そのスレッドの接続に仕掛ける
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        await sync_to_async(self.install)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(self.uninstall)(recorder)
+        self.finish(request, response, time.perf_counter() - started, recorder)
+        return response
+
+    def finish(self, request, response, elapsed, recorder):
+        total_ms = elapsed * 1000
+        db_ms = recorder.duration * 1000
+        duplicates = recorder.duplicates
+        response['Server-Timing'] = ', '.join([
+            f'total;dur={total_ms:.1f}',
+            f'db;dur={db_ms:.1f};desc="{recorder.count} queries"',
+            f'dup;desc="{duplicates} duplicate queries"',
+        ])
+
+        view = view_label(request)
+        metrics.observe(view, total_ms, db_ms, recorder.count)
+
+        if total_ms >= self.slow_ms:
+            lines = [
+                f'  {n}x {ms}ms {sql}' for n, ms, sql in recorder.top_repeated(self.top_queries)
+            ]
+            logger.warning(
+                'Slow request %s %s (%s): %.1fms, db %.1fms, %d queries, %d duplicates%s',
+                request.method, request.path, view, total_ms, db_ms, recorder.count, duplicates,
+                ''.join('\n' + line for line in lines),
+            )
+
+
+def metrics_view(request):
+    """ビューごとのヒストグラム（計測が有効で、ALLOWED_IPSからのアクセスのみ）"""
+    if not get_setting('ENABLED') or request.META.get('REMOTE_ADDR') not in get_setting('ALLOWED_IPS'):
+        raise Http404
+    return JsonResponse({'views': metrics.snapshot()})
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .database import sqlite_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'TimeToHunt.instrumentation.RequestInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -77,11 +81,12 @@ WSGI_APPLICATION = 'TimeToHunt.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# 本番ではTIMETOHUNT_DB_PROFILE=productionでWAL・接続の使い回し・BEGIN IMMEDIATEを有効にする
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': sqlite_database(
+        BASE_DIR / 'db.sqlite3',
+        os.environ.get('TIMETOHUNT_DB_PROFILE', 'development'),
+    ),
 }
 
 
@@ -144,3 +149,68 @@ CORS_ALLOW_METHODS = [
     'POST',
     'PUT',
 ]
+
+# Gameの変更配信（/api/events/）
+TIMETOHUNT_EVENTS = {
+    'BACKEND': 'api.events.LocalBackend',
+    'QUEUE_SIZE': 100,
+    'HEARTBEAT': 15,  # 秒
+}
+
+# 一覧APIのページング（?cursor= または ?page_size= 指定時のみ有効）
+TIMETOHUNT_PAGINATION = {
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 1000,
+}
+
+# Genus/Speciesの読み取りキャッシュ（複数プロセスで共有する場合は api.cache.DjangoCacheBackend）
+TIMETOHUNT_READ_CACHE = {
+    'ENABLED': True,
+    'BACKEND': 'api.cache.LocMemLRUBackend',
+    'OPTIONS': {'max_entries': 1024},
+}
+
+# リクエストごとのSQL・レイテンシ計測（無効時はミドルウェアごと外れる）
+TIMETOHUNT_INSTRUMENTATION = {
+    'ENABLED': False,
+    'SLOW_REQUEST_MS': 500,
+    'TOP_QUERIES': 5,
+    'BUCKETS_MS': [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000],
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],  # /internal/metrics/ を見られる接続元
+}
+
+# 捕獲実績からの推定所要時間の学習（Species.auto_update_estimateが有効な種は自動で更新する）
+TIMETOHUNT_ESTIMATION = {
+    'ALPHA': 0.3,
+    'QUANTILE': 0.75,
+    'MIN_SAMPLES': 5,
+    'SUGGEST': 'quantile',  # 'quantile' または 'ewma'
+}
+
+# 終了済みGameの木のアーカイブ（manage.py archive_games、または下の定期実行）
+TIMETOHUNT_ARCHIVE = {
+    'RETENTION_DAYS': 30,
+    'BATCH_SIZE': 200,  # 1トランザクションでアーカイブする木の数
+}
+
+# 期限切れGameの掃き出し（manage.py expire_games、または下の定期実行）
+TIMETOHUNT_EXPIRY = {
+    'TRANSITION': 'OVERDUE',  # 'OVERDUE'（印を付けるだけ）または 'ESCAPED'（葉を見失ったことにする）
+    'STATUSES': ['NOT_STARTED', 'PENDING'],
+    'BATCH_SIZE': 500,
+}
+
+# 複数日のタイムライン（GET /api/games/timeline/）
+TIMETOHUNT_TIMELINE = {
+    'AVAILABLE_HOURS': 8,  # 1日に使える時間（予定の負荷と比べる）
+    'MAX_DAYS': 31,
+}
+
+# プロセス内の定期実行（有効にするのは1つのサーバープロセスだけにすること）
+TIMETOHUNT_SCHEDULER = {
+    'ENABLED': False,
+    'JOBS': {
+        'api.archive.run_scheduled': 60 * 60,  # 秒
+        'api.expiry.run_scheduled': 5 * 60,
+    },
+}
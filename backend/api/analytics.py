@@ -0,0 +1,235 @@
+"""
+推定所要時間の精度の集計
+
+葉のGameが捕獲完了(CAPTURED)・見失う(ESCAPED)になった時点で、そのGameの寄与を種・期間(日/週/月)・
+期間の開始日ごとの集計行(EstimateRollup)へ加算する。編集・削除では変更前の寄与を引いてから
+変更後の寄与を足すので、集計行は常にGameの現在の状態と一致する。
+ダッシュボードは集計行だけを読み、Gameのテーブルは走査しない。
+
+超過時間（実績 - 終了時点の推定）は分単位の固定の区間でヒストグラムに数えるので、
+複数の行を足し合わせてからパーセンタイルを求められる。
+"""
+import bisect
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache
+
+FINISHED = ('CAPTURED', 'ESCAPED')
+PERIODS = ('day', 'week', 'month')
+
+# 超過時間のヒストグラムの区間の上限（分）。最後の区間はこれより大きいもの
+OVERRUN_BUCKETS = [-60, -30, -15, -5, 0, 5, 15, 30, 60, 120]
+
+# 寄与の計算に使うGameの列
+GAME_COLUMNS = ('species_id', 'status', 'hunt_start_time', 'actual_hunting_time', 'finished_estimate')
+
+Contribution = namedtuple('Contribution', ['species_id', 'date', 'status', 'actual', 'overrun'])
+
+# 分位点が入る区間の上限（分）。open_endedなら最後の区間で、minutesはその下限（これより大きい）
+Quantile = namedtuple('Quantile', ['minutes', 'open_ended'])
+
+
+def empty_histogram():
+    return [0] * (len(OVERRUN_BUCKETS) + 1)
+
+
+def bucket_start(period, date):
+    """dateを含む期間の開始日"""
+    if period == 'day':
+        return date
+    if period == 'week':
+        return date - timedelta(days=date.weekday())
+    if period == 'month':
+        return date.replace(day=1)
+    raise ValueError(f'Unknown period {period!r}')
+
+
+def overrun_bucket(overrun):
+    return bisect.bisect_left(OVERRUN_BUCKETS, overrun / timedelta(minutes=1))
+
+
+def game_values(game, loaded=False):
+    """寄与の計算に使う値（loadedなら読み込み時点の値）"""
+    if loaded:
+        if not game._loaded_values:
+            return None
+        return {name: game._loaded_values.get(name, getattr(game, name)) for name in GAME_COLUMNS}
+    return {name: getattr(game, name) for name in GAME_COLUMNS}
+
+
+def contribution(values):
+    """終了した葉のGameの集計への寄与（集計対象でなければNone）"""
+    if not values or values['status'] not in FINISHED or values['finished_estimate'] is None:
+        return None
+    actual, estimate = values['actual_hunting_time'], values['finished_estimate']
+    overrun = actual - estimate if actual is not None else None
+    return Contribution(
+        species_id=values['species_id'],
+        date=timezone.localdate(values['hunt_start_time']),
+        status=values['status'],
+        actual=actual,
+        overrun=overrun,
+    )
+
+
+class Delta:
+    def __init__(self):
+        self.count = self.captured = self.escaped = self.timed = 0
+        self.total_actual = timedelta()
+        self.total_overrun = timedelta()
+        self.histogram = empty_histogram()
+
+    def add(self, item, sign):
+        self.count += sign
+        if item.status == 'CAPTURED':
+            self.captured += sign
+        else:
+            self.escaped += sign
+        if item.actual is not None:
+            self.total_actual += sign * item.actual
+        if item.overrun is not None:
+            self.timed += sign
+            self.total_overrun += sign * item.overrun
+            self.histogram[overrun_bucket(item.overrun)] += sign
+
+    def apply_to(self, row):
+        row.count += self.count
+        row.captured += self.captured
+        row.escaped += self.escaped
+        row.timed += self.timed
+        row.total_actual += self.total_actual
+        row.total_overrun += self.total_overrun
+        row.overrun_histogram = [a + b for a, b in zip(row.overrun_histogram, self.histogram)]
+
+    def __bool__(self):
+        return bool(self.count or self.timed or self.total_actual or any(self.histogram))
+
+
+def record(changes):
+    """
+    Gameの変更 [(変更前の値, 変更後の値), ...] を集計行へ反映
+
+    値はgame_values()の形式で、作成・削除ではそれぞれ変更前・変更後をNoneにする。
+    """
+    from .models import EstimateRollup
+
+    deltas = defaultdict(Delta)
+    for before, after in changes:
+        old, new = contribution(before), contribution(after)
+        if old == new:
+            continue
+        for item, sign in ((old, -1), (new, 1)):
+            if item is None:
+                continue
+            for period in PERIODS:
+                deltas[item.species_id, period, bucket_start(period, item.date)].add(item, sign)
+
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        species_ids = {species_id for species_id, _, _ in deltas}
+        starts = {start for _, _, start in deltas}
+        rows = {
+            (row.species_id, row.period, row.bucket_start): row
+            for row in EstimateRollup.objects.filter(species_id__in=species_ids, bucket_start__in=starts)
+        }
+        created, updated, emptied = [], [], []
+        for (species_id, period, start), delta in deltas.items():
+            row = rows.get((species_id, period, start))
+            if row is None:
+                row = EstimateRollup(species_id=species_id, period=period, bucket_start=start)
+                created.append(row)
+            else:
+                updated.append(row)
+            delta.apply_to(row)
+            if not row.count and row.pk:
+                emptied.append(row.pk)
+
+        # 行のない期間から引く寄与は、同じ削除で集計行ごと消えたものなので無視する
+        EstimateRollup.objects.bulk_create([row for row in created if row.count > 0], batch_size=500)
+        EstimateRollup.objects.bulk_update(
+            [row for row in updated if row.count],
+            ['count', 'captured', 'escaped', 'timed', 'total_actual', 'total_overrun', 'overrun_histogram'],
+            batch_size=500,
+        )
+        EstimateRollup.objects.filter(pk__in=emptied).delete()
+        cache.invalidate('analytics')
+
+
+def rebuild():
+    """集計行をGame・ArchivedGameから作り直す（修復用）"""
+    from .models import ArchivedGame, EstimateRollup, Game
+
+    with transaction.atomic():
+        EstimateRollup.objects.all().delete()
+        # アーカイブ済みのGameも集計に含める
+        batch = []
+        for model in (Game, ArchivedGame):
+            finished = model.objects.filter(status__in=FINISHED, finished_estimate__isnull=False)
+            for values in finished.values(*GAME_COLUMNS).iterator(chunk_size=2000):
+                batch.append((None, values))
+                if len(batch) == 2000:
+                    record(batch)
+                    batch = []
+        record(batch)
+        return EstimateRollup.objects.count()
+
+
+def percentile(histogram, p):
+    """ヒストグラムからp分位点が入る区間をQuantileで求める（空ならNone）"""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank, cumulative = p * total, 0
+    for i, n in enumerate(histogram):
+        cumulative += n
+        if cumulative >= rank and n:
+            if i < len(OVERRUN_BUCKETS):
+                return Quantile(OVERRUN_BUCKETS[i], False)
+            return Quantile(OVERRUN_BUCKETS[-1], True)
+    return None
+
+
+def summarize(rows, key):
+    """
+    集計行をkey(row)ごとに足し合わせ、レポートの行を返す
+
+    属の集計は属に含まれる種の行を、種の部分木の集計は部分木の種の行を足し合わせる。
+    """
+    groups = {}
+    for row in rows:
+        group = groups.get(key(row))
+        if group is None:
+            group = groups[key(row)] = {
+                'count': 0, 'captured': 0, 'escaped': 0, 'timed': 0,
+                'total_actual': timedelta(), 'total_overrun': timedelta(),
+                'histogram': empty_histogram(),
+            }
+        for name in ('count', 'captured', 'escaped', 'timed', 'total_actual', 'total_overrun'):
+            group[name] += getattr(row, name)
+        group['histogram'] = [a + b for a, b in zip(group['histogram'], row.overrun_histogram)]
+
+    report = []
+    for group_key, group in groups.items():
+        p50, p90 = percentile(group['histogram'], 0.5), percentile(group['histogram'], 0.9)
+        report.append({
+            **dict(group_key),
+            'count': group['count'],
+            'captured': group['captured'],
+            'escaped': group['escaped'],
+            'capture_rate': group['captured'] / group['count'],
+            'escape_rate': group['escaped'] / group['count'],
+            'total_actual': group['total_actual'],
+            'mean_overrun': group['total_overrun'] / group['timed'] if group['timed'] else None,
+            'overrun_p50': None if p50 is None else timedelta(minutes=p50.minutes),
+            'overrun_p50_open': p50 is not None and p50.open_ended,
+            'overrun_p90': None if p90 is None else timedelta(minutes=p90.minutes),
+            'overrun_p90_open': p90 is not None and p90.open_ended,
+        })
+    return report
@@ -0,0 +1,111 @@
+"""
+終了済みGameの木のアーカイブ
+
+保存期間より前に始まり、木の全てのGameが終了(CAPTURED/ESCAPED)した木を、精度の集計と復元に
+必要な列だけを持つArchivedGameへ移す。Gameの行単位の受信処理は止めて行うので、
+精度の集計（アーカイブ後もそのまま残す）は引かれず、配信もアーカイブした根ごとにまとめて行う。
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache, events, receivers
+from .analytics import FINISHED
+from .models import ArchivedGame, Game
+
+DEFAULTS = {
+    'RETENTION_DAYS': 30,
+    'BATCH_SIZE': 200,
+}
+
+COLUMNS = (
+    'id', 'parent_game_id', 'owner_id', 'species_id', 'status',
+    'hunt_start_time', 'deadline', 'actual_hunting_time', 'finished_estimate',
+)
+
+
+def get_setting(name):
+    return getattr(settings, 'TIMETOHUNT_ARCHIVE', {}).get(name, DEFAULTS[name])
+
+
+def collect_trees(root_ids):
+    """根ごとの木の全行を段ごとに取得し、(行のリスト, pk→根のpk) を返す"""
+    rows, root_of = [], {}
+    level = list(Game.objects.filter(pk__in=root_ids).values(*COLUMNS))
+    for row in level:
+        root_of[row['id']] = row['id']
+    while level:
+        rows.extend(level)
+        level = list(Game.objects.filter(parent_game_id__in=[row['id'] for row in level]).values(*COLUMNS))
+        for row in level:
+            root_of[row['id']] = root_of[row['parent_game_id']]
+    return rows, root_of
+
+
+def _archive_batch(root_ids, dry_run):
+    rows, root_of = collect_trees(root_ids)
+    # 根が終了していても、見失った子の横に未着手のGameが残っている木は対象外
+    unfinished = {root_of[row['id']] for row in rows if row['status'] not in FINISHED}
+    rows = [row for row in rows if root_of[row['id']] not in unfinished]
+    roots = sorted({root_of[row['id']] for row in rows})
+    if dry_run or not rows:
+        return len(roots), len(rows)
+
+    with transaction.atomic(), receivers.suspended('game'):
+        ArchivedGame.objects.bulk_create(
+            [ArchivedGame(root_id=root_of[row['id']], **row) for row in rows], batch_size=500,
+        )
+        Game.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+        cache.invalidate('game')
+        # 所有者ごとにまとめて配信する
+        owners = {row['id']: row['owner_id'] for row in rows if row['id'] == root_of[row['id']]}
+        for owner in set(owners.values()):
+            events.publish('game.archived', {'roots': [pk for pk in roots if owners[pk] == owner]}, owner)
+    return len(roots), len(rows)
+
+
+def archive_games(before=None, batch_size=None, dry_run=False):
+    """beforeより前に始まった終了済みの木をアーカイブし、(木の数, Gameの数) を返す"""
+    before = before or timezone.now() - timedelta(days=get_setting('RETENTION_DAYS'))
+    batch_size = batch_size or get_setting('BATCH_SIZE')
+    candidates = Game.objects.filter(
+        parent_game__isnull=True, status__in=FINISHED, hunt_start_time__lt=before,
+    ).order_by('pk').values_list('pk', flat=True)
+
+    trees = games = 0
+    last = 0
+    while True:
+        # 1バッチごとにコミットし、書き込みロックを長く持ち続けない
+        root_ids = list(candidates.filter(pk__gt=last)[:batch_size])
+        if not root_ids:
+            break
+        last = root_ids[-1]
+        archived_trees, archived_games = _archive_batch(root_ids, dry_run)
+        trees += archived_trees
+        games += archived_games
+    return trees, games
+
+
+def restore_tree(root_id):
+    """アーカイブした木を元のpkのままGameへ戻し、根のGameを返す"""
+    archived = list(ArchivedGame.objects.filter(root_id=root_id).order_by('id'))
+    if not archived:
+        raise ArchivedGame.DoesNotExist(f'No archived game tree with root {root_id}.')
+
+    with transaction.atomic(), receivers.suspended('game'):
+        Game.objects.bulk_create([
+            Game(**{name: getattr(row, name) for name in COLUMNS}) for row in archived
+        ], batch_size=500)
+        ArchivedGame.objects.filter(root_id=root_id).delete()
+        cache.invalidate('game')
+        events.publish('game.restored', {
+            'id': root_id, 'descendants': [row.id for row in archived if row.id != root_id],
+        }, archived[0].owner_id)
+    return Game.objects.get(pk=root_id)
+
+
+def run_scheduled():
+    """定期実行用（保存期間は設定値）"""
+    return archive_games()
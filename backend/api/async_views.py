@@ -0,0 +1,59 @@
+"""
+よく読まれるエンドポイントの非同期版（ASGIで動かすこと）
+
+同期版のViewSetと同じクエリの組み立て・Serializerを使い、DBの読み取りだけをasync ORMで待つ。
+読み込む行は関連を結合・注釈済みなので、シリアライズ中に追加のクエリは発行しない。
+?cursor= によるページングと読み取りキャッシュには対応しない（同期版を使うこと）。
+"""
+from functools import partial
+
+from django.http import JsonResponse
+from rest_framework.exceptions import ValidationError
+
+from .cache import etag_response
+from .models import Genus, Species, Game
+from .serializers import GameSerializer, SpeciesSerializer, serialize_species_tree
+from .views import filter_games
+
+
+def not_found(detail='Not found.'):
+    return JsonResponse({'detail': detail}, status=404)
+
+
+async def active_game(request):
+    """現在アクティブなゲーム（active_game/ の非同期版）"""
+    games = Game.objects.owned_by(await request.auser()).for_serialization()
+    game = await games.filter(is_active=True).order_by().afirst()
+    if game is None:
+        return not_found('No active game found.')
+    return JsonResponse(GameSerializer(game).data)
+
+
+async def games(request):
+    """ゲームの一覧（games/?date= などの非同期版）"""
+    queryset = Game.objects.owned_by(await request.auser()).for_serialization()
+    try:
+        queryset = filter_games(queryset, request.GET)
+    except ValidationError as e:
+        return JsonResponse(e.detail, status=400)
+    return JsonResponse(GameSerializer([game async for game in queryset], many=True).data, safe=False)
+
+
+async def species_tree(request, pk):
+    """子孫を含む部分木（species/<pk>/tree/ の非同期版）"""
+    species = await Species.objects.owned_by(await request.auser()).filter(pk=pk).afirst()
+    if species is None:
+        return not_found()
+    subtree = Species.objects.subtree_of(species).for_serialization().order_by('depth', 'pk')
+    return etag_response(
+        request, serialize_species_tree([row async for row in subtree])[0], partial(JsonResponse, safe=False),
+    )
+
+
+async def genus_species(request, pk):
+    """属に属する種（genera/<pk>/species/ の非同期版）"""
+    genus = await Genus.objects.owned_by(await request.auser()).filter(pk=pk).afirst()
+    if genus is None:
+        return not_found()
+    species = Species.objects.filter(genus=genus).for_serialization().order_by('pk')
+    return JsonResponse(SpeciesSerializer([row async for row in species], many=True).data, safe=False)
@@ -0,0 +1,261 @@
+"""
+APIのホットパスのベンチマーク
+
+各シナリオは準備（計測対象外）を済ませてから (method, path, data) を返し、ランナーがその
+リクエストのレイテンシとクエリ数を計測する。データ生成から計測までを1つのトランザクションの
+中で行って最後にロールバックするので、実行中のDBを汚さない。
+"""
+import os
+import platform
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+import django
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from TimeToHunt.database import PRODUCTION_PRAGMAS
+
+from . import datagen
+from .models import Species, Game
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+def _first(queryset, what):
+    obj = queryset.first()
+    if obj is None:
+        raise RuntimeError(f'Dataset has no {what} left; generate a larger one.')
+    return obj
+
+
+def _deep_leaf_game(status):
+    return _first(
+        Game.objects.filter(status=status, species__is_leaf_species=True)
+        .order_by('-species__depth', '-hunt_start_time', 'pk'),
+        f'{status} leaf game',
+    )
+
+
+@scenario('game_create_deep')
+def game_create_deep(context):
+    root = _first(Species.objects.filter(pk__in=context['roots']), 'root species')
+    return 'post', '/api/games/', {'species': root.pk}
+
+
+@scenario('start_hunting_deep_leaf')
+def start_hunting_deep_leaf(context):
+    game = _deep_leaf_game('NOT_STARTED')
+    return 'post', f'/api/games/{game.pk}/start_hunting/', None
+
+
+@scenario('complete_hunting_deep_leaf')
+def complete_hunting_deep_leaf(context):
+    game = _deep_leaf_game('NOT_STARTED')
+    game.status = 'HUNTING'
+    game.save()
+    return 'post', f'/api/games/{game.pk}/complete_hunting/', None
+
+
+@scenario('daily_games')
+def daily_games(context):
+    return 'get', f'/api/games/?date={timezone.localdate().isoformat()}', None
+
+
+@scenario('active_game')
+def active_game(context):
+    if Game.objects.active() is None:
+        game = _deep_leaf_game('NOT_STARTED')
+        game.status = 'HUNTING'
+        game.save()
+    return 'get', '/api/active_game/', None
+
+
+@scenario('species_leaf_edit')
+def species_leaf_edit(context):
+    species = _first(Species.objects.filter(is_leaf_species=True).order_by('-depth', 'pk'), 'leaf species')
+    minutes = species.estimated_hunting_time // timedelta(minutes=1) % 60 + 1
+    return 'patch', f'/api/species/{species.pk}/', {
+        'estimated_hunting_time': str(timedelta(minutes=minutes)),
+    }
+
+
+@scenario('species_subtree_move')
+def species_subtree_move(context):
+    # 根の直下の部分木を別の根の下へ付け替える
+    species = _first(Species.objects.filter(depth=1).order_by('pk'), 'depth-1 species')
+    target = _first(
+        Species.objects.filter(pk__in=context['roots']).exclude(pk=species.parent_species_id),
+        'second root species',
+    )
+    return 'patch', f'/api/species/{species.pk}/', {'parent_species': target.pk}
+
+
+@scenario('species_cascading_delete')
+def species_cascading_delete(context):
+    species = _first(Species.objects.filter(depth=1).order_by('-pk'), 'depth-1 species')
+    return 'delete', f'/api/species/{species.pk}/', None
+
+
+def summarize(latencies, queries):
+    ordered = sorted(latencies)
+    return {
+        'latency_ms': {
+            'min': ordered[0],
+            'median': statistics.median(ordered),
+            'p95': ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))],
+            'mean': statistics.fmean(ordered),
+            'max': ordered[-1],
+        },
+        'queries': {'min': min(queries), 'max': max(queries)},
+    }
+
+
+def run_scenario(client, func, context, iterations, warmup):
+    latencies, queries = [], []
+    for i in range(warmup + iterations):
+        method, path, data = func(context)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = getattr(client, method)(path, data, format='json')
+            elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method.upper()} {path} returned {response.status_code}: {response.content[:200]!r}')
+        if i >= warmup:
+            latencies.append(round(elapsed, 3))
+            queries.append(len(captured.captured_queries))
+    return summarize(latencies, queries)
+
+
+def run(dataset_options, iterations=5, warmup=1, names=None):
+    """合成データを生成してシナリオを順に計測し、結果をJSONにできる辞書で返す"""
+    names = names or list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+    results = {}
+    with override_settings(ALLOWED_HOSTS=['testserver']), transaction.atomic():
+        dataset = datagen.generate_dataset(**dataset_options)
+        context = {'roots': dataset.roots}
+        client = APIClient()
+        for name in names:
+            results[name] = run_scenario(client, SCENARIOS[name], context, iterations, warmup)
+        transaction.set_rollback(True)
+
+    return {
+        'meta': {
+            'dataset': {**dataset_options, 'species': dataset.species, 'games': dataset.games},
+            'iterations': iterations,
+            'warmup': warmup,
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'timestamp': timezone.now().isoformat(),
+        },
+        'scenarios': results,
+    }
+
+
+def compare(baseline, current, threshold=1.5):
+    """
+    基準の結果と比べて悪化したシナリオを [(シナリオ, 説明), ...] で返す
+
+    レイテンシは中央値がthreshold倍を超えたら、クエリ数は1つでも増えたら悪化とみなす。
+    """
+    regressions = []
+    for name, result in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        before, after = base['latency_ms']['median'], result['latency_ms']['median']
+        if before and after / before > threshold:
+            regressions.append((name, f'median latency {before:.2f}ms -> {after:.2f}ms'))
+        before, after = base['queries']['max'], result['queries']['max']
+        if after > before:
+            regressions.append((name, f'queries {before} -> {after}'))
+    return regressions
+
+
+def _contend(path, pragmas, seconds, readers, rows):
+    """書き込みを続けるスレッドの横で読み取りを繰り返し、読み取りの待ち時間を計測"""
+    def connect():
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name}={value}')
+        return conn
+
+    setup = connect()
+    setup.execute('CREATE TABLE game (id INTEGER PRIMARY KEY, status TEXT, n INTEGER)')
+    setup.executemany('INSERT INTO game (status, n) VALUES (?, 0)', [('NOT_STARTED',)] * rows)
+    setup.close()
+
+    stop = threading.Event()
+    latencies, errors, writes = [], [], [0]
+    lock = threading.Lock()
+
+    def write():
+        conn = connect()
+        while not stop.is_set():
+            # 連鎖的な保存を模して、1トランザクションで多数の行を書き換える
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('UPDATE game SET n = n + 1, status = ? WHERE id % 3 = ?', ('PENDING', writes[0] % 3))
+            conn.execute('COMMIT')
+            writes[0] += 1
+        conn.close()
+
+    def read():
+        conn = connect()
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                conn.execute("SELECT count(*), sum(n) FROM game WHERE status = 'PENDING'").fetchone()
+            except sqlite3.OperationalError as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(round(elapsed, 3))
+        conn.close()
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    result = summarize(latencies or [0], [0])
+    del result['queries']
+    result.update({'reads': len(latencies), 'writes': writes[0], 'read_errors': len(errors)})
+    return result
+
+
+def run_concurrency(seconds=2.0, readers=4, rows=20000):
+    """
+    既定のロールバックジャーナルと本番プロファイル（WAL）で、書き込み中の読み取りの待ち時間を比べる
+
+    Djangoの接続を介さず一時ファイルのSQLiteに直接つなぐので、実行中のDBには影響しない。
+    """
+    profiles = {'development': {}, 'production': PRODUCTION_PRAGMAS}
+    results = {}
+    for name, pragmas in profiles.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            results[name] = _contend(os.path.join(tmp, 'concurrency.sqlite3'), pragmas, seconds, readers, rows)
+    return results
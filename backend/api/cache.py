@@ -0,0 +1,202 @@
+"""
+Genus/Species系の読み取りAPIのレスポンスキャッシュ
+
+キーにはリソースごとのバージョン番号を含め、書き込み時はキャッシュを消す代わりに
+バージョンを上げる（古いエントリは参照されなくなりLRUで追い出される）。
+ETagは内容から求めてデータと一緒にキャッシュするので、ヒット時は直列化せずに304を返せ、
+キャッシュを通らない応答（etag_response）のETagとも一致する。
+"""
+import functools
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.http import HttpResponseNotModified
+from django.dispatch import receiver
+from django.utils.http import parse_etags, quote_etag
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.response import Response
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'api.cache.LocMemLRUBackend',
+    'OPTIONS': {'max_entries': 1024},
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'TIMETOHUNT_READ_CACHE', {}).get(name, DEFAULTS[name])
+
+
+class LocMemLRUBackend:
+    """プロセス内のLRUキャッシュ（既定）"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_version(self, resource):
+        return self._versions.get(resource, 0)
+
+    def bump_version(self, resource):
+        with self._lock:
+            self._versions[resource] = self._versions.get(resource, 0) + 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoCacheBackend:
+    """CACHES設定のキャッシュを使うバックエンド（複数プロセスで共有する場合）"""
+
+    def __init__(self, alias='default', timeout=300):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(f'read:{key}')
+
+    def set(self, key, value):
+        self.cache.set(f'read:{key}', value, self.timeout)
+
+    def get_version(self, resource):
+        return self.cache.get(f'version:{resource}', 0)
+
+    def bump_version(self, resource):
+        key = f'version:{resource}'
+        self.cache.add(key, 0, None)
+        self.cache.incr(key)
+
+    def __len__(self):
+        return 0
+
+
+class ReadCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, resources, request):
+        versions = ','.join(f'{name}{self.backend.get_version(name)}' for name in resources)
+        query = '&'.join(sorted(request.GET.urlencode().split('&')))
+        # 一覧はユーザーの所有する行に絞り込まれるので、ユーザーごとに分ける
+        user = getattr(request, 'user', None)
+        owner = user.pk if user is not None and user.is_authenticated else ''
+        return f'{versions}|{owner}|{request.path}?{query}'
+
+    def bump(self, *resources):
+        for resource in resources:
+            self.backend.bump_version(resource)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.backend),
+        }
+
+
+_read_cache = None
+_read_cache_lock = threading.Lock()
+
+
+def get_read_cache():
+    global _read_cache
+    with _read_cache_lock:
+        if _read_cache is None:
+            backend_class = import_string(get_setting('BACKEND'))
+            _read_cache = ReadCache(backend_class(**get_setting('OPTIONS')))
+        return _read_cache
+
+
+@receiver(setting_changed)
+def reset_read_cache(setting, **kwargs):
+    global _read_cache
+    if setting == 'TIMETOHUNT_READ_CACHE':
+        _read_cache = None
+
+
+def invalidate(*resources):
+    """リソースのバージョンを上げる（確定前の読み取り対策として確定後にもう一度上げる）"""
+    read_cache = get_read_cache()
+    read_cache.bump(*resources)
+    transaction.on_commit(lambda: read_cache.bump(*resources))
+
+
+def content_etag(data):
+    """内容から求めたETag（キャッシュ・etag_responseで共通）"""
+    payload = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode()
+    return quote_etag(hashlib.md5(payload).hexdigest())
+
+
+def with_etag(request, etag, render):
+    """If-None-Matchがetagと一致すれば304、しなければrender()の応答にETagを付けて返す"""
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = render()
+    response['ETag'] = etag
+    return response
+
+
+def etag_response(request, data, response_class=Response):
+    """内容から求めたETagを付けて返す（同期版はDRFのResponse、非同期版はJsonResponseで返す）"""
+    return with_etag(request, content_etag(data), lambda: response_class(data))
+
+
+def cached_read(*resources):
+    """
+    GETアクションのレスポンスをキャッシュするデコレータ
+
+    resourcesにはレスポンスの内容が依存するリソース（'genus', 'species', 'game'）を並べる。
+    レスポンスにETagが付いていればそれを、なければ内容から求めたETagをデータと一緒にキャッシュする。
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if not get_setting('ENABLED'):
+                return method(self, request, *args, **kwargs)
+
+            read_cache = get_read_cache()
+            key = read_cache.make_key(resources, request)
+            entry = read_cache.backend.get(key)
+            if entry is None:
+                read_cache.misses += 1
+                response = method(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                # Serializerへの参照を持たせたままキャッシュしない
+                data = list(response.data) if isinstance(response.data, list) else dict(response.data)
+                entry = (data, response.get('ETag') or content_etag(data))
+                read_cache.backend.set(key, entry)
+            else:
+                read_cache.hits += 1
+
+            data, etag = entry
+            return with_etag(request, etag, lambda: Response(data))
+        return wrapper
+    return decorator
@@ -0,0 +1,135 @@
+"""
+ベンチマーク・負荷確認用の合成データ生成
+
+Species木は段ごとにbulk_createで作り（path・depthは親から求める）、最後に合計を1度だけ集計し直す。
+Gameは実際のAPIと同じ instantiate_subtree() で木ごと作り、過去の日の葉には状態の分布を割り当てる。
+"""
+import random
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import analytics
+from .models import Genus, Species, Game
+
+DEFAULT_STATUS_MIX = {
+    'CAPTURED': 0.6,
+    'ESCAPED': 0.1,
+    'PENDING': 0.1,
+    'NOT_STARTED': 0.2,
+}
+
+Dataset = namedtuple('Dataset', ['genera', 'species', 'roots', 'games'])
+
+
+def parse_status_mix(value):
+    """"CAPTURED=0.6,ESCAPED=0.1" の形式を状態ごとの比率に変換"""
+    valid = {choice for choice, _ in Game.STATUS_CHOICES} - {'HUNTING'}
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip().upper()
+        if name not in valid:
+            raise ValueError(f'Unknown status in mix: {name!r}')
+        mix[name] = float(weight)
+    if not mix or any(weight < 0 for weight in mix.values()) or not sum(mix.values()):
+        raise ValueError('Status mix needs at least one positive weight.')
+    return mix
+
+
+def generate_catalog(genera=2, roots_per_genus=2, depth=4, fanout=3,
+                     estimate_minutes=(5, 60), rng=None):
+    """depth段・fanout分岐のSpecies木を属ごとにroots_per_genus本作成し、根のリストを返す"""
+    rng = rng or random.Random()
+    roots = []
+    for g in range(genera):
+        genus = Genus.objects.create(name=f'genus-{g}')
+        level = Species.objects.bulk_create([
+            Species(
+                title=f'{genus.name}/{r}', genus=genus, is_leaf_species=depth == 0,
+                estimated_hunting_time=timedelta(minutes=rng.randint(*estimate_minutes)),
+            )
+            for r in range(roots_per_genus)
+        ])
+        roots.extend(level)
+
+        for d in range(1, depth + 1):
+            level = Species.objects.bulk_create([
+                Species(
+                    title=f'{parent.title}/{i}',
+                    genus=genus,
+                    parent_species=parent,
+                    priority=rng.randint(1, 5),
+                    estimated_hunting_time=timedelta(minutes=rng.randint(*estimate_minutes)),
+                    is_leaf_species=d == depth,
+                    path=parent.subtree_prefix,
+                    depth=d,
+                )
+                for parent in level
+                for i in range(fanout)
+            ], batch_size=500)
+
+    # 親の値は葉の合計なので最後に1度だけ積み上げる
+    Species.objects.recompute_totals()
+    return roots
+
+
+def generate_games(roots, days=7, games_per_day=3, status_mix=None, today=None, rng=None):
+    """
+    今日までのdays日分、1日あたりgames_per_day件のGame木を作成
+
+    今日より前のGameの葉にはstatus_mixの比率で状態を割り当て、今日のGameは未着手のまま残す。
+    """
+    rng = rng or random.Random()
+    status_mix = status_mix or DEFAULT_STATUS_MIX
+    statuses, weights = zip(*status_mix.items())
+    today = today or timezone.localdate()
+    tz = timezone.get_current_timezone()
+
+    created = 0
+    finished_leaves = []
+    for offset in range(days - 1, -1, -1):
+        day = today - timedelta(days=offset)
+        for n in range(games_per_day):
+            start = timezone.make_aware(datetime.combine(day, time(8)), tz) + timedelta(hours=n)
+            game = Game(species=rng.choice(roots), hunt_start_time=start)
+            game.save()
+            games = [game, *game.instantiate_subtree()]
+            created += len(games)
+            if offset:
+                finished_leaves.extend(g for g in games if g.species.is_leaf_species)
+
+    # 過去の葉へ状態を割り当て、親の状態は段ごとにまとめて求め直す
+    changed = []
+    for game in finished_leaves:
+        game.status = rng.choices(statuses, weights)[0]
+        if game.status == 'NOT_STARTED':
+            continue
+        if game.status == 'CAPTURED':
+            ratio = rng.uniform(0.5, 1.8)
+            game.actual_hunting_time = game.species.estimated_hunting_time * ratio
+        game.snapshot_estimate(is_leaf=True)
+        changed.append(game)
+    Game.objects.bulk_update(
+        changed, ['status', 'actual_hunting_time', 'finished_estimate'], batch_size=500,
+    )
+    analytics.record((None, analytics.game_values(game)) for game in changed)
+    Game.objects.propagate_status({game.parent_game_id for game in changed})
+    return created
+
+
+def generate_dataset(genera=2, roots_per_genus=2, depth=4, fanout=3, days=7, games_per_day=3,
+                     status_mix=None, seed=None):
+    """Species木とGameをまとめて生成"""
+    rng = random.Random(seed)
+    with transaction.atomic():
+        roots = generate_catalog(genera, roots_per_genus, depth, fanout, rng=rng)
+        games = generate_games(roots, days, games_per_day, status_mix, rng=rng)
+    return Dataset(
+        genera=genera,
+        species=Species.objects.count(),
+        roots=[root.pk for root in roots],
+        games=games,
+    )
@@ -0,0 +1,160 @@
+"""
+捕獲実績から推定所要時間を学習する
+
+種ごとに実績(actual_hunting_time)の指数移動平均(EWMA)と、P²法による分位点の推定値を持ち、
+Gameが捕獲完了するたびにO(1)で更新する。過去の実績を読み直すことはない。
+十分な件数が集まった種には推定所要時間の候補(suggested_estimate)を出し、
+auto_update_estimateを有効にした葉の種では候補をそのまま推定所要時間として保存する
+（祖先の合計へは通常の保存と同じく差分で伝搬する）。
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import cache, rollup
+
+DEFAULTS = {
+    'ALPHA': 0.3,          # EWMAの重み（大きいほど直近の実績を重視する）
+    'QUANTILE': 0.75,      # P²法で追う分位点
+    'MIN_SAMPLES': 5,      # 候補を出すのに必要な実績の件数
+    'SUGGEST': 'quantile',  # 候補に使う値（'quantile' または 'ewma'）
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'TIMETOHUNT_ESTIMATION', {}).get(name, DEFAULTS[name])
+
+
+class P2Quantile:
+    """
+    P²法による分位点のストリーミング推定（Jain & Chlamtac, 1985）
+
+    5つのマーカーの高さと位置だけを持つので、件数によらず定数の記憶域・計算量で更新できる。
+    状態はJSONにそのまま保存できる辞書で出し入れする。
+    """
+
+    def __init__(self, p, state=None):
+        self.p = p
+        state = state or {}
+        self.heights = list(state.get('heights', []))
+        self.positions = list(state.get('positions', [0, 1, 2, 3, 4]))
+        self.desired = list(state.get('desired', [0, 2 * p, 4 * p, 2 + 2 * p, 4]))
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+        self.count = state.get('count', 0)
+
+    def state(self):
+        return {
+            'heights': self.heights,
+            'positions': self.positions,
+            'desired': self.desired,
+            'count': self.count,
+        }
+
+    def add(self, x):
+        self.count += 1
+        q, n = self.heights, self.positions
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # 中間のマーカーを望ましい位置へ1つずつ寄せる
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        if not self.heights:
+            return None
+        if self.count <= 5:
+            # マーカーが動き出すまでは並べた実績から直接求める
+            return self.heights[min(len(self.heights) - 1, int(self.p * len(self.heights)))]
+        return self.heights[2]
+
+
+def update_stats(stats, seconds):
+    """SpeciesEstimateStatsに実績を1件加え、候補を求め直す"""
+    alpha = get_setting('ALPHA')
+    stats.ewma_seconds = seconds if not stats.samples else alpha * seconds + (1 - alpha) * stats.ewma_seconds
+    sketch = P2Quantile(get_setting('QUANTILE'), stats.sketch)
+    sketch.add(seconds)
+    stats.sketch = sketch.state()
+    stats.samples += 1
+    stats.updated_at = timezone.now()
+
+    if stats.samples < get_setting('MIN_SAMPLES'):
+        stats.suggested_estimate = None
+    else:
+        value = sketch.value() if get_setting('SUGGEST') == 'quantile' else stats.ewma_seconds
+        stats.suggested_estimate = timedelta(seconds=round(value))
+
+
+def captured_samples(changes):
+    """Gameの変更 [(変更前の値, 変更後の値), ...] から新たに捕獲完了した葉の実績を取り出す"""
+    for before, after in changes:
+        if not after or after['status'] != 'CAPTURED' or after['finished_estimate'] is None:
+            continue
+        if after['actual_hunting_time'] is None or (before and before['status'] == 'CAPTURED'):
+            continue
+        yield after['species_id'], after['actual_hunting_time']
+
+
+def observe(changes):
+    """新たに捕獲完了したGameの実績を種ごとの統計へ加える（1件あたりO(1)）"""
+    from .models import Species, SpeciesEstimateStats
+
+    samples = list(captured_samples(changes))
+    if not samples:
+        return
+
+    species_ids = {species_id for species_id, _ in samples}
+    stats = {row.pk: row for row in SpeciesEstimateStats.objects.filter(pk__in=species_ids)}
+    created = []
+    for species_id, actual in samples:
+        if species_id not in stats:
+            stats[species_id] = SpeciesEstimateStats(species_id=species_id)
+            created.append(stats[species_id])
+        update_stats(stats[species_id], actual.total_seconds())
+
+    SpeciesEstimateStats.objects.bulk_create(created)
+    SpeciesEstimateStats.objects.bulk_update(
+        [row for row in stats.values() if row not in created],
+        ['samples', 'ewma_seconds', 'sketch', 'suggested_estimate', 'updated_at'],
+    )
+    cache.invalidate('species')
+
+    # 自動更新を有効にした葉の種へ候補を反映（祖先への伝搬はまとめて1度だけ書き込む）
+    suggested = {pk: row.suggested_estimate for pk, row in stats.items() if row.suggested_estimate}
+    auto_species = Species.objects.filter(pk__in=suggested, auto_update_estimate=True, is_leaf_species=True)
+    with rollup.deferred():
+        for species in auto_species:
+            if species.estimated_hunting_time != suggested[species.pk]:
+                species.estimated_hunting_time = suggested[species.pk]
+                species.save()
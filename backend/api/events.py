@@ -0,0 +1,129 @@
+"""
+Gameの変更を購読中のクライアントへ配信するブローカー
+
+変更はトランザクション確定後にバックエンドへ渡され、バックエンドからブローカーへ戻ってきた
+イベントがプロセス内の購読者全員に配られる。既定のLocalBackendはそのまま折り返すだけなので、
+複数プロセスで配信したい場合は TIMETOHUNT_EVENTS['BACKEND'] で差し替える。
+イベントには変更したGameの所有者のidを付け、購読側は自分の所有するGameのイベントだけを受け取る。
+"""
+import asyncio
+import itertools
+import json
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULTS = {
+    'BACKEND': 'api.events.LocalBackend',
+    'QUEUE_SIZE': 100,
+    'HEARTBEAT': 15,
+}
+
+GAME_FIELDS = (
+    'species', 'parent_game', 'hunt_start_time', 'deadline',
+    'actual_hunting_time', 'status', 'is_active',
+)
+
+
+def get_setting(name):
+    return getattr(settings, 'TIMETOHUNT_EVENTS', {}).get(name, DEFAULTS[name])
+
+
+class LocalBackend:
+    """同一プロセス内でそのまま配信する既定のバックエンド"""
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, event):
+        self.deliver(event)
+
+
+class Subscription:
+    """購読者ごとのキュー（イベントループ外のスレッドからも安全に積める）"""
+
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        # 読み出しが追いつかない購読者は古いイベントから捨てる
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broker:
+    def __init__(self, backend_class):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.backend = backend_class(self._deliver)
+
+    def publish(self, event_type, data, owner=None):
+        self.backend.publish({'type': event_type, 'data': data, 'owner': owner})
+
+    def subscribe(self):
+        subscription = Subscription(asyncio.get_running_loop(), get_setting('QUEUE_SIZE'))
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _deliver(self, event):
+        event = {**event, 'id': next(self._ids)}
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = Broker(import_string(get_setting('BACKEND')))
+        return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'TIMETOHUNT_EVENTS':
+        _broker = None
+
+
+def publish(event_type, data, owner=None):
+    """トランザクション確定後にイベントを配信（ownerは所有者のid。所有者なしのGameならNone）"""
+    transaction.on_commit(lambda: get_broker().publish(event_type, data, owner))
+
+
+def game_delta(game, fields=GAME_FIELDS):
+    data = {'id': game.pk}
+    for name in fields:
+        field = game._meta.get_field(name)
+        data[name] = getattr(game, field.attname)
+    return data
+
+
+def format_sse(event):
+    payload = json.dumps(event['data'], cls=DjangoJSONEncoder)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
@@ -0,0 +1,96 @@
+"""
+期限切れGameの掃き出し
+
+期限(deadline)を過ぎても未着手・保留中のままのGameを (is_overdue, deadline) のインデックスで
+範囲検索し、TRANSITIONに従って1バッチごとにまとめて更新する。
+
+- 'OVERDUE': is_overdue を立てるだけで状態は変えない
+- 'ESCAPED': 加えて葉のGameを見失ったことにする（親の状態は祖先ごとに1度だけ求め直す）
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+from django.utils import timezone
+
+from . import analytics, cache, events, receivers
+from .models import Game, Species
+
+DEFAULTS = {
+    'TRANSITION': 'OVERDUE',
+    'STATUSES': ['NOT_STARTED', 'PENDING'],
+    'BATCH_SIZE': 500,
+}
+TRANSITIONS = ('OVERDUE', 'ESCAPED')
+
+
+def get_setting(name):
+    return getattr(settings, 'TIMETOHUNT_EXPIRY', {}).get(name, DEFAULTS[name])
+
+
+def _expire_batch(rows, transition, now):
+    ids = [row['id'] for row in rows]
+    leaves = [row for row in rows if not row['has_child_games']] if transition == 'ESCAPED' else []
+
+    with transaction.atomic(), receivers.suspended('game'):
+        Game.objects.filter(pk__in=ids).update(is_overdue=True, updated_at=now)
+        if leaves:
+            Game.objects.filter(pk__in=[row['id'] for row in leaves]).update(
+                status='ESCAPED',
+                is_active=False,
+                finished_estimate=Subquery(
+                    Species.objects.filter(pk=OuterRef('species_id')).values('estimated_hunting_time')[:1]
+                ),
+            )
+            changes = []
+            for row in leaves:
+                before = {name: row[name] for name in analytics.GAME_COLUMNS}
+                after = {**before, 'status': 'ESCAPED', 'finished_estimate': row['estimate']}
+                changes.append((before, after))
+            analytics.record(changes)
+            Game.objects.propagate_status(row['parent_game_id'] for row in leaves)
+        cache.invalidate('game')
+
+        escaped = {row['id'] for row in leaves}
+        for row in rows:
+            data = {'id': row['id'], 'is_overdue': True}
+            if row['id'] in escaped:
+                data['status'] = 'ESCAPED'
+            events.publish('game.updated', data, row['owner_id'])
+    return len(leaves)
+
+
+def expire_games(now=None, transition=None, batch_size=None, dry_run=False):
+    """期限切れになったGameに印を付け、(印を付けた数, 見失ったことにした数) を返す"""
+    now = now or timezone.now()
+    transition = transition or get_setting('TRANSITION')
+    if transition not in TRANSITIONS:
+        raise ValueError(f"Unknown transition {transition!r}; use one of {', '.join(TRANSITIONS)}.")
+    batch_size = batch_size or get_setting('BATCH_SIZE')
+    candidates = Game.objects.filter(
+        is_overdue=False, deadline__lt=now, status__in=get_setting('STATUSES'),
+    )
+    if dry_run:
+        return candidates.count(), 0
+
+    candidates = candidates.annotate(
+        has_child_games=Exists(Game.objects.filter(parent_game=OuterRef('pk'))),
+    ).order_by('deadline', 'pk').values(
+        'id', 'parent_game_id', 'owner_id', 'has_child_games', 'species__estimated_hunting_time',
+        *analytics.GAME_COLUMNS,
+    )
+    marked = escaped = 0
+    while True:
+        # 印を付けたGameは次のバッチの範囲検索から外れる
+        rows = list(candidates[:batch_size])
+        if not rows:
+            break
+        for row in rows:
+            row['estimate'] = row.pop('species__estimated_hunting_time')
+        escaped += _expire_batch(rows, transition, now)
+        marked += len(rows)
+    return marked, escaped
+
+
+def run_scheduled():
+    """定期実行用（遷移は設定値）"""
+    return expire_games()
@@ -0,0 +1,119 @@
+"""
+起動中のサーバーへの負荷試験
+
+asyncioで生のHTTP/1.1（keep-alive）のクライアントを多数同時に動かし、同期版と非同期版の
+エンドポイントの組ごとに、1秒あたりのリクエスト数とレイテンシの分位点を比べる。
+対象のサーバーは別に起動しておくこと（例: uvicorn TimeToHunt.asgi:application）。
+"""
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+# 名前: (同期版のパス, 非同期版のパス)。{date}・{species}・{genus} は実行時に埋める
+PAIRS = {
+    'active_game': ('/api/active_game/', '/api/async/active_game/'),
+    'daily_games': ('/api/games/?date={date}', '/api/async/games/?date={date}'),
+    'species_tree': ('/api/species/{species}/tree/', '/api/async/species/{species}/tree/'),
+    'genus_species': ('/api/genera/{genus}/species/', '/api/async/genera/{genus}/species/'),
+}
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, round(p * (len(ordered) - 1)))]
+
+
+async def _read_response(reader):
+    """レスポンスを読み切り、(ステータス, 接続を使い回せるか) を返す"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed by the server.')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+async def _client(host, port, path, deadline, latencies, errors):
+    request = f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: application/json\r\n\r\n'.encode()
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            await writer.drain()
+            status, keep_alive = await _read_response(reader)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            errors['connection'] = errors.get('connection', 0) + 1
+            keep_alive = False
+        else:
+            if status >= 400:
+                errors[status] = errors.get(status, 0) + 1
+            else:
+                latencies.append((time.perf_counter() - started) * 1000)
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def load(url, concurrency=100, duration=10.0):
+    """urlへconcurrency本の接続からduration秒間リクエストを送り続けた結果を返す"""
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path = f'{path}?{parts.query}'
+    latencies, errors = [], {}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(
+        _client(parts.hostname, parts.port or 80, path, deadline, latencies, errors)
+        for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': {str(key): value for key, value in errors.items()},
+        'rps': round(len(ordered) / elapsed, 1),
+        'latency_ms': {
+            name: None if value is None else round(value, 2)
+            for name, value in (
+                ('p50', percentile(ordered, 0.5)),
+                ('p99', percentile(ordered, 0.99)),
+                ('max', ordered[-1] if ordered else None),
+            )
+        },
+    }
+
+
+def compare_pairs(base_url, names=None, concurrency=100, duration=10.0, **params):
+    """PAIRSの組ごとに同期版・非同期版を順に試験し、{名前: {'sync': 結果, 'async': 結果}} を返す"""
+    results = {}
+    for name in names or list(PAIRS):
+        results[name] = {}
+        for mode, path in zip(('sync', 'async'), PAIRS[name]):
+            url = base_url.rstrip('/') + path.format(**params)
+            results[name][mode] = asyncio.run(load(url, concurrency, duration))
+    return results
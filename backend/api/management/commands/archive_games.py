@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import archive
+
+
+class Command(BaseCommand):
+    help = "Move finished game trees older than the retention window into the archive table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help="Retention window in days (defaults to TIMETOHUNT_ARCHIVE['RETENTION_DAYS'])",
+        )
+        parser.add_argument('--batch-size', type=int, help="Game trees archived per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be archived")
+
+    def handle(self, *args, **options):
+        before = None
+        if options['days'] is not None:
+            before = timezone.now() - timedelta(days=options['days'])
+        trees, games = archive.archive_games(before, options['batch_size'], options['dry_run'])
+        verb = "Would archive" if options['dry_run'] else "Archived"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {trees} game trees ({games} games)."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import expiry
+
+
+class Command(BaseCommand):
+    help = "Mark games past their deadline as overdue (or escaped) in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--transition', choices=expiry.TRANSITIONS,
+            help="What to do with expired games (defaults to TIMETOHUNT_EXPIRY['TRANSITION'])",
+        )
+        parser.add_argument('--batch-size', type=int, help="Games updated per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be expired")
+
+    def handle(self, *args, **options):
+        try:
+            marked, escaped = expiry.expire_games(
+                transition=options['transition'], batch_size=options['batch_size'], dry_run=options['dry_run'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Would mark {marked} games as overdue."))
+            return
+        self.stdout.write(self.style.SUCCESS(f"Marked {marked} games as overdue ({escaped} escaped)."))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import transfer
+
+
+class Command(BaseCommand):
+    help = "Stream genera, species, games or the whole catalog as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', help="catalog, genera, species or games")
+        parser.add_argument('--format', default='ndjson', choices=sorted(transfer.FORMATS))
+        parser.add_argument('--output', help="File to write (defaults to stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            rows = transfer.export(options['resource'], options['format'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if not options['output']:
+            for line in rows:
+                self.stdout.write(line, ending='')
+            return
+        count = 0
+        with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+            for line in rows:
+                f.write(line)
+                count += 1
+        self.stderr.write(self.style.SUCCESS(f"Wrote {count} lines to {options['output']}."))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import datagen
+from api.models import Genus
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic catalog of species trees and several days of games"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--genera', type=int, default=2)
+        parser.add_argument('--roots', type=int, default=2, help="Root species per genus")
+        parser.add_argument('--depth', type=int, default=4)
+        parser.add_argument('--fanout', type=int, default=3)
+        parser.add_argument('--days', type=int, default=7)
+        parser.add_argument('--games-per-day', type=int, default=3)
+        parser.add_argument(
+            '--status-mix',
+            help="Weights for past leaf games, e.g. CAPTURED=0.6,ESCAPED=0.1,PENDING=0.1,NOT_STARTED=0.2",
+        )
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--clear', action='store_true', help="Delete all genera, species and games first")
+
+    def handle(self, *args, **options):
+        try:
+            status_mix = options['status_mix'] and datagen.parse_status_mix(options['status_mix'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        with transaction.atomic():
+            if options['clear']:
+                # Species・GameはGenusからCASCADEで消える
+                Genus.objects.all().delete()
+            dataset = datagen.generate_dataset(
+                genera=options['genera'],
+                roots_per_genus=options['roots'],
+                depth=options['depth'],
+                fanout=options['fanout'],
+                days=options['days'],
+                games_per_day=options['games_per_day'],
+                status_mix=status_mix,
+                seed=options['seed'],
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {dataset.genera} genera, {dataset.species} species and {dataset.games} games."
+        ))
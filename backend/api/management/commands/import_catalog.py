@@ -0,0 +1,35 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api import transfer
+
+
+class Command(BaseCommand):
+    help = "Load a catalog NDJSON export (genera and species) in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file to load ('-' reads stdin)")
+        parser.add_argument('--chunk-size', type=int, default=transfer.CHUNK_SIZE, help="Rows per bulk insert")
+        parser.add_argument('--owner', help="Username that will own the imported rows (defaults to no owner)")
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['owner']:
+            User = get_user_model()
+            try:
+                owner = User.objects.get(**{User.USERNAME_FIELD: options['owner']})
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['owner']!r} does not exist.")
+        try:
+            if options['path'] == '-':
+                counts = transfer.import_catalog(sys.stdin, options['chunk_size'], owner)
+            else:
+                with open(options['path'], encoding='utf-8') as f:
+                    counts = transfer.import_catalog(f, options['chunk_size'], owner)
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            raise CommandError(f"Import failed: {e}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {counts['genera']} genera and {counts['species']} species."
+        ))
@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests per second and latency of the sync and async read endpoints "
+        "on a running server (e.g. uvicorn TimeToHunt.asgi:application)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the running server")
+        parser.add_argument('--concurrency', type=int, default=100, help="Concurrent keep-alive clients")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per endpoint")
+        parser.add_argument(
+            '--pair', action='append', dest='pairs', choices=sorted(loadtest.PAIRS),
+            help="Only test this endpoint pair (repeatable)",
+        )
+        parser.add_argument('--date', help="Day for daily_games (defaults to today)")
+        parser.add_argument('--species', type=int, help="Species id for species_tree")
+        parser.add_argument('--genus', type=int, help="Genus id for genus_species")
+        parser.add_argument('--output', help="Also write the JSON results to this file")
+
+    def handle(self, *args, **options):
+        params = {
+            'date': options['date'] or timezone.localdate().isoformat(),
+            'species': options['species'],
+            'genus': options['genus'],
+        }
+        names = options['pairs'] or [
+            name for name, paths in loadtest.PAIRS.items()
+            if all(params[key] is not None for key in params if f'{{{key}}}' in paths[0])
+        ]
+        for name in names:
+            missing = [key for key in params if f'{{{key}}}' in loadtest.PAIRS[name][0] and params[key] is None]
+            if missing:
+                raise CommandError(f"{name} needs --{missing[0]}.")
+
+        results = loadtest.compare_pairs(
+            options['url'], names, options['concurrency'], options['duration'], **params,
+        )
+
+        self.stdout.write(f"{'endpoint':<16}{'mode':<7}{'rps':>9}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for name, modes in results.items():
+            for mode, result in modes.items():
+                latency = result['latency_ms']
+                self.stdout.write(
+                    f"{name:<16}{mode:<7}{result['rps']:>9}{latency['p50'] or '-':>10}"
+                    f"{latency['p99'] or '-':>10}{sum(result['errors'].values()):>8}"
+                )
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(json.dumps(results, indent=2) + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote results to {options['output']}."))
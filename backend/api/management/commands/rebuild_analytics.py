@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api import analytics
+
+
+class Command(BaseCommand):
+    help = "Rebuild the estimate-accuracy roll-ups from the finished games"
+
+    def handle(self, *args, **options):
+        count = analytics.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} estimate roll-up rows."))
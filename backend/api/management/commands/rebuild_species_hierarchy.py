@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Species
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized path, depth and leaf flags of every Species"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = Species.objects.rebuild_hierarchy()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt hierarchy for {count} species."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Species
+
+
+class Command(BaseCommand):
+    help = "Recompute the rolled-up estimated hunting time of every parent Species"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = Species.objects.recompute_totals()
+        self.stdout.write(self.style.SUCCESS(f"Repaired {count} species totals."))
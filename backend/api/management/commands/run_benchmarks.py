@@ -0,0 +1,78 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmarks, datagen
+
+
+class Command(BaseCommand):
+    help = "Benchmark the API hot paths on a synthetic dataset (rolled back afterwards)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--genera', type=int, default=2)
+        parser.add_argument('--roots', type=int, default=2, help="Root species per genus")
+        parser.add_argument('--depth', type=int, default=4)
+        parser.add_argument('--fanout', type=int, default=3)
+        parser.add_argument('--days', type=int, default=7)
+        parser.add_argument('--games-per-day', type=int, default=3)
+        parser.add_argument('--status-mix')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=5)
+        parser.add_argument('--warmup', type=int, default=1)
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios', choices=sorted(benchmarks.SCENARIOS),
+            help="Run only this scenario (repeatable)",
+        )
+        parser.add_argument(
+            '--concurrency', type=float, metavar='SECONDS',
+            help="Also measure read latency under a concurrent writer with each database profile",
+        )
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--output', help="Write the JSON results to this file instead of stdout")
+        parser.add_argument('--compare', help="Baseline JSON results to compare against")
+        parser.add_argument(
+            '--threshold', type=float, default=1.5,
+            help="Allowed median latency ratio against the baseline",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            status_mix = options['status_mix'] and datagen.parse_status_mix(options['status_mix'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        dataset_options = {
+            'genera': options['genera'],
+            'roots_per_genus': options['roots'],
+            'depth': options['depth'],
+            'fanout': options['fanout'],
+            'days': options['days'],
+            'games_per_day': options['games_per_day'],
+            'status_mix': status_mix or None,
+            'seed': options['seed'],
+        }
+        try:
+            results = benchmarks.run(
+                dataset_options, options['iterations'], options['warmup'], options['scenarios'],
+            )
+        except RuntimeError as e:
+            raise CommandError(e)
+        if options['concurrency']:
+            results['concurrency'] = benchmarks.run_concurrency(options['concurrency'], options['readers'])
+
+        report = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            regressions = benchmarks.compare(baseline, results, options['threshold'])
+            for name, detail in regressions:
+                self.stderr.write(f"{name}: {detail}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} benchmark regressions against {options['compare']}.")
+            self.stderr.write(self.style.SUCCESS("No regressions against the baseline."))
@@ -1,17 +1,44 @@
-from django.db import models
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Value
+from django.db.models.functions import Coalesce, Concat, Substr
 from django.core.validators import MinValueValidator
+from collections import defaultdict
 from datetime import timedelta
 from django.utils import timezone
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
+from . import analytics, cache, estimation, events, receivers, rollup
+
+
+def owner_of(user):
+    """リクエストのユーザーを所有者に変換（未ログインなら所有者なしの共有データ）"""
+    return user if user is not None and user.is_authenticated else None
+
+
+class OwnedQuerySet(models.QuerySet):
+    def owned_by(self, user):
+        """userが所有する行（未ログインなら所有者なしの行）"""
+        return self.filter(owner=owner_of(user))
+
 
 class Genus(models.Model):
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='genera',
+    )
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OwnedQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -19,7 +46,139 @@ class Genus(models.Model):
         verbose_name_plural = "Genera"
 
 
+class SpeciesQuerySet(OwnedQuerySet):
+    @staticmethod
+    def path_prefix_q(prefix):
+        # "1/5/" で始まるpathは ["1/5/", "1/50") の範囲に収まるので、LIKEではなく範囲検索でインデックスを使う
+        return Q(path__gte=prefix, path__lt=prefix[:-1] + '0')
+
+    def with_path_prefix(self, prefix):
+        """pathが指定の接頭辞で始まるSpecies"""
+        return self.filter(self.path_prefix_q(prefix))
+
+    def descendants_of(self, species):
+        """子孫Species（自身は含まない）"""
+        return self.with_path_prefix(species.subtree_prefix)
+
+    def subtree_of(self, species):
+        """自身と子孫Species"""
+        return self.filter(Q(pk=species.pk) | self.path_prefix_q(species.subtree_prefix))
+
+    def ancestors_of(self, species):
+        """祖先Species（根から順に並ぶとは限らない）"""
+        return self.filter(pk__in=species.ancestor_ids)
+
+    def for_serialization(self):
+        """SpeciesSerializerが行ごとに追加クエリを発行しないよう結合済みにする"""
+        return self.select_related('genus', 'estimate_stats')
+
+
+class SpeciesManager(models.Manager.from_queryset(SpeciesQuerySet)):
+    @staticmethod
+    def _walk(children):
+        """根から順に (pk, path) を返す"""
+        stack = [(pk, '') for pk in children.get(None, [])]
+        while stack:
+            pk, path = stack.pop()
+            yield pk, path
+            stack.extend((child, f'{path}{pk}/') for child in children.get(pk, []))
+
+    def rebuild_hierarchy(self):
+        """path・depth・is_leaf_speciesを親子関係から作り直す"""
+        children = {}
+        for pk, parent_id in self.values_list('pk', 'parent_species_id'):
+            children.setdefault(parent_id, []).append(pk)
+        paths = dict(self._walk(children))
+
+        species_list = list(self.filter(pk__in=paths))
+        for species in species_list:
+            species.path = paths[species.pk]
+            species.depth = species.path.count('/')
+            species.is_leaf_species = species.pk not in children
+        self.bulk_update(species_list, ['path', 'depth', 'is_leaf_species'], batch_size=500)
+        cache.invalidate('species')
+        return len(species_list)
+
+    def recompute_totals(self):
+        """親Speciesの推定所要時間を子から集計し直し、ずれていた件数を返す"""
+        rows = {
+            pk: (parent_id, estimated)
+            for pk, parent_id, estimated in self.values_list(
+                'pk', 'parent_species_id', 'estimated_hunting_time'
+            )
+        }
+        children = {}
+        for pk, (parent_id, _) in rows.items():
+            children.setdefault(parent_id, []).append(pk)
+
+        # 葉から根に向かって合計を積み上げる
+        totals = {}
+        for pk, _ in reversed(list(self._walk(children))):
+            if pk in children:
+                totals[pk] = sum((totals[child] for child in children[pk]), timedelta())
+            else:
+                totals[pk] = rows[pk][1]
+
+        drifted = [
+            Species(pk=pk, estimated_hunting_time=total)
+            for pk, total in totals.items()
+            if total != rows[pk][1]
+        ]
+        self.bulk_update(drifted, ['estimated_hunting_time'], batch_size=500)
+        cache.invalidate('species')
+        return len(drifted)
+
+    def delete_subtree(self, species):
+        """
+        部分木をまとめて削除
+
+        ノードごとの受信処理は止め、残る親の葉フラグ・祖先の合計と、
+        削除されるGameの残る親の状態は削除の後に1度だけ求め直す。
+        削除されるGameには、部分木の外の種のGameでもparent_gameを通して消える子孫を含める。
+        """
+        subtree = self.subtree_of(species)
+        with transaction.atomic(), receivers.suspended('species', 'game'):
+            path, value = self.filter(pk=species.pk).values_list('path', 'estimated_hunting_time').get()
+            value += rollup.pending_delta(species.pk)
+            tops = Game.objects.filter(species__in=subtree).exclude(parent_game__species__in=subtree)
+            rows = Game.objects.subtree_rows(
+                tops.values_list('pk', flat=True),
+                'id', 'parent_game_id', 'owner_id', 'is_active', *analytics.GAME_COLUMNS,
+            )
+            # 親が削除されずに残るGame（木の一番上で削除されるGame）ごとに子孫をまとめる
+            ids = {row['id'] for row in rows}
+            children = defaultdict(list)
+            for row in rows:
+                children[row['parent_game_id']].append(row['id'])
+            roots = [row for row in rows if row['parent_game_id'] not in ids]
+            analytics.record([({name: row[name] for name in analytics.GAME_COLUMNS}, None) for row in rows])
+
+            deleted = subtree.delete()
+            if species.parent_species_id is not None:
+                rollup.detach(rollup.path_ids(path), value)
+            Game.objects.propagate_status(row['parent_game_id'] for row in roots)
+            cache.invalidate('species', 'game')
+            for root in roots:
+                descendants, stack = [], list(children[root['id']])
+                while stack:
+                    pk = stack.pop()
+                    descendants.append(pk)
+                    stack.extend(children[pk])
+                events.publish('game.deleted', {'id': root['id'], 'descendants': descendants}, root['owner_id'])
+            for owner in {row['owner_id'] for row in rows if row['is_active']}:
+                events.publish('active.changed', {'id': None}, owner)
+        return deleted
+
+
 class Species(models.Model):
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='species',
+    )
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     genus = models.ForeignKey(Genus, on_delete=models.CASCADE, null=True, related_name='species')
@@ -43,42 +202,303 @@ class Species(models.Model):
         default=True,
         help_text="Whether this is a leaf species"
     )
+    auto_update_estimate = models.BooleanField(
+        default=False,
+        help_text="Replace the estimate with the one learned from captured games"
+    )
+
+    # 階層インデックス（祖先のpkを根から順に "1/5/" の形で保持する）
+    path = models.CharField(
+        max_length=2048,
+        blank=True,
+        default='',
+        editable=False,
+        db_index=True,
+        help_text="Materialized path of ancestor ids"
+    )
+    depth = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Number of ancestors"
+    )
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = SpeciesManager()
+
     def __str__(self):
         return self.title
 
+    @property
+    def subtree_prefix(self):
+        """子孫のpathが共通して持つ接頭辞"""
+        return f'{self.path}{self.pk}/'
+
+    @property
+    def ancestor_ids(self):
+        return rollup.path_ids(self.path)
+
     def aggregate_hunting_time(self):
         """統一されたインターフェースとしての推定所要時間"""
         if self.is_leaf_species:
             return self.estimated_hunting_time
 
-        total_time = timedelta()
-        for subspecies in self.subspecies.all():
-            if subspecies.estimated_hunting_time:
-                total_time += subspecies.estimated_hunting_time
-        self.estimated_hunting_time = total_time
+        total_time = self.subspecies.aggregate(
+            total=models.Sum('estimated_hunting_time')
+        )['total']
+        self.estimated_hunting_time = total_time or timedelta()
         return self.estimated_hunting_time
 
+    def _load_stored_rows(self):
+        """自身と親のDB上の値を1クエリで取得"""
+        pks = [pk for pk in (self.pk, self.parent_species_id) if pk is not None]
+        return {
+            row['pk']: row
+            for row in Species.objects.filter(pk__in=pks).values(
+                'pk', 'path', 'depth', 'parent_species_id', 'is_leaf_species', 'estimated_hunting_time'
+            )
+        }
+
     def save(self, *args, **kwargs):
-        if not self.pk:
+        stored = self._load_stored_rows()
+        previous = stored.get(self.pk)
+        parent = stored.get(self.parent_species_id)
+
+        if parent is None:
+            self.path, self.depth = '', 0
+        else:
+            if self.pk is not None and f'/{self.pk}/' in f'/{parent["path"]}{parent["pk"]}/':
+                raise ValueError('Species cannot be moved under its own descendant.')
+            self.path = f'{parent["path"]}{parent["pk"]}/'
+            self.depth = parent['depth'] + 1
+
+        if previous is None:
             self.is_leaf_species = True
+        else:
+            self.is_leaf_species = previous['is_leaf_species']
+            if not self.is_leaf_species:
+                # 親Speciesの推定所要時間は子孫から積み上げた値なので直接は変更しない
+                self.estimated_hunting_time = previous['estimated_hunting_time']
+
+        # post_saveで祖先へ差分を伝搬するために保存前の値を残しておく
+        self._rollup_previous = previous
+        self._rollup_parent = parent
+
+        with transaction.atomic():
             super().save(*args, **kwargs)
-            return
 
-        self.is_leaf_species = not self.subspecies.exists()
-        if not self.is_leaf_species:
-            self.aggregate_hunting_time()
+            # 付け替えられた場合は子孫のpathをまとめて書き換える
+            if previous is not None and previous['path'] != self.path:
+                old_prefix = f'{previous["path"]}{self.pk}/'
+                Species.objects.with_path_prefix(old_prefix).update(
+                    path=Concat(Value(self.subtree_prefix), Substr('path', len(old_prefix) + 1)),
+                    depth=F('depth') + (self.depth - previous['depth']),
+                )
 
-        super().save(*args, **kwargs)
+    def delete(self, *args, **kwargs):
+        """子孫とそのGameもまとめて削除する"""
+        return Species.objects.delete_subtree(self)
+
+    def get_descendants(self):
+        """子孫Speciesを1クエリで取得（親が子より先に並ぶ）"""
+        return Species.objects.descendants_of(self).order_by('depth', 'pk')
+
+    def get_ancestors(self):
+        """祖先Speciesを1クエリで取得（根から順に並ぶ）"""
+        return Species.objects.ancestors_of(self).order_by('depth')
 
     class Meta:
         verbose_name_plural = "Species"
 
 
+def derive_status(counts):
+    """子Gameの状態ごとの件数から親Gameの状態を決める"""
+    # 状態の伝搬ルール
+    if counts.get('HUNTING'):
+        return 'HUNTING'
+    if counts.get('ESCAPED'):
+        return 'ESCAPED'
+    if counts.get('CAPTURED', 0) == sum(counts.values()):
+        return 'CAPTURED'
+    if counts.get('PENDING'):
+        return 'PENDING'
+    return 'NOT_STARTED'
+
+
+class GameQuerySet(OwnedQuerySet):
+    def active(self):
+        """現在アクティブなGame（部分ユニークインデックスを1行引くだけ）"""
+        return next(iter(self.filter(is_active=True).order_by()[:1]), None)
+
+    def ancestor_ids(self, game):
+        """祖先Gameのpkを親から順に1クエリで取得"""
+        if not game.parent_game_id:
+            return []
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH RECURSIVE chain(id, parent_game_id, depth) AS (
+                    SELECT id, parent_game_id, 0 FROM {table} WHERE id = %s
+                    UNION ALL
+                    SELECT g.id, g.parent_game_id, chain.depth + 1
+                    FROM {table} g JOIN chain ON g.id = chain.parent_game_id
+                )
+                SELECT id FROM chain ORDER BY depth
+                """,
+                [game.parent_game_id],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def expired(self, value=True, now=None):
+        """期限を過ぎた（valueがFalseなら過ぎていない）Game。is_expiredと同じ判定をDB側で行う"""
+        expired = Q(deadline__lt=now or timezone.now())
+        return self.filter(expired) if value else self.exclude(expired)
+
+    def overlapping(self, start, end):
+        """
+        半開区間 [start, end) に開始した、または実行中のGame
+
+        ORの両側をそれぞれ区間で絞ると、SQLiteはhunt_start_timeとdeadlineのインデックスを
+        使い分けて（MULTI-INDEX OR）期間の前に始まった履歴全体を読まずに済む。
+        """
+        return self.filter(
+            Q(hunt_start_time__gte=start, hunt_start_time__lt=end)
+            | Q(hunt_start_time__lt=start, deadline__gt=start)
+        )
+
+    def for_serialization(self):
+        """GameSerializerが行ごとに追加クエリを発行しないよう結合・注釈済みにする"""
+        return self.select_related('species').annotate(
+            has_child_games=Exists(Game.objects.filter(parent_game=OuterRef('pk')))
+        )
+
+    def apply_changes(self, changes):
+        """
+        検証済みの部分更新 [(game, validated_data), ...] を1トランザクションで適用
+
+        行はbulk_updateでまとめて書き込み、親の状態は影響を受けた祖先ごとに1度だけ求め直す。
+        """
+        now = timezone.now()
+        fields, parent_ids = {'updated_at'}, set()
+        for game, data in changes:
+            affects_parent = 'status' in data or 'parent_game' in data
+            if affects_parent:
+                parent_ids.add(game.parent_game_id)
+            for name, value in data.items():
+                setattr(game, name, value)
+            fields.update(data)
+            if affects_parent:
+                parent_ids.add(game.parent_game_id)
+
+            # 狩猟を止めたGameはアクティブでなくなる
+            if game.is_active and game.status != 'HUNTING':
+                game.is_active = False
+                fields.add('is_active')
+                events.publish('active.changed', {'id': None}, game.owner_id)
+            if game.derive_deadline():
+                fields.update(('deadline', 'deadline_is_derived'))
+            if game.clear_overdue(now):
+                fields.add('is_overdue')
+            if 'status' in data:
+                fields.add('finished_estimate')
+            game.updated_at = now
+
+        games = [game for game, _ in changes]
+        if 'finished_estimate' in fields:
+            parents = set(Game.objects.filter(parent_game__in=games).values_list('parent_game_id', flat=True))
+            for game in games:
+                game.snapshot_estimate(is_leaf=game.pk not in parents)
+        with transaction.atomic():
+            self.bulk_update(games, sorted(fields))
+            cache.invalidate('game')
+            values = [(analytics.game_values(game, loaded=True), analytics.game_values(game)) for game in games]
+            analytics.record(values)
+            estimation.observe(values)
+            self.propagate_status(parent_ids)
+        for game in games:
+            game._loaded_values = {field.attname: getattr(game, field.attname) for field in game._meta.concrete_fields}
+        for game in games:
+            events.publish('game.updated', events.game_delta(game), game.owner_id)
+        return games
+
+    def subtree_rows(self, root_ids, *fields):
+        """根root_idsの木の全行の値を段ごとに取得（根から順に並ぶ。別の根の子孫でもある根は1度だけ）"""
+        rows, seen = [], set()
+        level = list(self.filter(pk__in=root_ids).values(*fields))
+        while level:
+            rows.extend(level)
+            seen.update(row['id'] for row in level)
+            level = [
+                row for row in self.filter(parent_game_id__in=[row['id'] for row in level]).values(*fields)
+                if row['id'] not in seen
+            ]
+        return rows
+
+    def delete_subtree(self, game):
+        """
+        Gameの木をまとめて削除
+
+        ノードごとの受信処理は止め、精度の集計からは削除する行の寄与を1度に引き、
+        残る親の状態は削除の後に1度だけ求め直す。
+        """
+        rows = self.subtree_rows([game.pk], 'id', 'parent_game_id', 'is_active', *analytics.GAME_COLUMNS)
+        with transaction.atomic(), receivers.suspended('game'):
+            analytics.record([({name: row[name] for name in analytics.GAME_COLUMNS}, None) for row in rows])
+            deleted = self.filter(pk=game.pk).delete()
+            if rows:
+                self.propagate_status({rows[0]['parent_game_id']})
+            cache.invalidate('game')
+            events.publish(
+                'game.deleted', {'id': game.pk, 'descendants': [row['id'] for row in rows[1:]]}, game.owner_id,
+            )
+            if any(row['is_active'] for row in rows):
+                events.publish('active.changed', {'id': None}, game.owner_id)
+        return deleted
+
+    def propagate_status(self, parent_ids):
+        """親Gameの状態を子の集計から求め直し、祖先へ1段ずつ伝搬"""
+        parent_ids = set(parent_ids) - {None}
+        while parent_ids:
+            # 親ごとの状態別件数と、親自身の状態・その親を1クエリで取得
+            rows = self.filter(parent_game_id__in=parent_ids).values_list(
+                'parent_game_id', 'parent_game__status', 'parent_game__parent_game_id', 'parent_game__owner_id',
+                'status',
+            ).annotate(n=Count('pk')).order_by()
+            counts, parents, owners = defaultdict(dict), {}, {}
+            for parent_id, parent_status, grandparent_id, owner, status, n in rows:
+                counts[parent_id][status] = n
+                parents[parent_id] = (parent_status, grandparent_id)
+                owners[parent_id] = owner
+
+            changed, parent_ids = defaultdict(list), set()
+            for parent_id, (current, grandparent_id) in parents.items():
+                derived = derive_status(counts[parent_id])
+                if derived != current:
+                    changed[derived].append(parent_id)
+                    parent_ids.add(grandparent_id)
+            parent_ids.discard(None)
+
+            if changed:
+                cache.invalidate('game')
+            for status, pks in changed.items():
+                self.filter(pk__in=pks).update(
+                    status=status, is_active=False, updated_at=timezone.now()
+                )
+                for pk in pks:
+                    events.publish('game.updated', {'id': pk, 'status': status, 'is_active': False}, owners[pk])
+
+
 class Game(models.Model):
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='games',
+    )
     species = models.ForeignKey(Species, on_delete=models.CASCADE, related_name='games')
     parent_game = models.ForeignKey(
         'self',
@@ -88,6 +508,10 @@ class Game(models.Model):
         related_name='child_games'
     )
 
+    objects = GameQuerySet.as_manager()
+
+    _loaded_values = {}
+
     # 時間関連のフィールド
     hunt_start_time = models.DateTimeField(
         default=timezone.now,
@@ -126,6 +550,34 @@ class Game(models.Model):
         blank=True,
         help_text="狩猟の期限時刻"
     )
+    # 期限を指定されずに開始時刻と推定所要時間から求めた場合（計画では期限として扱わない）
+    deadline_is_derived = models.BooleanField(
+        default=False,
+        editable=False,
+        help_text="期限が開始時刻と推定所要時間から求めたものかどうか"
+    )
+
+    # 期限切れの掃き出し(expiry.expire_games)が立てる印（期限が先へ延びれば外れる）
+    is_overdue = models.BooleanField(
+        default=False,
+        editable=False,
+        help_text="期限切れとして処理済みかどうか"
+    )
+
+    # 終了時点の推定所要時間（後から種の推定が変わっても精度の集計が変わらないよう残す）
+    finished_estimate = models.DurationField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="終了時点の推定所要時間"
+    )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 保存時に変更前の値と比較できるよう読み込んだ値を残しておく
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
 
     @property
     def estimated_hunting_time(self):
@@ -148,75 +600,314 @@ class Game(models.Model):
         if now > self.deadline:
             return timedelta()
         return self.deadline - now
-    
+
+    def derive_deadline(self):
+        """
+        期限が指定されていなければ開始時刻と推定所要時間から求め、変えたかどうかを返す
+
+        求めた期限は開始時刻が変われば求め直す。指定された期限はそのまま使う。
+        """
+        loaded = self._loaded_values
+        was_derived = self.deadline_is_derived
+        if 'deadline' in loaded and self.deadline != loaded['deadline']:
+            self.deadline_is_derived = False
+        if self.hunt_start_time and (
+            not self.deadline
+            or (self.deadline_is_derived and self.hunt_start_time != loaded.get('hunt_start_time'))
+        ):
+            deadline = self.hunt_start_time + self.estimated_hunting_time
+            changed = deadline != self.deadline or not was_derived
+            self.deadline, self.deadline_is_derived = deadline, True
+            return changed
+        return self.deadline_is_derived != was_derived
+
+    def clear_overdue(self, now=None):
+        """期限が先へ延びたら期限切れの印を外し、外したかどうかを返す"""
+        if self.is_overdue and (self.deadline is None or self.deadline > (now or timezone.now())):
+            self.is_overdue = False
+            return True
+        return False
+
+    def snapshot_estimate(self, is_leaf=None):
+        """
+        終了した葉のGameに終了時点の推定所要時間を残す（終了状態でなくなれば消す）
+
+        精度の集計はこの値を持つGameだけを数えるので、状態の伝搬で終了した親Gameは含まれない。
+        """
+        if self.status not in analytics.FINISHED:
+            self.finished_estimate = None
+        elif self.finished_estimate is None:
+            if is_leaf is None:
+                is_leaf = self.pk is None or self.is_leaf_game
+            if is_leaf:
+                self.finished_estimate = self.estimated_hunting_time
+
     @property
     def is_leaf_game(self):
         """葉のGameかどうかを確認"""
-        return self.child_games.count() == 0
+        has_child_games = getattr(self, 'has_child_games', None)
+        if has_child_games is None:
+            has_child_games = self.child_games.exists()
+        return not has_child_games
 
     def save(self, *args, **kwargs):
-        if self.status == 'HUNTING' and self.child_games.count() == 0:
+        if self.status == 'HUNTING' and (self.pk is None or not self.child_games.exists()):
             self.is_active = True
-            Game.objects.filter(
-                status='HUNTING',
-            ).exclude(pk=self.pk).update(
-                is_active=False,
-                status='PENDING'
-            )
+            # 同じ所有者の、自身と祖先以外で狩猟中のGameだけを保留に戻す（祖先は伝搬で狩猟中のまま）
+            demoted = list(Game.objects.filter(
+                owner_id=self.owner_id, status='HUNTING',
+            ).exclude(
+                pk__in=[self.pk, *Game.objects.ancestor_ids(self)]
+            ).values_list('pk', flat=True))
+            if demoted:
+                Game.objects.filter(pk__in=demoted).update(
+                    is_active=False,
+                    status='PENDING',
+                    updated_at=timezone.now(),
+                )
+                for pk in demoted:
+                    events.publish(
+                        'game.updated', {'id': pk, 'status': 'PENDING', 'is_active': False}, self.owner_id,
+                    )
         else:
             self.is_active = False
 
-        if not self.deadline and self.hunt_start_time:
-            self.deadline = self.hunt_start_time + self.estimated_hunting_time
+        active_changed = self.is_active != self._loaded_values.get('is_active', False)
+
+        self.derive_deadline()
+        self.snapshot_estimate()
+        self.clear_overdue()
 
         super().save(*args, **kwargs)
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+        # 作成時はpkが決まってから配信する
+        if active_changed:
+            events.publish('active.changed', {'id': self.pk if self.is_active else None}, self.owner_id)
+
+        # 親Gameの状態を更新（変化しなくなった時点で伝搬を止める）
+        if self.parent_game_id:
+            Game.objects.propagate_status([self.parent_game_id])
+
+    def instantiate_subtree(self):
+        """種の子孫に対応する子Gameを1トランザクションで一括作成"""
+        descendants = list(self.species.get_descendants())
+        if not descendants:
+            return []
+
+        games_by_species = {self.species_id: self}
+        child_games = []
+        for species in descendants:
+            game = Game(
+                owner_id=self.owner_id,
+                species=species,
+                parent_game=self if species.parent_species_id == self.species_id else None,
+                hunt_start_time=self.hunt_start_time,
+                deadline=self.hunt_start_time + species.estimated_hunting_time,
+                deadline_is_derived=True,
+                status='NOT_STARTED',
+            )
+            games_by_species[species.pk] = game
+            child_games.append(game)
 
-        # 親Gameの状態を更新（parent_gameを使用）
-        if self.parent_game:
-            parent_game = self.parent_game
-            child_games = parent_game.child_games.all()
-            
-            # 状態の伝搬ルール
-            if child_games.filter(status='HUNTING').exists():
-                parent_game.status = 'HUNTING'
-            elif child_games.filter(status='ESCAPED').exists():
-                parent_game.status = 'ESCAPED'
-            elif child_games.exclude(status='CAPTURED').count() == 0:
-                parent_game.status = 'CAPTURED'
-            elif child_games.filter(status='PENDING').exists():
-                parent_game.status = 'PENDING'
-            else:
-                parent_game.status = 'NOT_STARTED'
-            
-            parent_game.save()
+        with transaction.atomic():
+            Game.objects.bulk_create(child_games)
+
+            # 孫以降は親のpkが確定してから紐付ける
+            nested_games = []
+            for species, game in zip(descendants, child_games):
+                if game.parent_game_id is None:
+                    game.parent_game = games_by_species[species.parent_species_id]
+                    nested_games.append(game)
+            if nested_games:
+                Game.objects.bulk_update(nested_games, ['parent_game'])
+
+            # 子が全て未着手なので、自身の状態も最後に1度だけ確定させる
+            self.status = 'NOT_STARTED'
+            self.save()
+
+        events.publish('game.tree_created', {
+            'id': self.pk, 'descendants': [game.pk for game in child_games],
+        }, self.owner_id)
+
+        return child_games
+
+    def delete(self, *args, **kwargs):
+        """子孫のGameもまとめて削除する"""
+        return Game.objects.delete_subtree(self)
 
     def __str__(self):
         return f"{self.species.title} ({self.get_status_display()})"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['hunt_start_time', 'deadline']),
+            models.Index(fields=['deadline']),
+            models.Index(fields=['status']),
+            models.Index(fields=['is_overdue', 'deadline']),
+            models.Index(fields=['owner', 'is_active']),
+            models.Index(fields=['owner', 'hunt_start_time']),
+            models.Index(fields=['owner', 'deadline']),
+        ]
+        constraints = [
+            # アクティブなGameは所有者ごとに高々1つ（所有者なしの行どうしも1つにする）
+            models.UniqueConstraint(
+                Coalesce('owner', 0),
+                condition=Q(is_active=True),
+                name='unique_active_game_per_owner',
+            ),
+        ]
+
+
+class ArchivedGame(models.Model):
+    """
+    アーカイブされた終了済みGame（精度の集計と復元に必要な列だけを持つ）
+
+    pkは元のGameのpkのままにして、復元時に同じpkで戻す。
+    """
+    id = models.BigIntegerField(primary_key=True)
+    root_id = models.BigIntegerField(db_index=True, help_text="木の根のGameのpk")
+    parent_game_id = models.BigIntegerField(null=True, blank=True)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='archived_games',
+    )
+    species = models.ForeignKey(Species, on_delete=models.CASCADE, related_name='archived_games')
+    status = models.CharField(max_length=20, choices=Game.STATUS_CHOICES)
+    hunt_start_time = models.DateTimeField()
+    deadline = models.DateTimeField(null=True, blank=True)
+    actual_hunting_time = models.DurationField(null=True, blank=True)
+    finished_estimate = models.DurationField(null=True, blank=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    objects = OwnedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hunt_start_time']),
+        ]
+
+
+class SpeciesEstimateStats(models.Model):
+    """種ごとの捕獲実績のストリーミング統計（estimation.update_statsで1件ずつ更新する）"""
+    species = models.OneToOneField(
+        Species, on_delete=models.CASCADE, primary_key=True, related_name='estimate_stats'
+    )
+    samples = models.PositiveIntegerField(default=0)
+    ewma_seconds = models.FloatField(default=0)
+    sketch = models.JSONField(default=dict, help_text="P²法の分位点推定の状態")
+    suggested_estimate = models.DurationField(null=True, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+
+class EstimateRollup(models.Model):
+    """種・期間ごとの推定所要時間の精度の集計（Gameの終了時に差分で更新される）"""
+    PERIOD_CHOICES = [
+        ('day', '日'),
+        ('week', '週'),
+        ('month', '月'),
+    ]
+    species = models.ForeignKey(Species, on_delete=models.CASCADE, related_name='estimate_rollups')
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    bucket_start = models.DateField(help_text="期間の開始日")
+
+    count = models.PositiveIntegerField(default=0, help_text="終了したGameの数")
+    captured = models.PositiveIntegerField(default=0)
+    escaped = models.PositiveIntegerField(default=0)
+    timed = models.PositiveIntegerField(default=0, help_text="実績と推定の両方があるGameの数")
+    total_actual = models.DurationField(default=timedelta(0))
+    total_overrun = models.DurationField(default=timedelta(0))
+    overrun_histogram = models.JSONField(
+        default=analytics.empty_histogram,
+        help_text="超過時間の区間ごとの件数（区間はanalytics.OVERRUN_BUCKETS）"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['species', 'period', 'bucket_start'], name='unique_estimate_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'bucket_start']),
+        ]
+
+
+@receiver([post_save, post_delete], sender=Genus)
+def invalidate_genus_cache(sender, instance, **kwargs):
+    """属の読み取りキャッシュを無効化"""
+    if receivers.is_suspended('species'):
+        return
+    cache.invalidate('genus')
+
 
 @receiver(post_save, sender=Species)
 def update_parent_species(sender, instance, created, **kwargs):
     """Update parent species when a subspecies is created or updated"""
-    """Note: parentに対してsaveメソッドを呼ぶことで、親の親も再帰的に更新される"""
-    if instance.parent_species:
-        parent = instance.parent_species
-        parent.save()
+    """Note: 祖先の推定所要時間には変化量だけを加算する"""
+    previous = getattr(instance, '_rollup_previous', None)
+    parent = getattr(instance, '_rollup_parent', None)
+    instance._rollup_previous = instance._rollup_parent = None
+    # 一括処理では最後にまとめて合計を求め直す
+    if receivers.is_suspended('species'):
+        return
+    cache.invalidate('species')
+
+    if previous is None or previous['parent_species_id'] != instance.parent_species_id:
+        if previous is not None and previous['parent_species_id'] is not None:
+            old_value = previous['estimated_hunting_time'] + rollup.pending_delta(instance.pk)
+            rollup.detach(rollup.path_ids(previous['path']), old_value)
+        if parent is not None:
+            value = instance.estimated_hunting_time + rollup.pending_delta(instance.pk)
+            rollup.attach(parent, value)
+    elif instance.parent_species_id is not None:
+        delta = instance.estimated_hunting_time - previous['estimated_hunting_time']
+        rollup.add_delta(instance.ancestor_ids, delta)
 
 
 @receiver(post_delete, sender=Species)
 def handle_deleted_species(sender, instance, **kwargs):
     """Update parent species when a subspecies is deleted"""
-    # CASCADEで削除されるので、親Speciesが存在するか確認
-    def safe_get_parent(sp):
-        try:
-            parent = sp.parent_species
-            return parent, parent is not None
-        except Species.DoesNotExist:
-            return None, False
-
-    parent, parent_exists = safe_get_parent(instance)
-    if parent_exists:
-        # 他の子Speciesがないか確認
-        if not parent.subspecies.exclude(pk=instance.pk).exists():
-            parent.is_leaf_species = True
-        parent.save()
+    if receivers.is_suspended('species'):
+        return
+    cache.invalidate('species')
+    # CASCADEで親Speciesも同時に削除された場合は何もしない
+    if instance.parent_species_id is None:
+        return
+    if not Species.objects.filter(pk=instance.parent_species_id).exists():
+        return
+
+    value = instance.estimated_hunting_time + rollup.pending_delta(instance.pk)
+    rollup.detach(instance.ancestor_ids, value)
+
+
+@receiver(post_save, sender=Game)
+def publish_game_saved(sender, instance, created, **kwargs):
+    """Gameの作成・更新を購読者へ配信"""
+    if receivers.is_suspended('game'):
+        return
+    cache.invalidate('game')
+    events.publish('game.created' if created else 'game.updated', events.game_delta(instance), instance.owner_id)
+
+
+@receiver(post_delete, sender=Game)
+def publish_game_deleted(sender, instance, **kwargs):
+    """Gameの削除を購読者へ配信"""
+    if receivers.is_suspended('game'):
+        return
+    cache.invalidate('game')
+    events.publish('game.deleted', {'id': instance.pk}, instance.owner_id)
+
+
+@receiver(post_save, sender=Game)
+def record_game_saved(sender, instance, **kwargs):
+    """終了したGameの寄与を精度の集計・推定の学習へ反映（_loaded_valuesは保存前の値のまま）"""
+    if receivers.is_suspended('game'):
+        return
+    values = [(analytics.game_values(instance, loaded=True), analytics.game_values(instance))]
+    analytics.record(values)
+    estimation.observe(values)
+
+
+@receiver(post_delete, sender=Game)
+def record_game_deleted(sender, instance, **kwargs):
+    """削除されたGameの寄与を精度の集計から引く"""
+    if receivers.is_suspended('game'):
+        return
+    analytics.record([(analytics.game_values(instance), None)])
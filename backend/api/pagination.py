@@ -0,0 +1,39 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+DEFAULTS = {
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 1000,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'TIMETOHUNT_PAGINATION', {}).get(name, DEFAULTS[name])
+
+
+class OptInCursorPagination(CursorPagination):
+    """
+    キーセット（カーソル）方式のページング
+
+    既存のクライアントが配列のレスポンスを前提にしているため、
+    ?cursor= か ?page_size= が指定された場合だけページングする。
+    """
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = get_setting('PAGE_SIZE')
+        self.max_page_size = get_setting('MAX_PAGE_SIZE')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class IdCursorPagination(OptInCursorPagination):
+    ordering = ('id',)
+
+
+class GameCursorPagination(OptInCursorPagination):
+    ordering = ('hunt_start_time', 'id')
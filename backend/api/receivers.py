@@ -0,0 +1,32 @@
+"""
+モデルのシグナル受信処理を一時的に止める仕組み
+
+アーカイブや一括削除のように、行ごとの受信処理（差分の伝搬・集計・配信）の代わりに
+まとめて後始末をする処理で使う。停止はスレッドごとで、入れ子にできる。
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+_state = threading.local()
+
+
+def _suspended():
+    if not hasattr(_state, 'groups'):
+        _state.groups = Counter()
+    return _state.groups
+
+
+@contextmanager
+def suspended(*groups):
+    """指定したグループ（'game', 'species'）の受信処理をブロック内で止める"""
+    counts = _suspended()
+    counts.update(groups)
+    try:
+        yield
+    finally:
+        counts.subtract(groups)
+
+
+def is_suspended(group):
+    return _suspended()[group] > 0
@@ -0,0 +1,108 @@
+"""
+Speciesの推定所要時間を祖先へ差分で伝搬する仕組み
+
+葉Speciesの変更は、変化量(delta)をpathに並ぶ祖先へ加算するだけで反映する。
+deferred()の中では差分を祖先ごとに貯めておき、ブロックの終わりに1度だけ書き込む。
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+
+_state = threading.local()
+
+
+def _pending():
+    return getattr(_state, 'pending', None)
+
+
+def pending_delta(species_id):
+    """まだ書き込まれていない差分"""
+    pending = _pending()
+    if pending is None:
+        return timedelta()
+    return pending.get(species_id, timedelta())
+
+
+def path_ids(path):
+    """pathに並ぶ祖先のpk（根から順）"""
+    return [int(pk) for pk in path.split('/') if pk]
+
+
+@contextmanager
+def deferred():
+    """ブロック内の差分をまとめ、影響を受けた祖先ごとに1度だけ書き込む"""
+    if _pending() is not None:
+        # 外側のdeferred()でまとめて書き込む
+        yield
+        return
+
+    _state.pending = defaultdict(timedelta)
+    try:
+        with transaction.atomic():
+            yield
+            _apply(_state.pending)
+    finally:
+        _state.pending = None
+
+
+def add_delta(species_ids, delta):
+    """指定したSpeciesの推定所要時間にdeltaを加算"""
+    if not delta or not species_ids:
+        return
+    pending = _pending()
+    if pending is None:
+        _apply({pk: delta for pk in species_ids})
+        return
+    for pk in species_ids:
+        pending[pk] += delta
+
+
+def _apply(deltas):
+    from . import cache
+    from .models import Species
+
+    # 同じ差分を持つ祖先は1つのUPDATEにまとめる
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        Species.objects.filter(pk__in=pks).update(
+            estimated_hunting_time=F('estimated_hunting_time') + delta
+        )
+    if by_delta:
+        cache.invalidate('species')
+
+
+def attach(parent, value):
+    """
+    parentの下に推定所要時間valueの子が加わったことを反映
+
+    parentはsave時点のDB上の値 (pk, path, is_leaf_species, estimated_hunting_time)
+    """
+    from .models import Species
+
+    ancestors = path_ids(parent['path']) + [parent['pk']]
+    if parent['is_leaf_species']:
+        # 葉だった親は、自身の値の代わりに子の合計を持つようになる
+        Species.objects.filter(pk=parent['pk']).update(is_leaf_species=False)
+        current = parent['estimated_hunting_time'] + pending_delta(parent['pk'])
+        add_delta(ancestors, value - current)
+    else:
+        add_delta(ancestors, value)
+
+
+def detach(ancestor_ids, value):
+    """祖先ancestor_ids（末尾が親）の下から推定所要時間valueの子が外れたことを反映"""
+    from .models import Species
+
+    parent_id = ancestor_ids[-1]
+    if not Species.objects.filter(parent_species_id=parent_id).exists():
+        # 子がいなくなった親は葉に戻り、それまでの合計をそのまま自身の値として持つ
+        Species.objects.filter(pk=parent_id).update(is_leaf_species=True)
+        return
+    add_delta(ancestor_ids, -value)
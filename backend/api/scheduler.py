@@ -0,0 +1,73 @@
+"""
+プロセス内の定期実行
+
+TIMETOHUNT_SCHEDULER['JOBS'] に「関数のドット区切りのパス: 実行間隔（秒）」を並べると、
+ENABLEDのときAppConfig.ready()から起動するデーモンスレッドが順に実行する。
+複数のサーバープロセスで動かす場合は、1つのプロセスだけで有効にすること。
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'JOBS': {},
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'TIMETOHUNT_SCHEDULER', {}).get(name, DEFAULTS[name])
+
+
+class Scheduler(threading.Thread):
+    def __init__(self, jobs):
+        super().__init__(name='timetohunt-scheduler', daemon=True)
+        self.jobs = jobs
+        self.stopped = threading.Event()
+
+    def run(self):
+        now = time.monotonic()
+        due = {path: now + interval for path, interval in self.jobs.items()}
+        while not self.stopped.is_set():
+            path = min(due, key=due.get)
+            if self.stopped.wait(max(0, due[path] - time.monotonic())):
+                break
+            self.run_job(path)
+            due[path] = time.monotonic() + self.jobs[path]
+
+    @staticmethod
+    def run_job(path):
+        try:
+            result = import_string(path)()
+            logger.info('Scheduled job %s finished: %s', path, result)
+        except Exception:
+            logger.exception('Scheduled job %s failed', path)
+        finally:
+            close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
+
+
+_scheduler = None
+
+
+def start():
+    """設定が有効なら定期実行のスレッドを1度だけ起動"""
+    global _scheduler
+    if _scheduler is not None or not get_setting('ENABLED') or not get_setting('JOBS'):
+        return None
+    # runserverの自動再読み込みでは、監視側の親プロセスでは起動しない
+    if 'runserver' in sys.argv and os.environ.get('RUN_MAIN') != 'true':
+        return None
+    _scheduler = Scheduler(dict(get_setting('JOBS')))
+    _scheduler.start()
+    return _scheduler
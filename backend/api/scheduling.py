@@ -0,0 +1,59 @@
+"""
+日の計画を自動で組み立てるスケジューラ
+
+1. 期限の早い順に詰めていき、期限に間に合わなくなったら間に合うまで優先度の低いゲームを外す
+   （Moore-Hodgson法の優先度付き版）
+2. 残ったゲームを後ろから並べ、その位置に置けるもののうち優先度の最も低いものを最後に回す
+   （これで期限を守ったまま優先度の高いゲームができるだけ前に来る）
+
+どちらもヒープを使うので O(n log n) で済む。
+"""
+import heapq
+from collections import namedtuple
+from datetime import timedelta
+
+Job = namedtuple('Job', ['id', 'duration', 'deadline', 'priority'])
+Slot = namedtuple('Slot', ['job', 'start', 'end'])
+
+
+def build_plan(jobs, start, end):
+    """
+    半開区間 [start, end) に収まる計画を作る
+
+    (開始順に並んだSlotのリスト, [(Job, 理由), ...]) を返す。
+    """
+    unscheduled = []
+    candidates = []
+    for job in jobs:
+        deadline = min(job.deadline, end) if job.deadline else end
+        if start + job.duration > deadline:
+            reason = 'deadline' if job.deadline and job.deadline < end else 'window'
+            unscheduled.append((job, reason))
+        else:
+            candidates.append(job._replace(deadline=deadline))
+
+    # 期限順に詰め、間に合わなくなったら間に合うまで優先度の低いものから外す
+    candidates.sort(key=lambda job: (job.deadline, job.priority, job.id))
+    kept, total = [], timedelta()
+    for job in candidates:
+        heapq.heappush(kept, (-job.priority, -job.duration, -job.id, job))
+        total += job.duration
+        while start + total > job.deadline:
+            *_, dropped = heapq.heappop(kept)
+            total -= dropped.duration
+            unscheduled.append((dropped, 'capacity'))
+
+    # 後ろから、置ける中で優先度の最も低いものを最後に回す
+    remaining = sorted((entry[-1] for entry in kept), key=lambda job: job.deadline, reverse=True)
+    eligible, slots, cursor, i = [], [], start + total, 0
+    while i < len(remaining) or eligible:
+        while i < len(remaining) and remaining[i].deadline >= cursor:
+            job = remaining[i]
+            heapq.heappush(eligible, (-job.priority, -job.deadline.timestamp(), -job.id, job))
+            i += 1
+        *_, job = heapq.heappop(eligible)
+        slots.append(Slot(job, cursor - job.duration, cursor))
+        cursor -= job.duration
+
+    slots.reverse()
+    return slots, unscheduled
@@ -1,34 +1,98 @@
 from rest_framework import serializers
-from .models import Genus, Species, Game
+from .models import Genus, Species, Game, ArchivedGame, EstimateRollup
 
 
-class GenusSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    fields引数で指定されたフィールドだけを返すSerializer
+
+    Meta.sparse_field_sources には、モデルの列名と異なるフィールドが読む列を書いておく。
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def get_available_fields(cls):
+        return list(cls().fields)
+
+    @classmethod
+    def get_source_columns(cls, fields):
+        """指定フィールドの出力に必要なモデルの列"""
+        sources = getattr(cls.Meta, 'sparse_field_sources', {})
+        model_fields = {field.name for field in cls.Meta.model._meta.concrete_fields}
+        columns = set()
+        for name in fields:
+            if name in sources:
+                columns.update(sources[name])
+            elif name in model_fields:
+                columns.add(name)
+        return columns
+
+
+class OwnedRelationsMixin:
+    """
+    関連先として選べる行を、リクエストしたユーザーが所有する行に限るSerializer
+
+    対象のフィールドは Meta.owned_relations に並べる（contextにrequestがない場合は限らない）。
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is not None:
+            for name in getattr(self.Meta, 'owned_relations', ()):
+                field = fields.get(name)
+                if field is not None and not field.read_only:
+                    field.queryset = field.queryset.owned_by(request.user)
+        return fields
+
+
+class GenusSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Genus
         fields = '__all__'
 
 
-class SpeciesSerializer(serializers.ModelSerializer):
+class SpeciesSerializer(OwnedRelationsMixin, SparseFieldsMixin, serializers.ModelSerializer):
     genus_name = serializers.CharField(source='genus.name', read_only=True)
     is_leaf_species = serializers.BooleanField(read_only=True)
+    suggested_estimate = serializers.DurationField(
+        source='estimate_stats.suggested_estimate', read_only=True, allow_null=True
+    )
 
     class Meta:
         model = Species
         fields = [
             'id', 'title', 'description', 'genus', 'parent_species', 'genus_name',
-            'priority', 'estimated_hunting_time',
+            'priority', 'estimated_hunting_time', 'suggested_estimate', 'auto_update_estimate',
             'is_leaf_species', 'created_at', 'updated_at'
         ]
+        sparse_field_sources = {
+            'genus_name': ['genus__name'],
+            'suggested_estimate': ['estimate_stats__suggested_estimate'],
+        }
+        owned_relations = ['genus', 'parent_species']
 
     def validate(self, data):
         if not data.get('is_leaf_species', True) and data.get('estimated_hunting_time'):
             raise serializers.ValidationError({
                 'estimated_hunting_time': 'Cannot set hunting time directly for parent species.'
             })
+        parent = data.get('parent_species')
+        if self.instance and parent and (
+            parent.pk == self.instance.pk or self.instance.pk in parent.ancestor_ids
+        ):
+            raise serializers.ValidationError({
+                'parent_species': 'Cannot move a species under itself or its descendants.'
+            })
         return data
 
 
-class GameSerializer(serializers.ModelSerializer):
+class GameSerializer(OwnedRelationsMixin, SparseFieldsMixin, serializers.ModelSerializer):
     species_title = serializers.CharField(source='species.title', read_only=True)
     species_parent_species = serializers.PrimaryKeyRelatedField(source='species.parent_species', read_only=True)
     estimated_hunting_time = serializers.DurationField(read_only=True)
@@ -39,3 +103,83 @@ class GameSerializer(serializers.ModelSerializer):
     class Meta:
         model = Game
         fields = '__all__'
+        sparse_field_sources = {
+            'species_title': ['species__title'],
+            'species_parent_species': ['species__parent_species'],
+            'estimated_hunting_time': ['species__estimated_hunting_time'],
+            'remaining_time': ['deadline'],
+            'is_expired': ['deadline'],
+            'is_leaf_game': [],
+        }
+        owned_relations = ['species', 'parent_game']
+
+
+class ArchivedGameSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    species_title = serializers.CharField(source='species.title', read_only=True)
+
+    class Meta:
+        model = ArchivedGame
+        fields = '__all__'
+        sparse_field_sources = {
+            'species_title': ['species__title'],
+        }
+
+
+class EstimateAccuracySerializer(serializers.Serializer):
+    """analytics.summarize() が返す精度のレポートの1行"""
+    period = serializers.ChoiceField(choices=EstimateRollup.PERIOD_CHOICES)
+    bucket_start = serializers.DateField()
+    count = serializers.IntegerField()
+    captured = serializers.IntegerField()
+    escaped = serializers.IntegerField()
+    capture_rate = serializers.FloatField()
+    escape_rate = serializers.FloatField()
+    total_actual = serializers.DurationField()
+    mean_overrun = serializers.DurationField(allow_null=True)
+    overrun_p50 = serializers.DurationField(allow_null=True)
+    overrun_p50_open = serializers.BooleanField()
+    overrun_p90 = serializers.DurationField(allow_null=True)
+    overrun_p90_open = serializers.BooleanField()
+
+
+class SpeciesAccuracySerializer(EstimateAccuracySerializer):
+    species = serializers.IntegerField()
+
+
+class GenusAccuracySerializer(EstimateAccuracySerializer):
+    genus = serializers.IntegerField(allow_null=True)
+
+
+class TimelineDaySerializer(serializers.Serializer):
+    """timeline.build_timeline() が返す1日分"""
+    date = serializers.DateField()
+    planned = serializers.DurationField()
+    available = serializers.DurationField()
+    games = GameSerializer(many=True)
+
+
+class TimelineOverlapSerializer(serializers.Serializer):
+    games = serializers.ListField(child=serializers.IntegerField())
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+
+
+class ScheduleRequestSerializer(serializers.Serializer):
+    """games/schedule/ の本文のうち期間以外（期間はparse_time_windowで読む）"""
+    game_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_null=True)
+    dry_run = serializers.BooleanField(default=False)
+
+
+def serialize_species_tree(species_list):
+    """
+    Speciesの一覧を入れ子の木に組み立てる（O(n)）
+
+    親が一覧に含まれないSpeciesを根として扱い、各ノードのchildrenに子を並べる。
+    """
+    nodes = SpeciesSerializer(species_list, many=True).data
+    by_id = {node['id']: {**node, 'children': []} for node in nodes}
+    roots = []
+    for node in by_id.values():
+        parent = by_id.get(node['parent_species'])
+        (parent['children'] if parent else roots).append(node)
+    return roots
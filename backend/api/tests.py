@@ -1,3 +1,1595 @@
-from django.test import TestCase
+import asyncio
+import json
+import math
+import time
+from datetime import datetime, timedelta
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from TimeToHunt import instrumentation
+from TimeToHunt.database import sqlite_database
+
+from . import (
+    analytics, archive, benchmarks, cache, datagen, estimation, events, expiry, loadtest, rollup, scheduler,
+    scheduling, timeline, transfer,
+)
+from .models import Genus, Species, Game, ArchivedGame, EstimateRollup, SpeciesEstimateStats
+
+
+class RecordingBackend(events.LocalBackend):
+    """配信されたイベントを記録するテスト用バックエンド"""
+    published = []
+
+    def publish(self, event):
+        self.published.append(event)
+        super().publish(event)
+
+
+def build_species_tree(genus, depth, fanout, parent=None, minutes=10):
+    """depth段・fanout分岐のSpecies木を作成して根を返す"""
+    root = Species.objects.create(
+        title='root', genus=genus, parent_species=parent,
+        estimated_hunting_time=timedelta(minutes=minutes),
+    )
+    level = [root]
+    for d in range(depth):
+        next_level = []
+        for parent_species in level:
+            for i in range(fanout):
+                next_level.append(Species.objects.create(
+                    title=f'{parent_species.title}-{i}',
+                    genus=genus,
+                    parent_species=parent_species,
+                    estimated_hunting_time=timedelta(minutes=minutes),
+                ))
+        level = next_level
+    return root
+
+
+class GameCreateTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+
+    def create_game(self, species):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/games/', {'species': species.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_creates_whole_game_tree(self):
+        root = build_species_tree(self.genus, depth=2, fanout=3)
+        response, _ = self.create_game(root)
+
+        root_game = Game.objects.get(pk=response.data['id'])
+        self.assertEqual(Game.objects.count(), 1 + 3 + 9)
+        self.assertEqual(root_game.child_games.count(), 3)
+        for child in root_game.child_games.all():
+            self.assertEqual(child.child_games.count(), 3)
+        for game in Game.objects.exclude(pk=root_game.pk):
+            self.assertEqual(game.status, 'NOT_STARTED')
+            self.assertEqual(game.hunt_start_time, root_game.hunt_start_time)
+            self.assertEqual(
+                game.deadline, game.hunt_start_time + game.species.estimated_hunting_time
+            )
+        self.assertEqual(root_game.status, 'NOT_STARTED')
+        self.assertFalse(response.data['is_leaf_game'])
+
+    def test_query_count_only_grows_with_bulk_batches(self):
+        _, small = self.create_game(build_species_tree(self.genus, depth=2, fanout=2))
+        _, large = self.create_game(build_species_tree(self.genus, depth=3, fanout=4))
+        # 行ごとには増えず、一括作成・一括更新のバッチが分かれた分だけ増える
+        games = 4 + 16 + 64
+        fields = [field for field in Game._meta.concrete_fields if not field.primary_key]
+        batches = math.ceil(games / connection.ops.bulk_batch_size(fields, [None] * games))
+        self.assertLessEqual(large - small, 2 * (batches - 1))
+
+
+class SpeciesHierarchyTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(self.genus, depth=2, fanout=2)
+        self.child, self.other_child = self.root.subspecies.order_by('pk')
+
+    def test_path_and_depth_are_maintained_on_create(self):
+        grandchild = self.child.subspecies.first()
+        self.assertEqual(self.root.path, '')
+        self.assertEqual(grandchild.path, f'{self.root.pk}/{self.child.pk}/')
+        self.assertEqual(grandchild.depth, 2)
+        self.assertEqual(
+            [s.pk for s in grandchild.get_ancestors()], [self.root.pk, self.child.pk]
+        )
+        self.assertEqual(self.root.get_descendants().count(), 6)
+
+    def test_reparent_moves_whole_subtree(self):
+        new_root = Species.objects.create(title='new root', genus=self.genus)
+        response = self.client.patch(
+            f'/api/species/{self.child.pk}/', {'parent_species': new_root.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(
+            sorted(s.pk for s in new_root.get_descendants()),
+            sorted([self.child.pk] + [s.pk for s in self.child.subspecies.all()]),
+        )
+        self.assertEqual(self.root.get_descendants().count(), 3)
+        for grandchild in self.child.subspecies.all():
+            self.assertEqual(grandchild.path, f'{new_root.pk}/{self.child.pk}/')
+            self.assertEqual(grandchild.depth, 2)
+
+    def test_reparent_under_descendant_is_rejected(self):
+        grandchild = self.child.subspecies.first()
+        response = self.client.patch(
+            f'/api/species/{self.root.pk}/', {'parent_species': grandchild.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_rebuild_hierarchy_restores_paths(self):
+        Species.objects.update(path='', depth=0)
+        Species.objects.rebuild_hierarchy()
+        grandchild = self.other_child.subspecies.first()
+        self.assertEqual(grandchild.path, f'{self.root.pk}/{self.other_child.pk}/')
+        self.assertEqual(self.root.get_descendants().count(), 6)
+
+
+class HuntingTimeRollupTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(self.genus, depth=2, fanout=2)
+        self.child, self.other_child = self.root.subspecies.order_by('pk')
+
+    def assertTotal(self, species, minutes):
+        species.refresh_from_db()
+        self.assertEqual(species.estimated_hunting_time, timedelta(minutes=minutes))
+
+    def test_totals_are_rolled_up_on_create(self):
+        self.assertTotal(self.root, 40)
+        self.assertTotal(self.child, 20)
+        self.assertFalse(Species.objects.get(pk=self.root.pk).is_leaf_species)
+
+    def test_leaf_edit_adds_delta_to_ancestors(self):
+        leaf = self.child.subspecies.first()
+        response = self.client.patch(
+            f'/api/species/{leaf.pk}/', {'estimated_hunting_time': '00:25:00'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTotal(self.child, 35)
+        self.assertTotal(self.root, 55)
+        self.assertTotal(self.other_child, 20)
+
+    def test_parent_total_cannot_be_overwritten(self):
+        self.client.patch(
+            f'/api/species/{self.child.pk}/', {'estimated_hunting_time': '05:00:00'}, format='json'
+        )
+        self.assertTotal(self.child, 20)
+        self.assertTotal(self.root, 40)
+
+    def test_deferred_writes_each_ancestor_once(self):
+        leaves = list(Species.objects.filter(is_leaf_species=True))
+        with CaptureQueriesContext(connection) as ctx, rollup.deferred():
+            for leaf in leaves:
+                leaf.estimated_hunting_time = timedelta(minutes=25)
+                leaf.save()
+        rollup_updates = [
+            q for q in ctx.captured_queries
+            if q['sql'].startswith('UPDATE "api_species" SET "estimated_hunting_time" = ("api_species"')
+        ]
+        self.assertEqual(len(rollup_updates), 2)
+        self.assertTotal(self.child, 50)
+        self.assertTotal(self.root, 100)
+
+    def test_delete_subtracts_from_ancestors(self):
+        self.child.subspecies.first().delete()
+        self.assertTotal(self.child, 10)
+        self.assertTotal(self.root, 30)
+
+        # 最後の子を失った親は葉に戻り、値はそのまま残る
+        self.child.subspecies.first().delete()
+        self.assertTotal(self.child, 10)
+        self.assertTotal(self.root, 30)
+        self.assertTrue(Species.objects.get(pk=self.child.pk).is_leaf_species)
+
+    def test_delete_of_subtree_subtracts_once(self):
+        self.child.delete()
+        self.assertTotal(self.root, 20)
+
+    def test_reparent_moves_total(self):
+        new_root = Species.objects.create(
+            title='new root', genus=self.genus, estimated_hunting_time=timedelta(minutes=5)
+        )
+        self.child.parent_species = new_root
+        self.child.save()
+        self.assertTotal(new_root, 20)
+        self.assertTotal(self.root, 20)
+
+    def test_recompute_totals_repairs_drift(self):
+        Species.objects.filter(pk__in=[self.root.pk, self.child.pk]).update(
+            estimated_hunting_time=timedelta(0)
+        )
+        self.assertEqual(Species.objects.recompute_totals(), 2)
+        self.assertTotal(self.child, 20)
+        self.assertTotal(self.root, 40)
+
+
+class GameStatusPropagationTests(APITestCase):
+    def setUp(self):
+        genus = Genus.objects.create(name='genus')
+        self.root_species = build_species_tree(genus, depth=4, fanout=2)
+        self.client.post('/api/games/', {'species': self.root_species.pk}, format='json')
+        self.root = Game.objects.get(parent_game__isnull=True)
+        self.leaves = list(Game.objects.filter(child_games__isnull=True).order_by('pk'))
+
+    def ancestors(self, game):
+        chain = []
+        while game.parent_game_id:
+            game = Game.objects.get(pk=game.parent_game_id)
+            chain.append(game)
+        return chain
+
+    def test_start_hunting_marks_ancestors_hunting(self):
+        leaf = self.leaves[0]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(f'/api/games/{leaf.pk}/start_hunting/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_active'])
+        for game in self.ancestors(leaf):
+            self.assertEqual(game.status, 'HUNTING')
+            self.assertFalse(game.is_active)
+        # 1段あたり2クエリ程度に収まる
+        self.assertLessEqual(len(ctx.captured_queries), 10 + 2 * 4)
+
+    def test_switching_hunt_demotes_previous_leaf(self):
+        first, second = self.leaves[0], self.leaves[-1]
+        self.client.post(f'/api/games/{first.pk}/start_hunting/')
+        self.client.post(f'/api/games/{second.pk}/start_hunting/')
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'PENDING')
+        self.assertFalse(first.is_active)
+        self.assertEqual(Game.objects.get(pk=self.root.pk).status, 'HUNTING')
+        self.assertEqual(self.ancestors(first)[0].status, 'PENDING')
+
+    def test_completing_every_leaf_captures_root(self):
+        for leaf in self.leaves:
+            self.client.post(f'/api/games/{leaf.pk}/start_hunting/')
+            self.client.post(f'/api/games/{leaf.pk}/complete_hunting/')
+        self.assertEqual(Game.objects.get(pk=self.root.pk).status, 'CAPTURED')
+        self.assertFalse(Game.objects.exclude(status='CAPTURED').exists())
+
+    def test_escaped_child_wins_over_pending(self):
+        leaf = self.leaves[0]
+        leaf.status = 'ESCAPED'
+        leaf.save()
+        self.assertEqual(Game.objects.get(pk=self.root.pk).status, 'ESCAPED')
+
+
+class ListQueryCountTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+
+    def add_rows(self, count):
+        root = build_species_tree(self.genus, depth=1, fanout=count)
+        for _ in range(count):
+            self.client.post('/api/games/', {'species': root.pk}, format='json')
+        return root
+
+    def assertConstantQueries(self, url, num, make_url=None):
+        for count in (2, 6):
+            root = self.add_rows(count)
+            with self.assertNumQueries(num):
+                response = self.client.get(make_url(root) if make_url else url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_game_list(self):
+        self.assertConstantQueries('/api/games/', 1)
+
+    def test_species_list(self):
+        self.assertConstantQueries('/api/species/', 1)
+
+    def test_genus_species(self):
+        self.assertConstantQueries(f'/api/genera/{self.genus.pk}/species/', 2)
+
+    def test_species_games(self):
+        self.assertConstantQueries(None, 2, lambda root: f'/api/species/{root.pk}/games/')
+
+    def test_species_subspecies(self):
+        self.assertConstantQueries(None, 2, lambda root: f'/api/species/{root.pk}/subspecies/')
+
+
+class DailyGamesWindowTests(APITestCase):
+    def setUp(self):
+        genus = Genus.objects.create(name='genus')
+        self.species = Species.objects.create(
+            title='leaf', genus=genus, estimated_hunting_time=timedelta(hours=1)
+        )
+
+    def make_game(self, start, deadline=None):
+        return Game.objects.create(
+            species=self.species,
+            hunt_start_time=timezone.make_aware(start),
+            deadline=timezone.make_aware(deadline) if deadline else None,
+        )
+
+    def ids(self, query):
+        response = self.client.get(f'/api/games/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return {game['id'] for game in response.data}
+
+    def test_date_is_a_half_open_day_window(self):
+        last_second = self.make_game(datetime(2024, 5, 1, 23, 59, 30))
+        running = self.make_game(datetime(2024, 4, 30, 23, 0), datetime(2024, 5, 1, 0, 30))
+        ended_at_midnight = self.make_game(datetime(2024, 4, 30, 23, 0), datetime(2024, 5, 1, 0, 0))
+        next_day = self.make_game(datetime(2024, 5, 2, 0, 0))
+
+        ids = self.ids('date=2024-05-01')
+        self.assertEqual(ids, {last_second.pk, running.pk})
+        self.assertNotIn(ended_at_midnight.pk, ids)
+        self.assertNotIn(next_day.pk, ids)
+
+    def test_start_and_end_select_multiple_days(self):
+        first = self.make_game(datetime(2024, 5, 1, 9, 0))
+        last = self.make_game(datetime(2024, 5, 3, 22, 0))
+        self.make_game(datetime(2024, 5, 4, 9, 0))
+        self.assertEqual(self.ids('start=2024-05-01&end=2024-05-03'), {first.pk, last.pk})
+
+    def test_invalid_window_is_rejected(self):
+        self.assertEqual(self.client.get('/api/games/?date=2024-13-01').status_code, 400)
+        self.assertEqual(self.client.get('/api/games/?start=2024-05-01').status_code, 400)
+
+    def test_window_is_bounded_on_both_index_branches(self):
+        start = timezone.make_aware(datetime(2024, 5, 1))
+        for games in (Game.objects.all(), Game.objects.owned_by(None)):
+            plan = games.overlapping(start, start + timedelta(days=1)).explain()
+            self.assertIn('MULTI-INDEX OR', plan)
+            self.assertIn('hunt_start_time>? AND hunt_start_time<?', plan)
+            self.assertIn('deadline>?', plan)
+            # 期間の前に始まった履歴全体を読む検索（hunt_start_time<? だけ）にはならない
+            self.assertNotIn('SCAN', plan)
+            self.assertNotRegex(plan, r'\(hunt_start_time<\?\)|owner_id=\? AND hunt_start_time<\?\)')
+
+
+class ActiveGameTests(APITestCase):
+    def setUp(self):
+        genus = Genus.objects.create(name='genus')
+        root = build_species_tree(genus, depth=2, fanout=2)
+        self.client.post('/api/games/', {'species': root.pk}, format='json')
+        self.leaves = list(Game.objects.filter(child_games__isnull=True).order_by('pk'))
+
+    def test_active_game_is_a_single_query(self):
+        self.client.post(f'/api/games/{self.leaves[0].pk}/start_hunting/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/active_game/')
+        self.assertEqual(response.data['id'], self.leaves[0].pk)
+
+    def test_no_active_game(self):
+        self.assertEqual(self.client.get('/api/active_game/').status_code, 404)
+
+    def test_switch_leaves_shared_ancestors_untouched(self):
+        first, sibling = self.leaves[0], self.leaves[1]
+        self.client.post(f'/api/games/{first.pk}/start_hunting/')
+        shared = Game.objects.get(pk=first.parent_game_id)
+        touched_at = shared.updated_at
+
+        self.client.post(f'/api/games/{sibling.pk}/start_hunting/')
+        shared.refresh_from_db()
+        self.assertEqual(shared.status, 'HUNTING')
+        self.assertEqual(shared.updated_at, touched_at)
+        self.assertEqual(Game.objects.active().pk, sibling.pk)
+        self.assertEqual(Game.objects.filter(is_active=True).count(), 1)
+
+    def test_only_one_game_can_be_active(self):
+        self.client.post(f'/api/games/{self.leaves[0].pk}/start_hunting/')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Game.objects.filter(pk=self.leaves[1].pk).update(is_active=True)
+
+
+@override_settings(TIMETOHUNT_EVENTS={'BACKEND': 'api.tests.RecordingBackend', 'HEARTBEAT': 1})
+class GameEventTests(APITestCase):
+    def setUp(self):
+        RecordingBackend.published = []
+        genus = Genus.objects.create(name='genus')
+        root = build_species_tree(genus, depth=1, fanout=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/games/', {'species': root.pk}, format='json')
+        self.leaf = Game.objects.filter(child_games__isnull=True).first()
+
+    def published(self, event_type):
+        return [e['data'] for e in RecordingBackend.published if e['type'] == event_type]
+
+    def test_create_publishes_root_and_tree(self):
+        self.assertEqual(len(self.published('game.created')), 1)
+        tree = self.published('game.tree_created')[0]
+        self.assertEqual(len(tree['descendants']), 2)
+
+    def test_start_hunting_publishes_deltas(self):
+        RecordingBackend.published = []
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/games/{self.leaf.pk}/start_hunting/')
+        self.assertEqual(self.published('active.changed'), [{'id': self.leaf.pk}])
+        updated = {data['id']: data['status'] for data in self.published('game.updated')}
+        self.assertEqual(updated[self.leaf.pk], 'HUNTING')
+        self.assertEqual(updated[self.leaf.parent_game_id], 'HUNTING')
+
+    def test_game_created_hunting_publishes_its_id(self):
+        RecordingBackend.published = []
+        with self.captureOnCommitCallbacks(execute=True):
+            game = Game.objects.create(species=self.leaf.species, status='HUNTING')
+        self.assertEqual(self.published('active.changed'), [{'id': game.pk}])
+
+    def test_nothing_is_published_before_commit(self):
+        RecordingBackend.published = []
+        with self.captureOnCommitCallbacks(execute=False):
+            self.client.delete(f'/api/games/{self.leaf.pk}/')
+        self.assertEqual(RecordingBackend.published, [])
+
+
+@override_settings(TIMETOHUNT_EVENTS={'BACKEND': 'api.tests.RecordingBackend', 'HEARTBEAT': 1})
+class GameEventStreamTests(SimpleTestCase):
+    async def test_stream_delivers_published_events(self):
+        response = await self.async_client.get('/api/events/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+
+        events.get_broker().publish('active.changed', {'id': 7})
+        chunk = await anext(stream)
+        self.assertIn(b'event: active.changed', chunk)
+        self.assertIn(b'data: {"id": 7}', chunk)
+        self.assertEqual(await anext(stream), b': keepalive\n\n')
+
+    def test_stream_is_not_served_under_wsgi(self):
+        response = self.client.get('/api/events/')
+        self.assertEqual(response.status_code, 501)
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+
+
+@override_settings(TIMETOHUNT_EVENTS={'BACKEND': 'api.tests.RecordingBackend', 'HEARTBEAT': 1})
+class GameEventOwnerTests(APITestCase):
+    def setUp(self):
+        RecordingBackend.published = []
+        User = get_user_model()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def test_events_carry_the_owner(self):
+        self.client.force_authenticate(self.alice)
+        genus = self.client.post('/api/genera/', {'name': 'genus'}, format='json').data
+        species = self.client.post('/api/species/', {'title': 'leaf', 'genus': genus['id']}, format='json').data
+        with self.captureOnCommitCallbacks(execute=True):
+            game = self.client.post('/api/games/', {'species': species['id']}, format='json').data
+            self.client.post(f"/api/games/{game['id']}/start_hunting/")
+        self.assertTrue(RecordingBackend.published)
+        self.assertEqual({event['owner'] for event in RecordingBackend.published}, {self.alice.pk})
+
+    def test_stream_skips_other_owners_events(self):
+        async def read_stream():
+            await self.async_client.aforce_login(self.bob)
+            response = await self.async_client.get('/api/events/')
+            stream = aiter(response.streaming_content)
+            await anext(stream)
+            broker = events.get_broker()
+            broker.publish('active.changed', {'id': 1}, self.alice.pk)
+            broker.publish('active.changed', {'id': 2}, None)
+            broker.publish('active.changed', {'id': 3}, self.bob.pk)
+            return await anext(stream)
+
+        chunk = async_to_sync(read_stream)()
+        self.assertIn(b'data: {"id": 3}', chunk)
+
+
+@override_settings(TIMETOHUNT_PAGINATION={'PAGE_SIZE': 3, 'MAX_PAGE_SIZE': 5})
+class PaginationAndSparseFieldsTests(APITestCase):
+    def setUp(self):
+        genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(genus, depth=1, fanout=7)
+        start = timezone.now()
+        for i, species in enumerate(self.root.subspecies.order_by('pk')):
+            Game.objects.create(species=species, hunt_start_time=start + timedelta(minutes=i % 3))
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_lists_are_unpaginated_by_default(self):
+        self.assertIsInstance(self.client.get('/api/games/').data, list)
+
+    def test_game_cursor_follows_start_time_then_id(self):
+        ids = self.walk('/api/games/?page_size=3')
+        expected = list(Game.objects.order_by('hunt_start_time', 'id').values_list('pk', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_species_cursor_and_max_page_size(self):
+        response = self.client.get('/api/species/?page_size=50')
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(self.walk('/api/species/?cursor='), sorted(Species.objects.values_list('pk', flat=True)))
+
+    def test_fields_narrow_response_and_columns(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/games/?fields=id,species_title&page_size=3')
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'species_title'})
+        sql = ctx.captured_queries[0]['sql']
+        self.assertIn('"api_species"."title"', sql)
+        self.assertNotIn('"api_game"."actual_hunting_time"', sql)
+        self.assertNotIn('"api_species"."description"', sql)
+
+    def test_unknown_field_is_rejected(self):
+        self.assertEqual(self.client.get('/api/species/?fields=id,nope').status_code, 400)
+
+
+class BulkGameUpdateTests(APITestCase):
+    def setUp(self):
+        genus = Genus.objects.create(name='genus')
+        root = build_species_tree(genus, depth=2, fanout=3)
+        self.client.post('/api/games/', {'species': root.pk}, format='json')
+        self.root = Game.objects.get(parent_game__isnull=True)
+        self.leaves = list(Game.objects.filter(child_games__isnull=True).order_by('pk'))
+
+    def test_reschedules_many_games_in_one_request(self):
+        start = timezone.now() + timedelta(days=1)
+        payload = [
+            {'id': leaf.pk, 'hunt_start_time': (start + timedelta(minutes=10 * i)).isoformat()}
+            for i, leaf in enumerate(self.leaves)
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.patch('/api/games/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), len(self.leaves))
+        self.assertEqual(response.data['errors'], [])
+        self.assertLess(len(ctx.captured_queries), 10)
+        self.assertEqual(Game.objects.get(pk=self.leaves[-1].pk).hunt_start_time, start + timedelta(minutes=80))
+
+    def test_status_changes_propagate_once_per_ancestor(self):
+        payload = [{'id': leaf.pk, 'status': 'CAPTURED'} for leaf in self.leaves]
+        response = self.client.patch('/api/games/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Game.objects.get(pk=self.root.pk).status, 'CAPTURED')
+
+    def test_partial_failures_are_reported_per_item(self):
+        payload = [
+            {'id': self.leaves[0].pk, 'status': 'PENDING'},
+            {'id': self.leaves[1].pk, 'status': 'NOPE'},
+            {'id': 0, 'status': 'PENDING'},
+            {'id': self.leaves[2].pk, 'status': 'HUNTING'},
+        ]
+        response = self.client.patch('/api/games/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data['results']], [self.leaves[0].pk])
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2, 3])
+        self.assertIn('status', response.data['errors'][0]['errors'])
+        self.assertEqual(Game.objects.get(pk=self.leaves[0].parent_game_id).status, 'PENDING')
+
+    def test_malformed_ids_are_reported_per_item(self):
+        payload = [
+            {'id': [self.leaves[0].pk], 'status': 'PENDING'},
+            {'id': {'pk': 1}, 'status': 'PENDING'},
+            {'id': str(self.leaves[1].pk), 'status': 'PENDING'},
+            {'id': True, 'status': 'PENDING'},
+            'not an object',
+            {'id': self.leaves[2].pk, 'status': 'PENDING'},
+        ]
+        response = self.client.patch('/api/games/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data['results']], [self.leaves[2].pk])
+        errors = response.data['errors']
+        self.assertEqual([error['index'] for error in errors], [0, 1, 2, 3, 4])
+        for error in errors[:4]:
+            self.assertEqual(error['errors'], {'id': ['A valid integer is required.']})
+        self.assertIn('non_field_errors', errors[4]['errors'])
+
+    def test_rejects_non_list_body(self):
+        response = self.client.patch('/api/games/bulk/', {'id': 1}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class SchedulingTests(SimpleTestCase):
+    start = datetime(2024, 5, 1, 9, 0)
+    end = datetime(2024, 5, 1, 17, 0)
+
+    def job(self, pk, minutes, priority=1, deadline_hour=None):
+        deadline = self.start.replace(hour=deadline_hour) if deadline_hour else None
+        return scheduling.Job(pk, timedelta(minutes=minutes), deadline, priority)
+
+    def assertFeasible(self, slots):
+        cursor = self.start
+        for slot in slots:
+            self.assertGreaterEqual(slot.start, cursor)
+            self.assertLessEqual(slot.end, slot.job.deadline or self.end)
+            cursor = slot.end
+
+    def test_high_priority_goes_first_when_deadlines_allow(self):
+        slots, unscheduled = scheduling.build_plan(
+            [self.job(1, 60, priority=3), self.job(2, 60, priority=1), self.job(3, 60, priority=2)],
+            self.start, self.end,
+        )
+        self.assertEqual([slot.job.id for slot in slots], [2, 3, 1])
+        self.assertEqual(slots[0].start, self.start)
+        self.assertEqual(unscheduled, [])
+
+    def test_deadlines_override_priority(self):
+        slots, _ = scheduling.build_plan(
+            [self.job(1, 60, priority=1), self.job(2, 60, priority=5, deadline_hour=10)],
+            self.start, self.end,
+        )
+        self.assertEqual([slot.job.id for slot in slots], [2, 1])
+        self.assertFeasible(slots)
+
+    def test_lowest_priority_is_dropped_when_overloaded(self):
+        slots, unscheduled = scheduling.build_plan(
+            [self.job(1, 60, priority=1, deadline_hour=11),
+             self.job(2, 60, priority=4, deadline_hour=11),
+             self.job(3, 60, priority=2, deadline_hour=11),
+             self.job(4, 30, priority=1, deadline_hour=8)],
+            self.start, self.end,
+        )
+        self.assertEqual(sorted(slot.job.id for slot in slots), [1, 3])
+        self.assertEqual(sorted((job.id, reason) for job, reason in unscheduled), [(2, 'capacity'), (4, 'deadline')])
+        self.assertFeasible(slots)
+
+    def test_scales_to_thousands_of_games(self):
+        jobs = [
+            self.job(pk, minutes=pk % 7 + 1, priority=pk % 5 + 1, deadline_hour=10 + pk % 7)
+            for pk in range(1, 5001)
+        ]
+        began = time.perf_counter()
+        slots, unscheduled = scheduling.build_plan(jobs, self.start, self.end)
+        self.assertLess(time.perf_counter() - began, 1)
+        self.assertEqual(len(slots) + len(unscheduled), len(jobs))
+        self.assertFeasible(slots)
+
+
+class ScheduleEndpointTests(APITestCase):
+    def setUp(self):
+        genus = Genus.objects.create(name='genus')
+        self.day = (timezone.localdate() + timedelta(days=1)).isoformat()
+        self.games = []
+        for priority in (3, 1, 2):
+            species = Species.objects.create(
+                title=f'p{priority}', genus=genus, priority=priority,
+                estimated_hunting_time=timedelta(hours=1),
+            )
+            self.games.append(Game.objects.create(species=species, deadline=timezone.now() + timedelta(days=3)))
+
+    def test_dry_run_returns_plan_without_writing(self):
+        before = {game.pk: game.hunt_start_time for game in Game.objects.all()}
+        response = self.client.post('/api/games/schedule/', {'date': self.day, 'dry_run': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['priority'] for row in response.data['scheduled']], [1, 2, 3])
+        self.assertEqual({game.pk: game.hunt_start_time for game in Game.objects.all()}, before)
+
+    def test_apply_persists_start_times(self):
+        response = self.client.post('/api/games/schedule/', {'date': self.day}, format='json')
+        self.assertEqual(response.status_code, 200)
+        first = Game.objects.get(pk=self.games[1].pk)
+        self.assertEqual(first.hunt_start_time, response.data['scheduled'][0]['hunt_start_time'])
+        self.assertEqual(Game.objects.get(pk=self.games[0].pk).hunt_start_time, first.hunt_start_time + timedelta(hours=2))
+
+    def test_window_is_required(self):
+        self.assertEqual(self.client.post('/api/games/schedule/', {}, format='json').status_code, 400)
+
+    def test_game_ids_and_dry_run_are_validated(self):
+        for body in ({'game_ids': ['x']}, {'game_ids': [[1]]}, {'game_ids': 5}, {'dry_run': 'maybe'}):
+            response = self.client.post('/api/games/schedule/', {'date': self.day, **body}, format='json')
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn(next(iter(body)), response.data)
+
+    def test_schedules_games_created_through_the_api(self):
+        Game.objects.all().delete()
+        created = []
+        for species in Species.objects.order_by('priority'):
+            created.append(self.client.post('/api/games/', {'species': species.pk}, format='json').data['id'])
+        self.assertTrue(all(game.deadline_is_derived for game in Game.objects.all()))
+
+        response = self.client.post('/api/games/schedule/', {'date': self.day}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['unscheduled'], [])
+        self.assertEqual([row['id'] for row in response.data['scheduled']], created)
+        # 求めた期限は新しい開始時刻に合わせて動く
+        for game in Game.objects.all():
+            self.assertTrue(game.deadline_is_derived)
+            self.assertEqual(game.deadline, game.hunt_start_time + timedelta(hours=1))
+
+    def test_explicit_deadline_is_kept(self):
+        game = self.games[0]
+        self.assertFalse(game.deadline_is_derived)
+        deadline = game.deadline
+        self.client.post('/api/games/schedule/', {'date': self.day}, format='json')
+        game.refresh_from_db()
+        self.assertEqual(game.deadline, deadline)
+        self.assertFalse(game.deadline_is_derived)
+
+    def test_body_must_be_an_object(self):
+        for body in ([], [{'date': self.day}], 'today'):
+            self.assertEqual(self.client.post('/api/games/schedule/', body, format='json').status_code, 400, body)
+        self.assertEqual(self.client.post('/api/games/schedule/', {'date': 5}, format='json').status_code, 400)
+
+    def test_dry_run_string_is_parsed(self):
+        before = {game.pk: game.hunt_start_time for game in Game.objects.all()}
+        response = self.client.post('/api/games/schedule/', {
+            'date': self.day, 'dry_run': 'false', 'game_ids': [str(self.games[0].pk)],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['dry_run'])
+        self.assertEqual([row['id'] for row in response.data['scheduled']], [self.games[0].pk])
+        self.assertNotEqual(Game.objects.get(pk=self.games[0].pk).hunt_start_time, before[self.games[0].pk])
+
+        response = self.client.post('/api/games/schedule/', {'date': self.day, 'dry_run': 'true'}, format='json')
+        self.assertTrue(response.data['dry_run'])
+
+
+class SpeciesTreeTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(self.genus, depth=3, fanout=2)
+        self.child = self.root.subspecies.order_by('pk').first()
+
+    def test_species_tree_is_nested_with_rollups(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/species/{self.child.pk}/tree/')
+        self.assertEqual(response.status_code, 200)
+        tree = response.data
+        self.assertEqual(tree['id'], self.child.pk)
+        self.assertEqual(tree['estimated_hunting_time'], '00:40:00')
+        self.assertEqual(len(tree['children']), 2)
+        self.assertEqual(len(tree['children'][0]['children']), 2)
+        self.assertEqual(tree['children'][0]['children'][0]['children'], [])
+
+    def test_genus_tree_contains_every_root(self):
+        other_root = Species.objects.create(title='other', genus=self.genus)
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/genera/{self.genus.pk}/tree/')
+        self.assertEqual([node['id'] for node in response.data], [self.root.pk, other_root.pk])
+        self.assertEqual(response.data[0]['estimated_hunting_time'], '01:20:00')
+
+    def test_unchanged_tree_returns_304(self):
+        url = f'/api/species/{self.root.pk}/tree/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        leaf = Species.objects.filter(is_leaf_species=True).first()
+        leaf.estimated_hunting_time = timedelta(minutes=30)
+        leaf.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(TIMETOHUNT_READ_CACHE={'BACKEND': 'api.cache.LocMemLRUBackend', 'OPTIONS': {'max_entries': 16}})
+class ReadCacheTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(self.genus, depth=1, fanout=2)
+
+    def test_second_read_is_served_from_cache(self):
+        before = self.client.get('/api/cache_stats/').data
+        self.client.get('/api/species/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/species/')
+        self.assertEqual(len(response.data), 3)
+        after = self.client.get('/api/cache_stats/').data
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+
+    def test_writes_bump_the_version(self):
+        url = f'/api/species/{self.root.pk}/subspecies/'
+        self.assertEqual(len(self.client.get(url).data), 2)
+        Species.objects.create(title='new', genus=self.genus, parent_species=self.root)
+        self.assertEqual(len(self.client.get(url).data), 3)
+
+        self.client.get(f'/api/species/{self.root.pk}/')
+        self.genus.name = 'renamed'
+        self.genus.save()
+        self.assertEqual(self.client.get(f'/api/species/{self.root.pk}/').data['genus_name'], 'renamed')
+
+    def test_game_changes_invalidate_species_games(self):
+        url = f'/api/species/{self.root.pk}/games/'
+        self.assertEqual(self.client.get(url).data, [])
+        self.client.post('/api/games/', {'species': self.root.pk}, format='json')
+        self.assertEqual(len(self.client.get(url).data), 1)
+
+    def test_conditional_get(self):
+        url = f'/api/genera/{self.genus.pk}/species/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Species.objects.create(title='new', genus=self.genus)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cached_and_uncached_etags_agree(self):
+        url = f'/api/species/{self.root.pk}/tree/'
+        with self.settings(TIMETOHUNT_READ_CACHE={'ENABLED': False}):
+            uncached = self.client.get(url)
+        first, second = self.client.get(url), self.client.get(url)
+        self.assertEqual(first['ETag'], uncached['ETag'])
+        self.assertEqual(second['ETag'], uncached['ETag'])
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=second['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], second['ETag'])
+
+        listing = self.client.get('/api/species/')
+        self.assertEqual(listing['ETag'], cache.content_etag(listing.data))
+
+    def test_lru_evicts_oldest_entries(self):
+        backend = cache.LocMemLRUBackend(max_entries=2)
+        for key in ('a', 'b', 'c'):
+            backend.set(key, key)
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.get('c'), 'c')
+
+
+class DatasetAndBenchmarkTests(APITestCase):
+    def test_generated_dataset_is_consistent(self):
+        dataset = datagen.generate_dataset(
+            genera=1, roots_per_genus=2, depth=2, fanout=2, days=3, games_per_day=2,
+            status_mix={'CAPTURED': 1}, seed=1,
+        )
+        self.assertEqual(dataset.species, 2 * (1 + 2 + 4))
+        self.assertEqual(dataset.games, 3 * 2 * 7)
+        self.assertEqual(Species.objects.recompute_totals(), 0)
+
+        # 過去の日のGameは全て捕獲済み、今日のGameは未着手
+        today = timezone.localdate()
+        for game in Game.objects.all():
+            expected = 'NOT_STARTED' if timezone.localdate(game.hunt_start_time) == today else 'CAPTURED'
+            self.assertEqual(game.status, expected)
+
+    def test_parse_status_mix(self):
+        self.assertEqual(datagen.parse_status_mix('captured=3,ESCAPED=1'), {'CAPTURED': 3, 'ESCAPED': 1})
+        with self.assertRaises(ValueError):
+            datagen.parse_status_mix('HUNTING=1')
+
+    def test_benchmark_smoke_run_is_rolled_back(self):
+        out = StringIO()
+        call_command(
+            'run_benchmarks', genera=1, roots=2, depth=2, fanout=2, days=2, games_per_day=1,
+            iterations=1, warmup=0, stdout=out,
+        )
+        results = json.loads(out.getvalue())
+        self.assertEqual(set(results['scenarios']), set(benchmarks.SCENARIOS))
+        for result in results['scenarios'].values():
+            self.assertGreater(result['queries']['max'], 0)
+        self.assertFalse(Species.objects.exists())
+
+    def test_concurrency_benchmark_reports_both_profiles(self):
+        results = benchmarks.run_concurrency(seconds=0.2, readers=2, rows=100)
+        self.assertEqual(set(results), {'development', 'production'})
+        for result in results.values():
+            self.assertGreater(result['reads'], 0)
+            self.assertEqual(result['read_errors'], 0)
+
+    def test_compare_flags_regressions(self):
+        def result(median, queries):
+            return {'scenarios': {'s': {
+                'latency_ms': {'median': median}, 'queries': {'max': queries},
+            }}}
+
+        self.assertEqual(benchmarks.compare(result(10, 5), result(14, 5), threshold=1.5), [])
+        self.assertEqual(len(benchmarks.compare(result(10, 5), result(16, 5), threshold=1.5)), 1)
+        self.assertEqual(len(benchmarks.compare(result(10, 5), result(10, 6), threshold=1.5)), 1)
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    def test_production_profile(self):
+        database = sqlite_database('db.sqlite3', 'production')
+        self.assertEqual(database['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertIn('PRAGMA journal_mode=WAL', database['OPTIONS']['init_command'])
+        self.assertGreater(database['CONN_MAX_AGE'], 0)
+        self.assertNotIn('OPTIONS', sqlite_database('db.sqlite3'))
+        with self.assertRaises(ValueError):
+            sqlite_database('db.sqlite3', 'staging')
+
+
+class AtomicWriteTests(APITestCase):
+    def test_only_writes_open_a_transaction(self):
+        genus = Genus.objects.create(name='genus')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.patch(f'/api/genera/{genus.pk}/', {'name': 'renamed'}, format='json')
+        self.assertTrue(ctx.captured_queries[0]['sql'].startswith('SAVEPOINT'))
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(f'/api/genera/{genus.pk}/species/')
+        self.assertFalse(any(q['sql'].startswith('SAVEPOINT') for q in ctx.captured_queries))
+
+
+class InstrumentationTests(APITestCase):
+    enabled = {'ENABLED': True, 'SLOW_REQUEST_MS': 0}
+
+    def setUp(self):
+        instrumentation.metrics.reset()
+        self.genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(self.genus, depth=1, fanout=2)
+
+    def test_disabled_by_default(self):
+        response = self.client.get('/api/games/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get('/internal/metrics/').status_code, 404)
+
+    def test_server_timing_and_slow_log(self):
+        with override_settings(TIMETOHUNT_INSTRUMENTATION=self.enabled):
+            # しきい値0ではメトリクスの取得も遅いリクエストとして記録されるので、ログを捕まえておく
+            with self.assertLogs('TimeToHunt.instrumentation', 'WARNING') as logs:
+                response = self.client.get('/api/games/')
+                metrics = self.client.get('/internal/metrics/').json()['views']
+            self.assertIn('db;dur=', response['Server-Timing'])
+            self.assertIn('desc="1 queries"', response['Server-Timing'])
+            self.assertIn('Slow request GET /api/games/ (GET game-list)', logs.output[0])
+            self.assertIn('Slow request GET /internal/metrics/', logs.output[1])
+        self.assertEqual(metrics['GET game-list']['count'], 1)
+        self.assertEqual(metrics['GET game-list']['mean_queries'], 1)
+
+    def test_recorder_counts_duplicates_and_repeats(self):
+        recorder = instrumentation.QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            list(Species.objects.filter(pk=self.root.pk))
+            list(Species.objects.filter(pk=self.root.pk))
+            list(Species.objects.filter(pk=self.root.pk + 1))
+        self.assertEqual(recorder.count, 3)
+        self.assertEqual(recorder.duplicates, 1)
+        [(n, _, sql)] = recorder.top_repeated(5)
+        self.assertEqual(n, 3)
+        self.assertIn('api_species', sql)
+
+
+class EstimateAnalyticsTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(self.genus, depth=1, fanout=2, minutes=30)
+        self.client.post('/api/games/', {'species': self.root.pk}, format='json')
+        self.leaves = list(Game.objects.filter(parent_game__isnull=False).order_by('pk'))
+
+    def finish(self, game, status='CAPTURED', minutes=None):
+        game.status = status
+        game.actual_hunting_time = None if minutes is None else timedelta(minutes=minutes)
+        game.save()
+
+    def rollup(self, period='day', species=None):
+        game = self.leaves[0]
+        return EstimateRollup.objects.get(
+            species=species or game.species, period=period,
+            bucket_start=analytics.bucket_start(period, timezone.localdate(game.hunt_start_time)),
+        )
+
+    def test_finishing_a_game_updates_every_period(self):
+        self.finish(self.leaves[0], minutes=45)
+        for period in analytics.PERIODS:
+            row = self.rollup(period)
+            self.assertEqual((row.count, row.captured, row.timed), (1, 1, 1))
+            self.assertEqual(row.total_overrun, timedelta(minutes=15))
+        # 親Gameは伝搬で捕獲完了になっても集計しない
+        self.assertEqual(EstimateRollup.objects.filter(species=self.root).count(), 0)
+
+    def test_edits_and_deletes_keep_rollups_exact(self):
+        game = self.leaves[0]
+        self.finish(game, minutes=45)
+        game.actual_hunting_time = timedelta(minutes=20)
+        game.save()
+        row = self.rollup()
+        self.assertEqual((row.count, row.total_actual), (1, timedelta(minutes=20)))
+
+        # 種の推定が変わっても終了時点の推定との差のまま
+        Species.objects.filter(pk=game.species_id).update(estimated_hunting_time=timedelta(hours=2))
+        game.refresh_from_db()
+        game.save()
+        self.assertEqual(self.rollup().total_overrun, timedelta(minutes=-10))
+
+        self.finish(game, status='ESCAPED')
+        row = self.rollup()
+        self.assertEqual((row.count, row.captured, row.escaped, row.timed), (1, 0, 1, 0))
+
+        game.delete()
+        self.assertFalse(EstimateRollup.objects.exists())
+
+    def test_bulk_updates_are_recorded(self):
+        payload = [{'id': leaf.pk, 'status': 'ESCAPED'} for leaf in self.leaves]
+        self.client.patch('/api/games/bulk/', payload, format='json')
+        self.assertEqual(EstimateRollup.objects.filter(period='week').count(), 2)
+        self.assertEqual(sum(EstimateRollup.objects.filter(period='week').values_list('escaped', flat=True)), 2)
+
+    def test_reports_read_rollups_only(self):
+        self.finish(self.leaves[0], minutes=45)
+        self.finish(self.leaves[1], status='ESCAPED')
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/api/analytics/species/{self.root.pk}/?period=day')
+        self.assertFalse(any('api_game' in q['sql'] for q in ctx.captured_queries))
+        [row] = response.data
+        self.assertEqual(row['species'], self.root.pk)
+        self.assertEqual((row['count'], row['captured'], row['escaped']), (2, 1, 1))
+        self.assertEqual(row['capture_rate'], 0.5)
+        self.assertEqual(row['mean_overrun'], '00:15:00')
+        self.assertEqual(row['overrun_p50'], '00:15:00')
+        self.assertFalse(row['overrun_p50_open'])
+
+        response = self.client.get('/api/analytics/species/?period=month')
+        self.assertEqual(len(response.data), 2)
+        response = self.client.get(f'/api/analytics/genera/{self.genus.pk}/?period=week')
+        self.assertEqual(response.data[0]['genus'], self.genus.pk)
+        self.assertEqual(response.data[0]['count'], 2)
+
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        response = self.client.get(f'/api/analytics/genera/?period=day&date={tomorrow}')
+        self.assertEqual(response.data, [])
+        self.assertEqual(self.client.get('/api/analytics/genera/?period=year').status_code, 400)
+
+    def test_percentile_marks_the_open_last_bucket(self):
+        histogram = analytics.empty_histogram()
+        histogram[4], histogram[-1] = 1, 3
+        self.assertEqual(analytics.percentile(histogram, 0.2), analytics.Quantile(0, False))
+        self.assertEqual(analytics.percentile(histogram, 0.9), analytics.Quantile(120, True))
+        self.assertIsNone(analytics.percentile(analytics.empty_histogram(), 0.5))
+
+        self.finish(self.leaves[0], minutes=30 + 180)
+        [row] = self.client.get(f'/api/analytics/species/{self.root.pk}/?period=day').data
+        self.assertEqual((row['overrun_p90'], row['overrun_p90_open']), ('02:00:00', True))
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.finish(self.leaves[0], minutes=45)
+        self.finish(self.leaves[1], status='ESCAPED')
+        fields = ('species', 'period', 'bucket_start', 'count', 'captured', 'escaped',
+                  'total_actual', 'total_overrun', 'overrun_histogram')
+        before = sorted(EstimateRollup.objects.values_list(*fields))
+        analytics.rebuild()
+        self.assertEqual(sorted(EstimateRollup.objects.values_list(*fields)), before)
+
+
+class LearnedEstimateTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(self.genus, depth=1, fanout=2, minutes=30)
+        self.leaf, self.sibling = self.root.subspecies.order_by('pk')
+
+    def capture(self, species, minutes):
+        game = Game.objects.create(species=species)
+        self.client.post(f'/api/games/{game.pk}/start_hunting/')
+        game.refresh_from_db()
+        game.status = 'CAPTURED'
+        game.actual_hunting_time = timedelta(minutes=minutes)
+        game.save()
+
+    def test_p2_quantile_tracks_the_distribution(self):
+        sketch = estimation.P2Quantile(0.75)
+        for x in range(1, 1001):
+            sketch.add((x * 7919) % 1000)
+        restored = estimation.P2Quantile(0.75, json.loads(json.dumps(sketch.state())))
+        self.assertAlmostEqual(restored.value(), 750, delta=25)
+
+    def test_suggestion_needs_enough_samples(self):
+        for minutes in (10, 20, 30, 40):
+            self.capture(self.leaf, minutes)
+        url = f'/api/species/{self.leaf.pk}/'
+        self.assertIsNone(self.client.get(url).data['suggested_estimate'])
+
+        self.capture(self.leaf, 50)
+        stats = SpeciesEstimateStats.objects.get(pk=self.leaf.pk)
+        self.assertEqual(stats.samples, 5)
+        self.assertEqual(self.client.get(url).data['suggested_estimate'], '00:40:00')
+        # 自動更新を有効にしていなければ推定所要時間はそのまま
+        self.leaf.refresh_from_db()
+        self.assertEqual(self.leaf.estimated_hunting_time, timedelta(minutes=30))
+
+    def test_updates_are_constant_time(self):
+        for minutes in (10, 20, 30):
+            self.capture(self.leaf, minutes)
+        game = Game.objects.create(species=self.leaf, status='HUNTING')
+        game.status = 'CAPTURED'
+        game.actual_hunting_time = timedelta(minutes=40)
+        # 実績の件数によらず、統計の読み書きは1件ずつ
+        with CaptureQueriesContext(connection) as ctx:
+            game.save()
+        stats_queries = [q for q in ctx.captured_queries if 'api_speciesestimatestats' in q['sql']]
+        self.assertEqual(len(stats_queries), 2)
+
+    def test_auto_update_rolls_up_to_parents(self):
+        self.client.patch(f'/api/species/{self.leaf.pk}/', {'auto_update_estimate': True}, format='json')
+        for minutes in (50, 60, 70, 80, 90):
+            self.capture(self.leaf, minutes)
+        self.leaf.refresh_from_db()
+        self.root.refresh_from_db()
+        self.assertEqual(self.leaf.estimated_hunting_time, timedelta(minutes=80))
+        self.assertEqual(self.root.estimated_hunting_time, timedelta(minutes=80 + 30))
+
+    def test_sparse_fieldset(self):
+        self.client.patch(f'/api/species/{self.leaf.pk}/', {'auto_update_estimate': True}, format='json')
+        response = self.client.get('/api/species/?fields=id,suggested_estimate')
+        self.assertEqual(set(response.data[0]), {'id', 'suggested_estimate'})
+
+
+class ArchiveTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(self.genus, depth=1, fanout=2, minutes=30)
+        self.old = timezone.now() - timedelta(days=60)
+
+    def create_tree(self, status, hunt_start_time=None):
+        self.client.post('/api/games/', {'species': self.root.pk}, format='json')
+        root = Game.objects.filter(parent_game__isnull=True).latest('pk')
+        payload = [{'id': child.pk, 'status': status} for child in root.child_games.all()]
+        self.client.patch('/api/games/bulk/', payload, format='json')
+        Game.objects.filter(pk__in=[root.pk, *root.child_games.values_list('pk', flat=True)]).update(
+            hunt_start_time=hunt_start_time or self.old,
+        )
+        return Game.objects.get(pk=root.pk)
+
+    def test_archives_only_old_finished_trees(self):
+        finished = self.create_tree('CAPTURED')
+        self.create_tree('CAPTURED', hunt_start_time=timezone.now())
+        self.create_tree('PENDING')
+
+        self.assertEqual(archive.archive_games(), (1, 3))
+        self.assertFalse(Game.objects.filter(pk=finished.pk).exists())
+        self.assertEqual(Game.objects.count(), 6)
+        self.assertEqual(set(ArchivedGame.objects.values_list('root_id', flat=True)), {finished.pk})
+
+    def test_archiving_keeps_analytics_and_restore_round_trips(self):
+        root = self.create_tree('ESCAPED')
+        rollups = sorted(EstimateRollup.objects.values_list('species', 'period', 'count'))
+        self.assertEqual(len(rollups), 6)
+        ids = sorted(Game.objects.values_list('pk', flat=True))
+
+        out = StringIO()
+        call_command('archive_games', days=30, stdout=out)
+        self.assertIn('Archived 1 game trees (3 games)', out.getvalue())
+        self.assertFalse(Game.objects.exists())
+        self.assertEqual(sorted(EstimateRollup.objects.values_list('species', 'period', 'count')), rollups)
+        analytics.rebuild()
+        self.assertEqual(sorted(EstimateRollup.objects.values_list('species', 'period', 'count')), rollups)
+
+        response = self.client.get('/api/archived_games/')
+        self.assertEqual(len(response.data), 3)
+        leaf = next(row for row in response.data if row['parent_game_id'] == root.pk)
+        self.assertEqual(self.client.delete(f"/api/archived_games/{leaf['id']}/").status_code, 405)
+
+        response = self.client.post(f"/api/archived_games/{leaf['id']}/restore/")
+        self.assertEqual(response.data['id'], root.pk)
+        self.assertEqual(response.data['status'], 'ESCAPED')
+        self.assertEqual(sorted(Game.objects.values_list('pk', flat=True)), ids)
+        self.assertFalse(ArchivedGame.objects.exists())
+        self.assertEqual(sorted(EstimateRollup.objects.values_list('species', 'period', 'count')), rollups)
+
+    def test_scheduler_runs_registered_jobs(self):
+        calls = []
+        job = scheduler.Scheduler({'api.tests.ArchiveTests': 0.01})
+        job.run_job = calls.append
+        job.start()
+        time.sleep(0.1)
+        job.stop()
+        job.join(1)
+        self.assertGreater(len(calls), 1)
+
+
+class TransferTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus', description='desc')
+        self.root = build_species_tree(self.genus, depth=2, fanout=2, minutes=10)
+
+    def export(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_catalog_round_trip_in_topological_order(self):
+        lines = self.export('/api/export/catalog.ndjson').splitlines()
+        self.assertEqual(len(lines), 1 + 7)
+        self.assertEqual(json.loads(lines[0])['type'], 'genus')
+        # 子を親より先に並べても、親の書き込みを待ってから取り込む
+        body = '\n'.join([lines[0], *reversed(lines[1:])])
+        with CaptureQueriesContext(connection) as queries:
+            counts = transfer.import_catalog(body.splitlines(), chunk_size=2)
+        self.assertEqual(counts, {'genera': 1, 'species': 7})
+        self.assertLess(len(queries), 30)
+
+        genus = Genus.objects.exclude(pk=self.genus.pk).get()
+        root = Species.objects.get(genus=genus, parent_species__isnull=True)
+        self.assertEqual(root.estimated_hunting_time, timedelta(minutes=40))
+        self.assertFalse(root.is_leaf_species)
+        self.assertEqual(Species.objects.subtree_of(root).count(), 7)
+        self.assertEqual(Species.objects.descendants_of(root).filter(is_leaf_species=True).count(), 4)
+        self.assertEqual(Species.objects.filter(depth=2, genus=genus).count(), 4)
+
+        response = self.client.post(
+            '/api/import/catalog/', '\n'.join(lines), content_type='application/x-ndjson',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'genera': 1, 'species': 7})
+        self.assertEqual(Genus.objects.count(), 3)
+
+    def test_csv_export_and_unknown_resource(self):
+        self.client.post('/api/games/', {'species': self.root.pk}, format='json')
+        rows = self.export('/api/export/games.csv').splitlines()
+        self.assertEqual(rows[0], 'id,species_id,parent_game_id,status,hunt_start_time,deadline,'
+                                  'actual_hunting_time,finished_estimate')
+        self.assertEqual(len(rows), 1 + Game.objects.count())
+        species = self.export('/api/export/species.csv').splitlines()
+        self.assertIn(',P0DT00H40M00S,False,', species[1])
+
+        self.assertEqual(self.client.get('/api/export/catalog.csv').status_code, 404)
+        self.assertEqual(self.client.get('/api/export/users.ndjson').status_code, 404)
+
+    def test_import_only_updates_its_own_trees(self):
+        # 既存の木の合計がずれていても、取り込みでは直さない
+        Species.objects.filter(pk=self.root.pk).update(estimated_hunting_time=timedelta(minutes=1))
+        lines = [
+            json.dumps({'type': 'genus', 'id': 1, 'name': 'g'}),
+            json.dumps({'type': 'species', 'id': 1, 'title': 'root', 'genus_id': 1,
+                        'estimated_hunting_time': '00:00:00'}),
+            *(json.dumps({'type': 'species', 'id': 2 + i, 'title': f'leaf-{i}', 'genus_id': 1,
+                          'parent_species_id': 1, 'estimated_hunting_time': '00:15:00'}) for i in range(2)),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            transfer.import_catalog(lines)
+        self.assertFalse(any(
+            query['sql'].startswith('SELECT') and 'api_species' in query['sql'] for query in queries
+        ))
+
+        self.assertEqual(Species.objects.get(pk=self.root.pk).estimated_hunting_time, timedelta(minutes=1))
+        root = Species.objects.get(genus__name='g', parent_species__isnull=True)
+        self.assertEqual(root.estimated_hunting_time, timedelta(minutes=30))
+        self.assertFalse(root.is_leaf_species)
+        self.assertEqual(Species.objects.filter(parent_species=root, is_leaf_species=True).count(), 2)
+
+    def test_failed_import_leaves_nothing_behind(self):
+        lines = [
+            json.dumps({'type': 'genus', 'id': 1, 'name': 'g'}),
+            json.dumps({'type': 'species', 'id': 5, 'title': 'orphan', 'genus_id': 1,
+                        'parent_species_id': 99, 'estimated_hunting_time': '00:10:00'}),
+        ]
+        response = self.client.post(
+            '/api/import/catalog/', '\n'.join(lines), content_type='application/x-ndjson',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('99', response.data['detail'])
+        self.assertEqual(Genus.objects.count(), 1)
+
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', '/nonexistent.ndjson', stdout=StringIO())
+
+
+@override_settings(TIMETOHUNT_EVENTS={'BACKEND': 'api.tests.RecordingBackend', 'HEARTBEAT': 1})
+class SubtreeDeleteTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(self.genus, depth=1, fanout=2, minutes=10)
+        self.branch = Species.objects.get(title='root-0')
+
+    def delete_branch(self, fanout):
+        """root-0の下にfanout分岐3段の部分木とGameを作って削除し、発行したクエリ数を返す"""
+        build_species_tree(self.genus, depth=2, fanout=fanout, parent=self.branch, minutes=5)
+        self.client.post('/api/games/', {'species': self.root.pk}, format='json')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.delete(f'/api/species/{self.branch.pk}/')
+        self.assertEqual(response.status_code, 204)
+        return len(ctx.captured_queries)
+
+    def test_species_subtree_delete_fixes_survivors_once(self):
+        small = self.delete_branch(fanout=1)
+        self.root.refresh_from_db()
+        self.assertEqual(self.root.estimated_hunting_time, timedelta(minutes=10))
+        self.assertFalse(self.root.is_leaf_species)
+        self.assertEqual(Species.objects.count(), 2)
+        self.assertEqual(Game.objects.count(), 2)
+
+        self.branch = Species.objects.create(title='root-0', genus=self.genus, parent_species=self.root)
+        Game.objects.all().delete()
+        large = self.delete_branch(fanout=4)
+        self.assertEqual(large, small)
+
+        # 最後の子を失った親は葉に戻る
+        Species.objects.get(title='root-1').delete()
+        self.root.refresh_from_db()
+        self.assertTrue(self.root.is_leaf_species)
+        self.assertEqual(self.root.estimated_hunting_time, timedelta(minutes=10))
+
+    def test_species_subtree_delete_covers_cascaded_games(self):
+        self.client.post('/api/games/', {'species': self.root.pk}, format='json')
+        branch_game = Game.objects.get(species=self.branch)
+        # 部分木の外の種のGameでも、削除されるGameの子ならparent_gameを通して一緒に消える
+        outside = Game.objects.create(species=Species.objects.get(title='root-1'), parent_game=branch_game)
+        self.client.patch('/api/games/bulk/', [{'id': outside.pk, 'status': 'CAPTURED'}], format='json')
+        self.assertTrue(EstimateRollup.objects.filter(species__title='root-1', count__gt=0).exists())
+        # 部分木の種のGameが外の種のGameの下にもある（状態の伝搬を避けてそのまま書き込む）
+        [nested] = Game.objects.bulk_create([
+            Game(species=self.branch, parent_game=outside, hunt_start_time=outside.hunt_start_time),
+        ])
+
+        RecordingBackend.published = []
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/species/{self.branch.pk}/').status_code, 204)
+        self.assertFalse(Game.objects.filter(pk__in=[branch_game.pk, outside.pk, nested.pk]).exists())
+        self.assertFalse(EstimateRollup.objects.filter(species__title='root-1', count__gt=0).exists())
+        deleted = [event['data'] for event in RecordingBackend.published if event['type'] == 'game.deleted']
+        self.assertEqual(len(deleted), 1)
+        self.assertEqual(deleted[0]['id'], branch_game.pk)
+        self.assertEqual(sorted(deleted[0]['descendants']), [outside.pk, nested.pk])
+
+    def test_game_subtree_delete_recomputes_parent_and_rollups(self):
+        self.client.post('/api/games/', {'species': self.root.pk}, format='json')
+        root = Game.objects.get(parent_game__isnull=True)
+        captured, hunting = root.child_games.order_by('pk')
+        self.client.patch('/api/games/bulk/', [{'id': captured.pk, 'status': 'CAPTURED'}], format='json')
+        self.client.post(f'/api/games/{hunting.pk}/start_hunting/')
+        self.assertEqual(EstimateRollup.objects.filter(period='week').get().count, 1)
+
+        RecordingBackend.published = []
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/games/{hunting.pk}/').status_code, 204)
+        root.refresh_from_db()
+        self.assertEqual(root.status, 'CAPTURED')
+        published = [(event['type'], event['data']) for event in RecordingBackend.published]
+        self.assertIn(('game.deleted', {'id': hunting.pk, 'descendants': []}), published)
+        self.assertIn(('active.changed', {'id': None}), published)
+
+        self.client.delete(f'/api/games/{root.pk}/')
+        self.assertFalse(Game.objects.exists())
+        self.assertFalse(EstimateRollup.objects.exists())
+
+
+class ExpiryTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(self.genus, depth=1, fanout=2, minutes=30)
+        self.client.post('/api/games/', {'species': self.root.pk}, format='json')
+        self.game = Game.objects.get(parent_game__isnull=True)
+        self.leaves = list(self.game.child_games.order_by('pk'))
+        self.past = timezone.now() - timedelta(hours=1)
+        Game.objects.update(deadline=self.past)
+
+    def test_overdue_transition_only_marks_games(self):
+        self.assertEqual(self.client.get('/api/games/?expired=true').data[0]['is_expired'], True)
+        self.assertEqual(len(self.client.get('/api/games/?expired=true').data), 3)
+        self.assertEqual(self.client.get('/api/games/?expired=maybe').status_code, 400)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(expiry.expire_games(transition='OVERDUE', batch_size=2), (3, 0))
+        self.assertLess(len(ctx.captured_queries), 12)
+        self.assertEqual(set(Game.objects.values_list('status', 'is_overdue')), {('NOT_STARTED', True)})
+        self.assertEqual(expiry.expire_games(transition='OVERDUE'), (0, 0))
+
+        # 期限を延ばすと印が外れ、期限切れの一覧からも外れる
+        later = timezone.now() + timedelta(hours=1)
+        self.client.patch('/api/games/bulk/', [{'id': self.leaves[0].pk, 'deadline': later.isoformat()}], format='json')
+        self.assertFalse(Game.objects.get(pk=self.leaves[0].pk).is_overdue)
+        self.assertEqual(len(self.client.get('/api/games/?expired=true').data), 2)
+        self.assertEqual(len(self.client.get('/api/games/?expired=false').data), 1)
+
+    def test_escaped_transition_updates_leaves_parents_and_rollups(self):
+        self.client.patch('/api/games/bulk/', [{'id': self.leaves[1].pk, 'status': 'CAPTURED'}], format='json')
+        Game.objects.filter(pk=self.leaves[1].pk).update(deadline=self.past)
+
+        out = StringIO()
+        call_command('expire_games', transition='ESCAPED', stdout=out)
+        self.assertIn('Marked 2 games as overdue (1 escaped)', out.getvalue())
+        leaf = Game.objects.get(pk=self.leaves[0].pk)
+        self.assertEqual((leaf.status, leaf.finished_estimate), ('ESCAPED', timedelta(minutes=30)))
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.status, 'ESCAPED')
+        self.assertEqual(Game.objects.get(pk=self.leaves[1].pk).status, 'CAPTURED')
+
+        rollups = sorted(EstimateRollup.objects.filter(period='week').values_list('captured', 'escaped'))
+        analytics.rebuild()
+        self.assertEqual(sorted(EstimateRollup.objects.filter(period='week').values_list('captured', 'escaped')), rollups)
+        self.assertEqual(rollups, [(0, 1), (1, 0)])
+
+        with self.assertRaises(CommandError):
+            call_command('expire_games', transition='GONE', stdout=StringIO())
+
+
+class OwnerScopingTests(APITestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def create_tree(self, user):
+        """userとして属・2つの葉を持つ種・Gameの木を作り、Gameの木の根を返す"""
+        self.client.force_authenticate(user)
+        genus = self.client.post('/api/genera/', {'name': user.username}, format='json').data
+        root = self.client.post('/api/species/', {
+            'title': 'root', 'genus': genus['id'], 'estimated_hunting_time': '00:10:00',
+        }, format='json').data
+        for i in range(2):
+            self.client.post('/api/species/', {
+                'title': f'leaf-{i}', 'genus': genus['id'], 'parent_species': root['id'],
+                'estimated_hunting_time': '00:10:00',
+            }, format='json')
+        return Game.objects.get(pk=self.client.post('/api/games/', {'species': root['id']}, format='json').data['id'])
+
+    def test_rows_are_scoped_to_their_owner(self):
+        game = self.create_tree(self.alice)
+        self.assertEqual(set(Game.objects.values_list('owner', flat=True)), {self.alice.pk})
+        self.assertEqual(len(self.client.get('/api/species/').data), 3)
+
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.client.get('/api/genera/').data, [])
+        self.assertEqual(self.client.get('/api/games/').data, [])
+        self.assertEqual(self.client.get(f'/api/games/{game.pk}/').status_code, 404)
+        # 他のユーザーの種からはGameを作れない
+        response = self.client.post('/api/games/', {'species': game.species_id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(b''.join(self.client.get('/api/export/catalog.ndjson').streaming_content), b'')
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/species/').data, [])
+
+    def test_active_hunt_is_per_owner(self):
+        alice_leaf = self.create_tree(self.alice).child_games.first()
+        self.client.post(f'/api/games/{alice_leaf.pk}/start_hunting/')
+        bob_root = self.create_tree(self.bob)
+        bob_leaf, other = bob_root.child_games.order_by('pk')
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(f'/api/games/{bob_leaf.pk}/start_hunting/')
+        demotion = next(q['sql'] for q in ctx.captured_queries if '"status" = \'HUNTING\'' in q['sql'])
+        self.assertIn('"owner_id" = %s' % self.bob.pk, demotion)
+        self.assertEqual(Game.objects.get(pk=alice_leaf.pk).status, 'HUNTING')
+        self.assertEqual(self.client.get('/api/active_game/').data['id'], bob_leaf.pk)
+
+        self.client.post(f'/api/games/{other.pk}/start_hunting/')
+        self.assertEqual(Game.objects.get(pk=bob_leaf.pk).status, 'PENDING')
+        self.assertEqual(set(Game.objects.filter(is_active=True).values_list('pk', flat=True)), {alice_leaf.pk, other.pk})
+
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.client.get('/api/active_game/').data['id'], alice_leaf.pk)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Game.objects.filter(pk=alice_leaf.parent_game_id).update(is_active=True)
+
+    @override_settings(TIMETOHUNT_READ_CACHE={'ENABLED': True})
+    def test_read_cache_is_keyed_per_user(self):
+        self.create_tree(self.alice)
+        self.assertEqual(len(self.client.get('/api/genera/').data), 1)
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.client.get('/api/genera/').data, [])
+
+
+class AsyncReadTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(self.genus, depth=2, fanout=2)
+        self.client.post('/api/games/', {'species': self.root.pk}, format='json')
+        self.leaf = Game.objects.filter(species__is_leaf_species=True).first()
+        self.client.post(f'/api/games/{self.leaf.pk}/start_hunting/')
+
+    def async_get(self, path, **headers):
+        return async_to_sync(self.async_client.get)(path, headers=headers)
+
+    @staticmethod
+    def without_remaining(data):
+        """残り時間はリクエストの時刻で変わるので比べない"""
+        rows = data if isinstance(data, list) else [data]
+        for row in rows:
+            row.pop('remaining_time', None)
+        return data
+
+    def test_async_endpoints_match_sync_ones(self):
+        today = timezone.localdate().isoformat()
+        for sync_path, async_path in [
+            ('/api/active_game/', '/api/async/active_game/'),
+            (f'/api/games/?date={today}', f'/api/async/games/?date={today}'),
+            (f'/api/species/{self.root.pk}/tree/', f'/api/async/species/{self.root.pk}/tree/'),
+            (f'/api/genera/{self.genus.pk}/species/', f'/api/async/genera/{self.genus.pk}/species/'),
+        ]:
+            expected = self.client.get(sync_path, HTTP_ACCEPT='application/json').json()
+            response = self.async_get(async_path)
+            self.assertEqual(response.status_code, 200, async_path)
+            self.assertEqual(self.without_remaining(response.json()), self.without_remaining(expected), async_path)
+
+        etag = self.async_get(f'/api/async/species/{self.root.pk}/tree/')['ETag']
+        self.assertEqual(self.async_get(f'/api/async/species/{self.root.pk}/tree/', if_none_match=etag).status_code, 304)
+        # 同期版（キャッシュ経由）と非同期版で同じETagになる
+        self.assertEqual(self.client.get(f'/api/species/{self.root.pk}/tree/')['ETag'], etag)
+
+    def test_async_errors_and_owner_scoping(self):
+        self.assertEqual(self.async_get('/api/async/games/?date=someday').status_code, 400)
+        self.assertEqual(self.async_get('/api/async/species/0/tree/').status_code, 404)
+
+        async_to_sync(self.async_client.aforce_login)(get_user_model().objects.create_user('alice'))
+        self.assertEqual(self.async_get('/api/async/active_game/').status_code, 404)
+        self.assertEqual(self.async_get(f'/api/async/genera/{self.genus.pk}/species/').status_code, 404)
+
+
+class LoadTestHarnessTests(SimpleTestCase):
+    async def serve(self, handle):
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await loadtest.load(f'http://127.0.0.1:{port}/api/x/?a=1', concurrency=5, duration=0.2)
+
+    def test_load_counts_requests_over_keep_alive(self):
+        connections = []
+
+        async def handle(reader, writer):
+            connections.append(writer)
+            chunked = len(connections) % 2 == 0
+            try:
+                while await reader.readuntil(b'\r\n\r\n'):
+                    if chunked:
+                        writer.write(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n2\r\n{}\r\n0\r\n\r\n')
+                    else:
+                        writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}')
+                    await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                writer.close()
+
+        async def serve_and_drop(reader, writer):
+            try:
+                await reader.readuntil(b'\r\n\r\n')
+            except asyncio.IncompleteReadError:
+                return writer.close()
+            writer.write(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            await writer.drain()
+            writer.close()
+
+        result = asyncio.run(self.serve(handle))
+        self.assertGreater(result['requests'], 5)
+        self.assertEqual(result['errors'], {})
+        self.assertEqual(len(connections), 5)
+        self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+
+        result = asyncio.run(self.serve(serve_and_drop))
+        self.assertEqual(result['requests'], 0)
+        self.assertIn('503', result['errors'])
+
+
+class TimelineTests(APITestCase):
+    def setUp(self):
+        self.genus = Genus.objects.create(name='genus')
+        self.root = build_species_tree(self.genus, depth=1, fanout=2, minutes=60)
+        self.day = timezone.localdate() + timedelta(days=1)
+        self.morning = timezone.make_aware(datetime.combine(self.day, datetime.min.time())) + timedelta(hours=9)
+
+    def create_tree(self, start):
+        self.client.post('/api/games/', {'species': self.root.pk}, format='json')
+        root = Game.objects.filter(parent_game__isnull=True).latest('pk')
+        Game.objects.filter(Q(pk=root.pk) | Q(parent_game=root)).update(hunt_start_time=start)
+        return list(root.child_games.order_by('pk'))
+
+    def test_find_overlaps_sweeps_sorted_intervals(self):
+        def t(minutes):
+            return self.morning + timedelta(minutes=minutes)
+
+        intervals = [
+            timeline.Interval(3, t(10), t(20)),
+            timeline.Interval(1, t(0), t(10)),
+            timeline.Interval(2, t(5), t(15)),
+            timeline.Interval(4, t(12), t(13)),
+            timeline.Interval(5, t(30), t(30)),
+        ]
+        overlaps = {(a.id, b.id, start, end) for a, b, start, end in timeline.find_overlaps(intervals)}
+        self.assertEqual(overlaps, {
+            (1, 2, t(5), t(10)), (2, 3, t(10), t(15)), (2, 4, t(12), t(13)), (3, 4, t(12), t(13)),
+        })
+
+    def test_week_timeline_in_one_query(self):
+        first, second = self.create_tree(self.morning)
+        Game.objects.filter(pk=second.pk).update(hunt_start_time=self.morning + timedelta(hours=2))
+        self.create_tree(self.morning + timedelta(days=2))
+
+        end = self.day + timedelta(days=6)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/api/games/timeline/?start={self.day}&end={end}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        days = response.data['days']
+        self.assertEqual([day['date'] for day in days], [str(self.day + timedelta(days=i)) for i in range(7)])
+        self.assertEqual([len(day['games']) for day in days], [3, 0, 3, 0, 0, 0, 0])
+        # 親Gameの推定（子の合計）は数えない
+        self.assertEqual(days[0]['planned'], '02:00:00')
+        self.assertEqual(days[0]['available'], '08:00:00')
+        # 同じ日の2つ目の木の葉どうしは同時刻に始まるので重なる
+        self.assertEqual(len(response.data['overlaps']), 1)
+        self.assertNotIn(first.pk, response.data['overlaps'][0]['games'])
+
+        self.assertEqual(self.client.get('/api/games/timeline/').status_code, 400)
+        too_long = self.day + timedelta(days=40)
+        self.assertEqual(self.client.get(f'/api/games/timeline/?start={self.day}&end={too_long}').status_code, 400)
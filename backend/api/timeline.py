@@ -0,0 +1,77 @@
+"""
+複数日のタイムライン
+
+期間内に開始するGameを1回の範囲検索で読み、開始した日（ローカル時刻）ごとにまとめる。
+日ごとの予定の負荷は葉のGameの推定所要時間の合計（親Gameの推定は子の合計なので数えない）。
+葉のGameの予定の区間 [開始, 開始 + 推定所要時間) の重なりは、開始順に並べて
+終了時刻のヒープで掃くので O(n log n + 重なりの数) で求まる。
+"""
+import heapq
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+DEFAULTS = {
+    'AVAILABLE_HOURS': 8,   # 1日に使える時間
+    'MAX_DAYS': 31,         # 1回に求められる日数
+}
+
+Interval = namedtuple('Interval', ['id', 'start', 'end'])
+
+
+def get_setting(name):
+    return getattr(settings, 'TIMETOHUNT_TIMELINE', {}).get(name, DEFAULTS[name])
+
+
+def find_overlaps(intervals):
+    """半開区間どうしの重なりを [(先に始まる区間, 後の区間, 重なりの開始, 重なりの終了), ...] で返す"""
+    overlaps, active = [], []
+    for interval in sorted(intervals, key=lambda interval: (interval.start, interval.id)):
+        if interval.end <= interval.start:
+            continue
+        # 始まる前に終わった区間を外すと、残りは全てこの区間と重なる
+        while active and active[0][0] <= interval.start:
+            heapq.heappop(active)
+        for end, _, other in active:
+            overlaps.append((other, interval, interval.start, min(end, interval.end)))
+        heapq.heappush(active, (interval.end, interval.id, interval))
+    return overlaps
+
+
+def days_between(start, end):
+    """[start, end) に含まれるローカルの日付"""
+    day, last = timezone.localdate(start), timezone.localdate(end - timedelta(microseconds=1))
+    days = []
+    while day <= last:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def build_timeline(games, start, end):
+    """
+    開始順に並んだGame（has_child_games注釈・species結合済み）を日ごとにまとめる
+
+    {'days': [{'date', 'planned', 'available', 'games'}, ...], 'overlaps': [...]} を返す
+    （gamesにはGameのまま入れるので、呼び出し側でシリアライズする）。
+    """
+    available = timedelta(hours=get_setting('AVAILABLE_HOURS'))
+    days = {day: {'date': day, 'planned': timedelta(), 'available': available, 'games': []}
+            for day in days_between(start, end)}
+
+    intervals = []
+    for game in games:
+        bucket = days[timezone.localdate(game.hunt_start_time)]
+        bucket['games'].append(game)
+        if not game.has_child_games:
+            duration = game.estimated_hunting_time
+            bucket['planned'] += duration
+            intervals.append(Interval(game.pk, game.hunt_start_time, game.hunt_start_time + duration))
+
+    overlaps = [
+        {'games': [first.id, second.id], 'start': overlap_start, 'end': overlap_end}
+        for first, second, overlap_start, overlap_end in find_overlaps(intervals)
+    ]
+    return {'days': list(days.values()), 'overlaps': overlaps}
@@ -0,0 +1,230 @@
+"""
+カタログ（属・種）とGameの履歴のストリーミングでの書き出し・カタログの一括取り込み
+
+書き出しは .iterator() で少しずつ読みながら1行ずつ返すので、件数によらずメモリを使わない。
+カタログのNDJSONは各行に "type"（genus / species）を持ち、種は親より後に並ぶ（深さ順）。
+
+取り込みは元のidから新しいpkへの対応を持ちながらbulk_createで少しずつ書き込み、
+親がまだ書き込まれていない種は親の書き込みを待ってから書き込む（トポロジカル順）。
+行ごとの受信処理は止め、is_leaf_species・推定所要時間の合計は最後に1度だけ求め直す。
+"""
+import csv
+import io
+import json
+from collections import defaultdict, deque
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.dateparse import parse_duration
+
+from . import cache, receivers
+from .models import Genus, Species, Game
+
+CHUNK_SIZE = 2000
+
+RESOURCES = {
+    'genera': (Genus, ('id', 'name', 'description'), ('pk',)),
+    'species': (
+        Species,
+        ('id', 'title', 'description', 'genus_id', 'parent_species_id', 'priority',
+         'estimated_hunting_time', 'is_leaf_species', 'auto_update_estimate'),
+        ('depth', 'pk'),
+    ),
+    'games': (
+        Game,
+        ('id', 'species_id', 'parent_game_id', 'status', 'hunt_start_time', 'deadline',
+         'actual_hunting_time', 'finished_estimate'),
+        ('pk',),
+    ),
+}
+CATALOG = (('genus', 'genera'), ('species', 'species'))
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+_encoder = DjangoJSONEncoder()
+
+
+def iter_rows(resource, queryset=None):
+    """(列名, 行の値のタプルのイテレータ) を返す"""
+    model, columns, ordering = RESOURCES[resource]
+    queryset = model.objects.all() if queryset is None else queryset
+    rows = queryset.order_by(*ordering).values_list(*columns).iterator(chunk_size=CHUNK_SIZE)
+    return columns, rows
+
+
+def to_ndjson(resource, queryset=None, row_type=None):
+    columns, rows = iter_rows(resource, queryset)
+    for row in rows:
+        data = dict(zip(columns, row))
+        if row_type:
+            data = {'type': row_type, **data}
+        yield json.dumps(data, cls=DjangoJSONEncoder) + '\n'
+
+
+def to_csv(resource, queryset=None):
+    columns, rows = iter_rows(resource, queryset)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writerow(columns)
+    yield flush()
+    for row in rows:
+        writer.writerow([
+            '' if value is None else value if isinstance(value, (str, int)) else _encoder.default(value)
+            for value in row
+        ])
+        yield flush()
+
+
+def export(resource, fmt, user=None):
+    """
+    書き出す行（文字列）のイテレータ。resourceが 'catalog' なら属と種を続けて書き出す（NDJSONのみ）
+
+    userを渡すとそのユーザーが所有する行だけを書き出す。
+    """
+    def rows_of(name):
+        model = RESOURCES[name][0]
+        return model.objects.all() if user is None else model.objects.owned_by(user)
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; use one of {', '.join(FORMATS)}.")
+    if resource == 'catalog':
+        if fmt != 'ndjson':
+            raise ValueError('The catalog can only be exported as NDJSON.')
+        return (line for row_type, name in CATALOG for line in to_ndjson(name, rows_of(name), row_type))
+    if resource not in RESOURCES:
+        raise ValueError(f"Unknown resource {resource!r}; use catalog, {', '.join(RESOURCES)}.")
+    writer = to_ndjson if fmt == 'ndjson' else to_csv
+    return writer(resource, rows_of(resource))
+
+
+class CatalogImport:
+    """カタログのNDJSONを取り込む（transaction.atomic()の中で使う）"""
+
+    def __init__(self, chunk_size=CHUNK_SIZE, owner=None):
+        self.chunk_size = chunk_size
+        self.owner = owner
+        self.genus_ids = {}
+        self.species = {}              # 元のid → (新しいpk, path, depth)
+        self.created = {}              # 新しいpk → (親の新しいpk, 推定所要時間)（書き込んだ順）
+        self.ready = deque()           # 親が書き込み済みで、書き込める種
+        self.waiting = defaultdict(list)  # 元の親id → 親の書き込みを待つ種
+        self.pending_genera = []
+
+    def feed(self, line_number, line):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f'Line {line_number}: invalid JSON ({e}).')
+        row_type = row.pop('type', None)
+        if row_type == 'genus':
+            self.pending_genera.append(row)
+            if len(self.pending_genera) >= self.chunk_size:
+                self.flush_genera()
+        elif row_type == 'species':
+            parent = row.get('parent_species_id')
+            if parent is None or parent in self.species:
+                self.ready.append(row)
+            else:
+                self.waiting[parent].append(row)
+            if len(self.ready) >= self.chunk_size:
+                self.flush_species()
+        else:
+            raise ValueError(f'Line {line_number}: unknown row type {row_type!r}.')
+
+    def flush_genera(self):
+        rows, self.pending_genera = self.pending_genera, []
+        genera = Genus.objects.bulk_create([
+            Genus(owner=self.owner, name=row['name'], description=row.get('description') or '') for row in rows
+        ], batch_size=500)
+        for row, genus in zip(rows, genera):
+            self.genus_ids[row['id']] = genus.pk
+
+    def build(self, row):
+        genus = row.get('genus_id')
+        if genus is not None and genus not in self.genus_ids:
+            if self.pending_genera:
+                self.flush_genera()
+            if genus not in self.genus_ids:
+                raise ValueError(f"Species {row['id']} refers to unknown genus {genus}.")
+        species = Species(
+            owner=self.owner,
+            title=row['title'],
+            description=row.get('description') or '',
+            genus_id=self.genus_ids.get(genus),
+            priority=row.get('priority', 1),
+            estimated_hunting_time=parse_duration(str(row.get('estimated_hunting_time') or 0)),
+            auto_update_estimate=row.get('auto_update_estimate', False),
+        )
+        parent = row.get('parent_species_id')
+        if parent is not None:
+            parent_pk, parent_path, parent_depth = self.species[parent]
+            species.parent_species_id = parent_pk
+            species.path = f'{parent_path}{parent_pk}/'
+            species.depth = parent_depth + 1
+        return species
+
+    def flush_species(self):
+        # 書き込んだ種を親に持つ種は次のチャンクで書き込めるようになる
+        while self.ready:
+            rows = [self.ready.popleft() for _ in range(min(self.chunk_size, len(self.ready)))]
+            created = Species.objects.bulk_create([self.build(row) for row in rows], batch_size=500)
+            for row, species in zip(rows, created):
+                self.species[row['id']] = (species.pk, species.path, species.depth)
+                self.created[species.pk] = (species.parent_species_id, species.estimated_hunting_time)
+                self.ready.extend(self.waiting.pop(row['id'], []))
+
+    def finish_trees(self):
+        """
+        取り込んだ種の葉フラグと合計を最後に1度だけ求め直す
+
+        取り込んだ木の親子は全て手元にあるので、既存の種は読まずに書き込んだ種だけを更新する。
+        """
+        parents = {parent for parent, _ in self.created.values() if parent is not None}
+        ordered = sorted(parents)
+        for i in range(0, len(ordered), self.chunk_size):
+            Species.objects.filter(pk__in=ordered[i:i + self.chunk_size]).update(is_leaf_species=False)
+
+        # 子は親より後に書き込んでいるので、逆順にたどれば子の合計が先に求まる
+        totals, drifted = defaultdict(timedelta), []
+        for pk, (parent, estimate) in reversed(self.created.items()):
+            total = totals[pk] if pk in parents else estimate
+            if total != estimate:
+                drifted.append(Species(pk=pk, estimated_hunting_time=total))
+            if parent is not None:
+                totals[parent] += total
+        Species.objects.bulk_update(drifted, ['estimated_hunting_time'], batch_size=500)
+
+    def finish(self):
+        self.flush_genera()
+        self.flush_species()
+        if self.waiting:
+            missing = ', '.join(str(pk) for pk in sorted(self.waiting)[:10])
+            raise ValueError(f'Species refer to parents missing from the catalog: {missing}.')
+
+        self.finish_trees()
+        cache.invalidate('genus', 'species')
+        return {'genera': len(self.genus_ids), 'species': len(self.species)}
+
+
+def import_catalog(lines, chunk_size=CHUNK_SIZE, owner=None):
+    """カタログのNDJSONの行をownerの所有として取り込み、取り込んだ件数を返す（失敗したら何も残さない）"""
+    with transaction.atomic(), receivers.suspended('species'):
+        catalog = CatalogImport(chunk_size, owner)
+        for line_number, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                line = line.decode()
+            catalog.feed(line_number, line)
+        return catalog.finish()
@@ -1,13 +1,30 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import GenusViewSet, SpeciesViewSet, GameViewSet
+from . import async_views
+from .views import (
+    GenusViewSet, SpeciesViewSet, GameViewSet, ArchivedGameViewSet,
+    GenusAnalyticsViewSet, SpeciesAnalyticsViewSet,
+    cache_stats, export_data, game_events, import_catalog,
+)
 
 router = DefaultRouter()
 router.register(r'genera', GenusViewSet)
 router.register(r'species', SpeciesViewSet)
 router.register(r'games', GameViewSet)
+router.register(r'archived_games', ArchivedGameViewSet)
+router.register(r'analytics/species', SpeciesAnalyticsViewSet, basename='species-analytics')
+router.register(r'analytics/genera', GenusAnalyticsViewSet, basename='genus-analytics')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('active_game/', GameViewSet.as_view({'get': 'active'}), name='active_game'),
+    path('events/', game_events, name='game_events'),
+    path('cache_stats/', cache_stats, name='cache_stats'),
+    path('export/<str:resource>.<str:fmt>', export_data, name='export_data'),
+    path('import/catalog/', import_catalog, name='import_catalog'),
+    # 読み取りの多いエンドポイントの非同期版（ASGIで動かすこと）
+    path('async/active_game/', async_views.active_game, name='async_active_game'),
+    path('async/games/', async_views.games, name='async_games'),
+    path('async/species/<int:pk>/tree/', async_views.species_tree, name='async_species_tree'),
+    path('async/genera/<int:pk>/species/', async_views.genus_species, name='async_genus_species'),
 ]
@@ -1,38 +1,219 @@
+import asyncio
+
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from .models import Genus, Species, Game
-from .serializers import GenusSerializer, SpeciesSerializer, GameSerializer
-from datetime import datetime
-from django.db.models import Q
+from . import analytics, archive, events, scheduling, timeline, transfer
+from .cache import cached_read, etag_response, get_read_cache
+from .models import Genus, Species, Game, ArchivedGame, EstimateRollup, owner_of
+from .pagination import GameCursorPagination, IdCursorPagination
+from .serializers import (
+    GenusSerializer, SpeciesSerializer, GameSerializer, ArchivedGameSerializer, serialize_species_tree,
+    GenusAccuracySerializer, SpeciesAccuracySerializer, TimelineDaySerializer, TimelineOverlapSerializer,
+    ScheduleRequestSerializer,
+)
+from rest_framework.exceptions import ValidationError
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import F
+
+
+def parse_time_window(params):
+    """
+    ?date= または ?start=&end= から半開区間 [start, end) を求める
+
+    日付のみのendはその日を含む。どちらも指定されなければNoneを返す。
+    """
+    def parse(name, inclusive_end=False):
+        value = params.get(name)
+        day = parse_date(value)
+        if day is not None:
+            if inclusive_end:
+                day += timedelta(days=1)
+            moment = datetime.combine(day, time.min)
+        else:
+            moment = parse_datetime(value)
+            if moment is None:
+                raise ValidationError({name: 'Enter a valid date (YYYY-MM-DD) or datetime.'})
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+    try:
+        if params.get('date'):
+            start = parse('date')
+            return start, parse('date', inclusive_end=True)
+        if params.get('start') or params.get('end'):
+            if not (params.get('start') and params.get('end')):
+                raise ValidationError({'detail': 'Both start and end are required.'})
+            start, end = parse('start'), parse('end', inclusive_end=True)
+            if end <= start:
+                raise ValidationError({'end': 'end must be after start.'})
+            return start, end
+    except (TypeError, ValueError):
+        raise ValidationError({'detail': 'Invalid date.'})
+    return None
+
+
+def filter_games(queryset, params):
+    """Gameの一覧を ?date= または ?start=&end=、?expired= で絞り込む（非同期版と共通）"""
+    window = parse_time_window(params)
+    if window:
+        # その日（期間）に開始された、または実行中のゲーム
+        queryset = queryset.overlapping(*window)
+
+    expired = params.get('expired')
+    if expired is not None:
+        if expired not in ('true', 'false'):
+            raise ValidationError({'expired': 'Use true or false.'})
+        queryset = queryset.expired(expired == 'true')
+
+    return queryset.order_by('hunt_start_time')
+
+
+class AtomicWriteMixin:
+    """
+    変更系のリクエストを1つのトランザクションで処理するMixin
+
+    保存やシグナルによる書き込みが1回のコミットにまとまり、本番プロファイルでは書き込みロックを
+    BEGIN IMMEDIATEで最初に取る。エラーを返す場合は途中までの書き込みを取り消す。
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        with transaction.atomic():
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code >= 400:
+                transaction.set_rollback(True)
+        return response
+
+
+class OwnedMixin:
+    """
+    行をリクエストしたユーザーが所有するものに限るMixin（未ログインなら所有者なしの行）
+
+    get_querysetではowned()を通し、作成した行はそのユーザーの所有にする。
+    """
+
+    def owned(self, queryset):
+        return queryset.owned_by(self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(owner=owner_of(self.request.user))
+
+
+class SparseFieldsetMixin:
+    """
+    ?fields= によるフィールドの絞り込みとページングを一覧系のアクションに適用するMixin
+
+    絞り込んだ場合はSQLで取得する列も .only() で必要なものだけにする。
+    """
 
+    def get_sparse_fields(self, serializer_class):
+        value = self.request.query_params.get('fields')
+        if self.request.method != 'GET' or not value:
+            return None
+        fields = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = set(fields) - set(serializer_class.get_available_fields())
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}"})
+        return fields
 
-class GenusViewSet(viewsets.ModelViewSet):
+    def restrict_columns(self, queryset, serializer_class, fields):
+        if fields is None:
+            return queryset
+        columns = serializer_class.get_source_columns(fields)
+        # カーソルの位置は並び順の列から作るので必ず取得する
+        paginator = self.paginator
+        if paginator is not None:
+            columns.update(name.lstrip('-') for name in paginator.ordering)
+        relations = {column.split('__')[0] for column in columns if '__' in column}
+        columns.update(relations)
+        return queryset.select_related(None).select_related(*relations).only(*columns)
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_sparse_fields(self.get_serializer_class()))
+        return super().get_serializer(*args, **kwargs)
+
+    def list_response(self, queryset, serializer_class):
+        fields = self.get_sparse_fields(serializer_class)
+        queryset = self.restrict_columns(queryset, serializer_class, fields)
+        page = self.paginate_queryset(queryset)
+        serializer = serializer_class(
+            queryset if page is None else page,
+            many=True,
+            fields=fields,
+            context=self.get_serializer_context(),
+        )
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    def list(self, request, *args, **kwargs):
+        return self.list_response(self.filter_queryset(self.get_queryset()), self.get_serializer_class())
+
+
+class GenusViewSet(AtomicWriteMixin, OwnedMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     ゲームの大分類（属）を管理するViewSet
     """
     queryset = Genus.objects.all()
     serializer_class = GenusSerializer
+    pagination_class = IdCursorPagination
+
+    def get_queryset(self):
+        return self.owned(Genus.objects.all())
+
+    @cached_read('genus')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_read('genus')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     @action(detail=True)
+    @cached_read('genus', 'species')
     def species(self, request, pk=None):
         """特定の属に属する種を取得"""
         genus = self.get_object()
-        species = Species.objects.filter(genus=genus)
-        serializer = SpeciesSerializer(species, many=True)
-        return Response(serializer.data)
+        species = Species.objects.filter(genus=genus).for_serialization()
+        return self.list_response(species, SpeciesSerializer)
+
+    @action(detail=True)
+    @cached_read('genus', 'species')
+    def tree(self, request, pk=None):
+        """属に含まれる種を入れ子の木として取得"""
+        genus = self.get_object()
+        species = Species.objects.filter(genus=genus).for_serialization().order_by('depth', 'pk')
+        return etag_response(request, serialize_species_tree(species))
 
 
-class SpeciesViewSet(viewsets.ModelViewSet):
+class SpeciesViewSet(AtomicWriteMixin, OwnedMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     ゲームの種類を管理するViewSet
     """
     queryset = Species.objects.all()
     serializer_class = SpeciesSerializer
+    pagination_class = IdCursorPagination
+
+    @cached_read('species', 'genus')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_read('species', 'genus')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     def get_queryset(self):
-        queryset = Species.objects.all()
+        queryset = self.owned(Species.objects.for_serialization())
         genus = self.request.query_params.get('genus', None)
         parent_species = self.request.query_params.get('parent_species', None)
 
@@ -47,76 +228,58 @@ class SpeciesViewSet(viewsets.ModelViewSet):
         return queryset
 
     @action(detail=True)
+    @cached_read('species', 'game')
     def games(self, request, pk=None):
         """特定の種に属するゲームインスタンスを取得"""
         species = self.get_object()
-        games = Game.objects.filter(species=species)
-        serializer = GameSerializer(games, many=True)
-        return Response(serializer.data)
+        games = Game.objects.filter(species=species).for_serialization()
+        return self.list_response(games, GameSerializer)
 
     @action(detail=True)
+    @cached_read('species', 'genus')
     def subspecies(self, request, pk=None):
         """子種を取得"""
         species = self.get_object()
-        subspecies = Species.objects.filter(parent_species=species)
-        serializer = SpeciesSerializer(subspecies, many=True)
-        return Response(serializer.data)
+        subspecies = Species.objects.filter(parent_species=species).for_serialization()
+        return self.list_response(subspecies, SpeciesSerializer)
+
+    @action(detail=True)
+    @cached_read('species', 'genus')
+    def tree(self, request, pk=None):
+        """子孫を含む部分木を入れ子の木として取得"""
+        species = self.get_object()
+        subtree = Species.objects.subtree_of(species).for_serialization().order_by('depth', 'pk')
+        return etag_response(request, serialize_species_tree(subtree)[0])
 
 
-class GameViewSet(viewsets.ModelViewSet):
+class GameViewSet(AtomicWriteMixin, OwnedMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     個別のゲームインスタンスを管理するViewSet
     """
     queryset = Game.objects.all()
     serializer_class = GameSerializer
+    pagination_class = GameCursorPagination
 
     def create(self, request, *args, **kwargs):
-        # 親Gameを作成
-        response = super().create(request, *args, **kwargs)
-        parent_game = Game.objects.get(id=response.data['id'])
-        parent_species = parent_game.species
-
-        # 子Speciesが存在する場合、子Gameも作成
-        def create_child_games(parent_game, parent_species):
-            for child_species in parent_species.subspecies.all():
-                child_game = Game.objects.create(
-                    species=child_species,
-                    parent_game=parent_game,
-                    hunt_start_time=parent_game.hunt_start_time,
-                    status='NOT_STARTED'
-                )
-                # さらに子がいれば再帰的に作成
-                if not child_species.is_leaf_species:
-                    create_child_games(child_game, child_species)
+        with transaction.atomic():
+            # 親Gameを作成
+            response = super().create(request, *args, **kwargs)
+            parent_game = Game.objects.get(id=response.data['id'])
 
-        if not parent_species.is_leaf_species:
-            create_child_games(parent_game, parent_species)
+            # 子Speciesが存在する場合、子孫Gameをまとめて作成
+            if not parent_game.species.is_leaf_species:
+                parent_game.instantiate_subtree()
 
         # 更新されたデータを返す
-        updated_game = Game.objects.get(id=parent_game.id)
-        return Response(self.serializer_class(updated_game).data)
+        return Response(self.serializer_class(parent_game).data)
 
     def get_queryset(self):
-        queryset = Game.objects.all()
-        date_str = self.request.query_params.get('date', None)
-
-        if date_str:
-            # 指定された日付の0時から24時までの範囲で検索
-            target_date = datetime.strptime(date_str, '%Y-%m-%d')
-            start_of_day = timezone.make_aware(target_date)
-            end_of_day = timezone.make_aware(target_date.replace(hour=23, minute=59, second=59))
-
-            queryset = queryset.filter(
-                Q(hunt_start_time__date=target_date) |  # その日に開始されたゲーム
-                Q(hunt_start_time__lte=end_of_day, deadline__gte=start_of_day)  # その日に実行中のゲーム
-            )
-
-        return queryset.order_by('hunt_start_time')
+        return filter_games(self.owned(Game.objects.for_serialization()), self.request.query_params)
 
     @action(detail=False)
     def active(self, request):
         """現在アクティブなゲームを取得"""
-        active_game = Game.objects.filter(is_active=True).first()
+        active_game = self.owned(Game.objects.for_serialization()).active()
         if active_game:
             serializer = GameSerializer(active_game)
             return Response(serializer.data)
@@ -125,6 +288,137 @@ class GameViewSet(viewsets.ModelViewSet):
             status=status.HTTP_404_NOT_FOUND
         )
 
+    @action(detail=False)
+    def timeline(self, request):
+        """?start=&end=（または ?date=）の期間に開始するゲームを日ごとにまとめ、予定の重なりを返す"""
+        window = parse_time_window(request.query_params)
+        if window is None:
+            raise ValidationError({'detail': 'Specify date or start and end.'})
+        start, end = window
+        max_days = timeline.get_setting('MAX_DAYS')
+        if len(timeline.days_between(start, end)) > max_days:
+            raise ValidationError({'end': f'The timeline can cover at most {max_days} days.'})
+
+        # 期間内に開始したゲームを1回の範囲検索で取得する
+        games = self.owned(Game.objects.for_serialization()).filter(
+            hunt_start_time__gte=start, hunt_start_time__lt=end,
+        ).order_by('hunt_start_time', 'pk')
+        result = timeline.build_timeline(games, start, end)
+        return Response({
+            'start': start,
+            'end': end,
+            'days': TimelineDaySerializer(result['days'], many=True).data,
+            'overlaps': TimelineOverlapSerializer(result['overlaps'], many=True).data,
+        })
+
+    @action(detail=False, methods=['patch'])
+    def bulk(self, request):
+        """複数のゲームをまとめて部分更新（1件ごとの検証エラーはerrorsで返す）"""
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({'detail': 'Expected a list of partial updates.'})
+
+        def valid_id(item):
+            pk = item.get('id') if isinstance(item, dict) else None
+            return isinstance(pk, int) and not isinstance(pk, bool)
+
+        games = self.owned(Game.objects.select_related('species')).in_bulk(
+            [item['id'] for item in items if valid_id(item)]
+        )
+
+        changes, errors, seen = [], [], set()
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                errors.append({'index': index, 'id': None, 'errors': {'non_field_errors': ['Expected an object.']}})
+                continue
+            pk = item.get('id')
+            if not valid_id(item):
+                errors.append({'index': index, 'id': pk, 'errors': {'id': ['A valid integer is required.']}})
+                continue
+            if pk not in games or pk in seen:
+                reason = 'Duplicate id.' if pk in seen else 'Game not found.'
+                errors.append({'index': index, 'id': pk, 'errors': {'id': [reason]}})
+                continue
+            seen.add(pk)
+
+            data = {name: value for name, value in item.items() if name not in ('id', 'is_active')}
+            serializer = GameSerializer(games[pk], data=data, partial=True, context=self.get_serializer_context())
+            if not serializer.is_valid():
+                errors.append({'index': index, 'id': pk, 'errors': serializer.errors})
+            elif serializer.validated_data.get('status') == 'HUNTING' and games[pk].status != 'HUNTING':
+                errors.append({'index': index, 'id': pk, 'errors': {
+                    'status': ['Start a hunt with start_hunting instead of a bulk update.']
+                }})
+            else:
+                changes.append((games[pk], serializer.validated_data))
+
+        if changes:
+            Game.objects.apply_changes(changes)
+        updated = Game.objects.for_serialization().filter(
+            pk__in=[game.pk for game, _ in changes]
+        ).order_by('hunt_start_time', 'pk')
+        return Response(
+            {'results': GameSerializer(updated, many=True).data, 'errors': errors},
+            status=status.HTTP_400_BAD_REQUEST if errors and not changes else status.HTTP_200_OK,
+        )
+
+    @action(detail=False, methods=['post'])
+    def schedule(self, request):
+        """優先度と期限から日の計画を自動で組み立てる（dry_runなら保存しない）"""
+        # 本文がオブジェクトでなければここで400にする（期間はその後で読む）
+        options = ScheduleRequestSerializer(data=request.data)
+        options.is_valid(raise_exception=True)
+        game_ids, dry_run = options.validated_data.get('game_ids'), options.validated_data['dry_run']
+        window = parse_time_window(request.data)
+        if window is None:
+            raise ValidationError({'detail': 'Specify date or start and end.'})
+        start, end = max(window[0], timezone.now()), window[1]
+
+        # 候補は未完了の葉Game（game_idsで絞り込める）
+        games = self.owned(Game.objects.for_serialization()).filter(
+            has_child_games=False, status__in=['NOT_STARTED', 'PENDING']
+        )
+        if game_ids is not None:
+            games = games.filter(pk__in=game_ids)
+        games = {game.pk: game for game in games}
+
+        slots, unscheduled = scheduling.build_plan(
+            (
+                scheduling.Job(
+                    game.pk, game.estimated_hunting_time,
+                    # 開始時刻から求めた期限は予定を動かせば一緒に動くので、期限として扱わない
+                    None if game.deadline_is_derived else game.deadline,
+                    game.species.priority,
+                )
+                for game in games.values()
+            ),
+            start,
+            end,
+        )
+
+        if not dry_run:
+            Game.objects.apply_changes([
+                (games[slot.job.id], {'hunt_start_time': slot.start}) for slot in slots
+            ])
+
+        return Response({
+            'start': start,
+            'end': end,
+            'dry_run': dry_run,
+            'scheduled': [
+                {
+                    'id': slot.job.id,
+                    'species_title': games[slot.job.id].species.title,
+                    'priority': slot.job.priority,
+                    'hunt_start_time': slot.start,
+                    'end_time': slot.end,
+                    'deadline': games[slot.job.id].deadline,
+                }
+                for slot in slots
+            ],
+            'unscheduled': [{'id': job.id, 'reason': reason} for job, reason in unscheduled],
+        })
+
     @action(detail=True, methods=['post'])
     def start_hunting(self, request, pk=None):
         """狩猟を開始"""
@@ -156,3 +450,160 @@ class GameViewSet(viewsets.ModelViewSet):
         game.save()
         serializer = GameSerializer(game)
         return Response(serializer.data)
+
+
+class ArchivedGameViewSet(AtomicWriteMixin, OwnedMixin, SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    アーカイブされたGameを参照するViewSet（?date= または ?start=&end=、?species= で絞り込める）
+    """
+    queryset = ArchivedGame.objects.all()
+    serializer_class = ArchivedGameSerializer
+    pagination_class = GameCursorPagination
+
+    def get_queryset(self):
+        queryset = self.owned(ArchivedGame.objects.select_related('species'))
+        window = parse_time_window(self.request.query_params)
+        if window:
+            queryset = queryset.filter(hunt_start_time__gte=window[0], hunt_start_time__lt=window[1])
+        species = self.request.query_params.get('species')
+        if species:
+            queryset = queryset.filter(species_id=species)
+        return queryset.order_by('hunt_start_time')
+
+    @action(detail=True, methods=['post'])
+    def restore(self, request, pk=None):
+        """このGameを含む木全体をGameへ戻す"""
+        archived = self.get_object()
+        game = archive.restore_tree(archived.root_id)
+        return Response(GameSerializer(Game.objects.for_serialization().get(pk=game.pk)).data)
+
+
+class AnalyticsMixin:
+    """
+    推定所要時間の精度の集計行を ?period=（day/week/month、既定はweek）と
+    ?date= または ?start=&end= で絞り込むMixin
+    """
+
+    def get_rollups(self):
+        params = self.request.query_params
+        period = params.get('period', 'week')
+        if period not in analytics.PERIODS:
+            raise ValidationError({'period': f"Choose one of {', '.join(analytics.PERIODS)}."})
+        rollups = EstimateRollup.objects.filter(period=period, species__owner=owner_of(self.request.user))
+
+        window = parse_time_window(params)
+        if window:
+            start, end = (timezone.localdate(moment) for moment in window)
+            rollups = rollups.filter(
+                bucket_start__gte=analytics.bucket_start(period, start),
+                bucket_start__lt=end,
+            )
+        return rollups
+
+    def report(self, rows, key, serializer_class):
+        report = analytics.summarize(rows, key)
+        report.sort(key=lambda row: (row.get('genus') or 0, row.get('species', 0), row['bucket_start']))
+        return Response(serializer_class(report, many=True).data)
+
+
+class SpeciesAnalyticsViewSet(AnalyticsMixin, viewsets.ViewSet):
+    """種ごとの推定所要時間の精度（詳細は子孫の種を含めて集計する）"""
+
+    @cached_read('analytics', 'species')
+    def list(self, request):
+        return self.report(
+            self.get_rollups(),
+            lambda row: (('species', row.species_id), ('period', row.period), ('bucket_start', row.bucket_start)),
+            SpeciesAccuracySerializer,
+        )
+
+    @cached_read('analytics', 'species')
+    def retrieve(self, request, pk=None):
+        species = get_object_or_404(Species.objects.owned_by(request.user), pk=pk)
+        rows = self.get_rollups().filter(species__in=Species.objects.subtree_of(species))
+        return self.report(
+            rows,
+            lambda row: (('species', species.pk), ('period', row.period), ('bucket_start', row.bucket_start)),
+            SpeciesAccuracySerializer,
+        )
+
+
+class GenusAnalyticsViewSet(AnalyticsMixin, viewsets.ViewSet):
+    """属ごとの推定所要時間の精度（属に含まれる種の集計行を足し合わせる）"""
+
+    def get_rollups(self):
+        return super().get_rollups().annotate(genus_id=F('species__genus_id'))
+
+    @staticmethod
+    def key(row):
+        return (('genus', row.genus_id), ('period', row.period), ('bucket_start', row.bucket_start))
+
+    @cached_read('analytics', 'species')
+    def list(self, request):
+        return self.report(self.get_rollups(), self.key, GenusAccuracySerializer)
+
+    @cached_read('analytics', 'species')
+    def retrieve(self, request, pk=None):
+        genus = get_object_or_404(Genus.objects.owned_by(request.user), pk=pk)
+        return self.report(self.get_rollups().filter(species__genus=genus), self.key, GenusAccuracySerializer)
+
+
+@api_view(['GET'])
+def cache_stats(request):
+    """読み取りキャッシュのヒット数・ミス数"""
+    return Response(get_read_cache().stats())
+
+
+@api_view(['GET'])
+def export_data(request, resource, fmt):
+    """ユーザーの属・種・Game・カタログをNDJSON/CSVで少しずつ書き出す"""
+    try:
+        rows = transfer.export(resource, fmt, user=request.user)
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_404_NOT_FOUND)
+    response = StreamingHttpResponse(rows, content_type=transfer.FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{resource}.{fmt}"'
+    return response
+
+
+@api_view(['POST'])
+def import_catalog(request):
+    """カタログのNDJSON（export/catalog.ndjsonの形式）を本文から1行ずつ読んでユーザーの所有として取り込む"""
+    if request.stream is None:
+        return Response({'detail': 'Request body is empty.'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        counts = transfer.import_catalog(request.stream, owner=owner_of(request.user))
+    except (KeyError, TypeError, ValueError) as e:
+        return Response({'detail': f'Import failed: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(counts, status=status.HTTP_201_CREATED)
+
+
+async def game_events(request):
+    """Gameの変更をServer-Sent Eventsで配信（ASGIで動かすこと。ユーザーの所有するGameの変更だけを送る）"""
+    if not isinstance(request, ASGIRequest):
+        # WSGIでは接続ごとにワーカーのスレッドを占有し続けるので配信しない（クライアントはポーリングに戻る）
+        return JsonResponse({'detail': 'The event stream needs the ASGI application.'}, status=501)
+    owner = owner_of(await request.auser())
+    owner_id = owner.pk if owner is not None else None
+    broker = events.get_broker()
+    heartbeat = events.get_setting('HEARTBEAT')
+
+    async def stream():
+        subscription = broker.subscribe()
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = await subscription.get(timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if event.get('owner') == owner_id:
+                    yield events.format_sse(event)
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -10,6 +10,9 @@ import { Game, GameStatus } from '@/types/game';
 
 dayjs.extend(duration);
 
+// 変更の通知を受けられない場合に、アクティブなゲームを取得し直す間隔
+const POLL_INTERVAL_MS = 30000;
+
 interface FocusProps {
   onStatusChange: (gameId: number, newStatus: GameStatus) => void;
 }
@@ -31,6 +34,15 @@ export default function Focus({ onStatusChange }: FocusProps) {
 
   React.useEffect(() => {
     fetchActiveGame();
+    // 他の端末での切り替えもサーバーからの通知で反映する（通知を受けられなければ定期的に取得し直す）
+    let poller: ReturnType<typeof setInterval> | undefined;
+    const unsubscribe = gameApi.subscribe('active.changed', () => fetchActiveGame(), () => {
+      poller = setInterval(fetchActiveGame, POLL_INTERVAL_MS);
+    });
+    return () => {
+      unsubscribe();
+      clearInterval(poller);
+    };
   }, []);
 
   React.useEffect(() => {
@@ -1,4 +1,4 @@
-const BASE_URL = 'http://localhost:8000/api';
+export const BASE_URL = 'http://localhost:8000/api';
 
 export const apiClient = async (endpoint: string, options: RequestInit = {}) => {
   const response = await fetch(`${BASE_URL}${endpoint}`, {
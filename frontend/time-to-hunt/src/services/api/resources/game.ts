@@ -1,10 +1,12 @@
-import { apiClient } from '@/services/api/client';
-import { GameCreate, GameUpdate } from '@/types/game';
+import { apiClient, BASE_URL } from '@/services/api/client';
+import { GameCreate, GameUpdate, Timeline } from '@/types/game';
 
 export const gameApi = {
   getAll: () => apiClient('/games/'),
   getByDate: (date: string) => apiClient(`/games/?date=${date}`),
   getActive: () => apiClient('/active_game/'),
+  getTimeline: (start: string, end: string): Promise<Timeline> =>
+    apiClient(`/games/timeline/?start=${start}&end=${end}`),
   create: (data: GameCreate) => 
     apiClient('/games/', { 
       method: 'POST', 
@@ -15,8 +17,27 @@ export const gameApi = {
       method: 'PATCH', 
       body: JSON.stringify(data) 
     }),
+  bulkUpdate: (updates: (GameUpdate & { id: number })[]) =>
+    apiClient('/games/bulk/', { 
+      method: 'PATCH', 
+      body: JSON.stringify(updates) 
+    }),
+  schedule: (date: string, dryRun: boolean = false) =>
+    apiClient('/games/schedule/', { 
+      method: 'POST', 
+      body: JSON.stringify({ date, dry_run: dryRun }) 
+    }),
   delete: (id: number) =>
     apiClient(`/games/${id}/`, { 
       method: 'DELETE' 
     }),
+  // 配信できないサーバー（WSGIで動いている場合など）では接続が閉じられ、onUnavailableが呼ばれる
+  subscribe: (eventType: string, onEvent: (data: any) => void, onUnavailable?: () => void) => {
+    const source = new EventSource(`${BASE_URL}/events/`);
+    source.addEventListener(eventType, (event) => onEvent(JSON.parse((event as MessageEvent).data)));
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) onUnavailable?.();
+    };
+    return () => source.close();
+  },
 };
@@ -1,5 +1,6 @@
 export interface Game {
     id: number;
+    owner?: number | null;
     species: number;
     species_title?: string;
     species_parent_species?: number;
@@ -10,9 +11,11 @@ export interface Game {
     is_active: boolean;
     is_leaf_game: boolean;
     deadline?: string;
+    deadline_is_derived?: boolean;
     estimated_hunting_time?: string;
     remaining_time?: string;
     is_expired?: boolean;
+    is_overdue?: boolean;
     created_at: string;
     updated_at: string;
 }
@@ -23,4 +26,23 @@ export interface GameCreate {
 
 export type GameUpdate = Partial<Game>;
 
-export type GameStatus = 'NOT_STARTED' | 'HUNTING' | 'PENDING' | 'CAPTURED' | 'ESCAPED';
\ No newline at end of file
+export type GameStatus = 'NOT_STARTED' | 'HUNTING' | 'PENDING' | 'CAPTURED' | 'ESCAPED';
+export interface TimelineDay {
+    date: string;
+    planned: string;
+    available: string;
+    games: Game[];
+}
+
+export interface TimelineOverlap {
+    games: [number, number];
+    start: string;
+    end: string;
+}
+
+export interface Timeline {
+    start: string;
+    end: string;
+    days: TimelineDay[];
+    overlaps: TimelineOverlap[];
+}
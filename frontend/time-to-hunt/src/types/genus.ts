@@ -1,5 +1,6 @@
 export interface Genus {
     id: number;
+    owner?: number | null;
     name: string;
     description: string;
     created_at: string;
@@ -7,6 +7,8 @@ export interface Species {
     parent_species?: number;
     priority: number;
     estimated_hunting_time: string;
+    suggested_estimate: string | null;
+    auto_update_estimate: boolean;
     is_leaf_species: boolean;
     created_at: string;
     updated_at: string;